@@ -1,11 +1,68 @@
-import yaml
+import os
+import base64
+import csv
+import io
+import atexit
+import logging
+import json
+import math
 import sqlite3
+import threading
+import time
 from datetime import datetime
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, Response, make_response, render_template, request, jsonify
+from werkzeug.exceptions import HTTPException, NotFound
+import heapq
 import importlib
+import queue
+import zlib
+from itertools import islice
 
-from sensor import init_db, store_reading
-from controller import set_fan, set_light
+import settings
+from sensor import store_reading
+from storage import (SPLIT, init_db, get_connection, device_series,
+                     page_samples, recent_samples, series_names,
+                     to_epoch_ms, ms_to_iso, now_ms)
+from latest import latest
+from events import bus
+from render_cache import render_cache
+from control_engine import engine
+from tuya_pool import pool
+from plug_poller import poller, tuya_devices
+from binary_ingest import listener, ingest_keys
+import retention
+import outbox
+from lease import Lease
+from write_behind import writer, QueueFull, BatchTooLarge
+from metrics import registry
+from profiling import profiler
+import logs
+
+log = logging.getLogger(__name__)
+
+scheduler_misfires_total = registry.counter(
+    'growlab_scheduler_misfires_total', "Scheduled runs that were missed or skipped.",
+    labels=('job', 'reason'))
+scheduler_errors_total = registry.counter(
+    'growlab_scheduler_errors_total', "Scheduled runs that raised.", labels=('job',))
+config_reloads_total = registry.counter(
+    'growlab_config_reloads_total', "config.yaml reloads by outcome.", labels=('result',))
+ingest_requests_total = registry.counter(
+    'growlab_ingest_requests_total', "Ingest requests by HTTP status.", labels=('code',))
+ingest_seconds = registry.histogram(
+    'growlab_ingest_request_seconds', "Ingest request handling time.")
+ingest_records = registry.histogram(
+    'growlab_ingest_records', "Records per ingest request.",
+    buckets=(1, 5, 10, 50, 100, 500, 1000, 5000, 10000))
+ingest_bytes = registry.histogram(
+    'growlab_ingest_bytes', "Ingest request body size.",
+    buckets=(256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304))
+
+# How often requests check config.yaml for edits
+RELOAD_CHECK_S = 1.0
+
+# Lease that elects the one collector/controller process (daemon.py)
+COLLECTOR_LEASE = 'collector'
 
 app = Flask(__name__)
 
@@ -14,113 +71,733 @@ app = Flask(__name__)
 def inject_now():
     return {"now": datetime.utcnow}
 
-def load_config():
-    with open('config.yaml') as f:
-        return yaml.safe_load(f)
-
-# — apply config & init DB/scheduler —
-config = load_config()
+# The shared config; a reload updates this same dict in place
+config = settings.cfg
 app.config.update(config)
-init_db()
+# Opt-in phase timing, slow-query log and /api/diagnostic/profile
+profiler.init_app(app)
+
+# — widgets —
+
+def widget_class(wcfg):
+    """Import a widget's module (on first use only) and return its class."""
+    module = importlib.import_module(wcfg['module'])
+    return getattr(module, wcfg['class'])
+
+def build_widgets(config):
+    """
+    Instantiate the widgets of one version of the config on a Flask app
+    of their own, which carries only their routes. Nothing is shared with
+    the running widgets, so a config reload can build the new set first
+    and swap it in at once. Widget modules are imported here, so a kind
+    that no device or page uses is never imported.
+    Returns (widget_app, widgets).
+    """
+    widget_app = Flask(__name__, static_folder=None)
+    widget_app.config.update(config)
+    widget_app.context_processor(inject_now)
+    profiler.instrument(widget_app)
+
+    widgets = []
+    # Which widget names are device-scoped?
+    device_widget_names = {dev['widget'] for dev in config['devices']}
+
+    # 1) Device-scoped widgets
+    for dev in config['devices']:
+        wcfg = config['widgets'][dev['widget']]
+        widgets.append(widget_class(wcfg)(widget_app, wcfg, device_info=dev))
+
+    # 2) Global widgets (not tied to any device); a device-scoped kind
+    # with no device configured is skipped
+    for name, wcfg in config['widgets'].items():
+        if name not in device_widget_names and wcfg.get('scope') != 'device':
+            widgets.append(widget_class(wcfg)(widget_app, wcfg))
+
+    # Widgets look each other up through this (e.g. controls → devices)
+    widget_app.config['_widgets'] = widgets
+    return widget_app, widgets
+
+def control_rules(widgets):
+    """{control_id: (config, actuate)} of the control widgets in a widget set."""
+    return {w.widget_id: w.engine_rule() for w in widgets if hasattr(w, 'engine_rule')}
+
+# Built by start(), replaced by reload_config()
+widget_app = None
+widgets = []
+
+def dispatch(environ, start_response):
+    """
+    WSGI entry point in front of the core routes: requests for a widget
+    route go to the current widget app, everything else to this app.
+    """
+    start()
+    reload_if_changed()
+    current = widget_app
+    if current is not None:
+        try:
+            current.url_map.bind_to_environ(environ).match()
+        except NotFound:
+            pass
+        except HTTPException:
+            # 405 or a redirect for one of its routes
+            return current(environ, start_response)
+        else:
+            return current(environ, start_response)
+    return core_wsgi_app(environ, start_response)
+
+core_wsgi_app = app.wsgi_app
+app.wsgi_app = dispatch
+
+# — config reload —
+
+_reload_lock = threading.Lock()
+_next_reload_check = 0.0
+
+def reload_config():
+    """
+    Re-read config.yaml and rebuild the widgets and their routes without
+    a restart. The new widgets are built before anything is replaced, so
+    a broken file leaves the running config in place (and raises).
+    Settings read once at startup (database, storage, retention, logging,
+    profiling) still need a restart.
+    """
+    global widget_app, widgets
+    stamp = settings.mtime()
+    fresh = settings.read()
+    new_app, new_widgets = build_widgets(fresh)
+    rules = control_rules(new_widgets)
+
+    # Nothing below can fail on a bad config; swap everything in
+    stale = set(config) - set(fresh)
+    settings.apply(fresh, stamp)
+    for key in stale:
+        if key in app.default_config:
+            app.config[key] = app.default_config[key]
+        else:
+            app.config.pop(key, None)
+    app.config.update(config)
+    widget_app, widgets = new_app, new_widgets
+    engine.replace_all(rules)
+    render_cache.invalidate()
+
+    engine.sweep_interval_s = config.get('controls', {}).get('sweep_interval_s', 60)
+    poller.set_devices(tuya_devices(config))
+    listener.set_keys(ingest_keys(config))
+    interval = config['schedule']['reading_interval_s']
+    job = sched.get_job('store_reading')
+    if job is not None and job.trigger.interval.total_seconds() != interval:
+        sched.reschedule_job('store_reading', trigger='interval', seconds=interval)
+    log.info("Reloaded config.yaml: %d widgets", len(widgets))
+
+def reload_if_changed():
+    """Reload the config if config.yaml changed, checking at most every RELOAD_CHECK_S."""
+    global _next_reload_check
+    now = time.monotonic()
+    if now < _next_reload_check:
+        return
+    _next_reload_check = now + RELOAD_CHECK_S
+    if not settings.changed() or not _reload_lock.acquire(blocking=False):
+        return
+    try:
+        if settings.changed():
+            reload_config()
+            config_reloads_total.inc(result="ok")
+    except Exception as e:
+        config_reloads_total.inc(result="error")
+        log.error("Config reload failed, keeping the running config: %s", e)
+    finally:
+        _reload_lock.release()
+
+# — startup —
 
 from apscheduler.schedulers.background import BackgroundScheduler
+from apscheduler.events import EVENT_JOB_ERROR, EVENT_JOB_MAX_INSTANCES, EVENT_JOB_MISSED
 sched = BackgroundScheduler()
-sched.add_job(store_reading, 'interval',
-              seconds=config['schedule']['reading_interval_s'])
-sched.start()
 
-# Dynamically instantiate all widgets
-widgets = []
-# Which widget names are device-scoped?
-device_widget_names = {dev['widget'] for dev in config['devices']}
+def on_scheduler_event(event):
+    """Count scheduler misfires (missed or overlapping runs) and job errors."""
+    if event.code == EVENT_JOB_MISSED:
+        scheduler_misfires_total.inc(job=event.job_id, reason="missed")
+    elif event.code == EVENT_JOB_MAX_INSTANCES:
+        scheduler_misfires_total.inc(job=event.job_id, reason="max_instances")
+    elif event.code == EVENT_JOB_ERROR:
+        scheduler_errors_total.inc(job=event.job_id)
+        log.error("Scheduled job %s failed: %s", event.job_id, event.exception)
 
-# 1) Device-scoped widgets
-for dev in config['devices']:
-    wcfg   = config['widgets'][dev['widget']]
-    module = importlib.import_module(wcfg['module'])
-    cls    = getattr(module, wcfg['class'])
-    widgets.append(cls(app, wcfg, device_info=dev))
+_started = False
+_start_lock = threading.Lock()
+
+def start(background=True):
+    """
+    Bring the app up: logging, the database, the latest-value cache and
+    the widgets, then (with background=True) the scheduler and the
+    control engine. Importing this module does none of this, so tools can
+    import it cheaply. `python app.py` calls start() before serving; under
+    another WSGI server the first request does. Idempotent.
+
+    In split mode (process.mode in config.yaml) the background work
+    belongs to daemon.py, so this only starts following the event outbox
+    and the web tier stays free to run as many workers as it likes.
+    """
+    global _started, widget_app, widgets
+    if _started:
+        return
+    with _start_lock:
+        if _started:
+            return
+        logs.configure(config.get('logging'))
+        init_db()
+        latest.load_from_db(get_connection())
+        widget_app, widgets = build_widgets(config)
+        engine.replace_all(control_rules(widgets))
+
+        if SPLIT:
+            # Plug states polled by the collector fill this process's cache
+            outbox.tail.on('plug_state', poller.remember)
+            outbox.tail.start()
+        elif background:
+            start_background()
+
+        # Commit anything still queued for write-behind before the process exits
+        atexit.register(writer.stop)
+        _started = True
+
+def collect():
+    """The scheduled sensor read, skipped while the collector lease has lapsed."""
+    if not outbox.may_drive():
+        log.warning("Skipping sensor collection: this collector's lease has lapsed")
+        return
+    store_reading()
+
+def start_background():
+    """
+    Start what must run in exactly one process: sensor collection,
+    retention, the control engine, plug state polling and the binary
+    ingest listener (plus outbox pruning in split mode).
+    """
+    sched.add_listener(on_scheduler_event,
+                       EVENT_JOB_MISSED | EVENT_JOB_MAX_INSTANCES | EVENT_JOB_ERROR)
+    sched.add_job(collect, 'interval', id='store_reading',
+                  seconds=config['schedule']['reading_interval_s'])
+    # Archive and delete data past its retention, in small batches
+    sched.add_job(retention.compact, 'interval', id='compact',
+                  seconds=retention.INTERVAL_S)
+    if SPLIT:
+        sched.add_job(outbox.prune, 'interval', id='outbox_prune', seconds=60)
+    sched.start()
 
-# 2) Global widgets (not tied to any device)
-for name, wcfg in config['widgets'].items():
-    if name not in device_widget_names:
-        module = importlib.import_module(wcfg['module'])
-        cls    = getattr(module, wcfg['class'])
-        widgets.append(cls(app, wcfg))
+    # One engine evaluates every control rule as readings are committed
+    engine.sweep_interval_s = config.get('controls', {}).get('sweep_interval_s', 60)
+    engine.start()
+
+    # Ask the plugs what they are actually doing, off the request path
+    poller.start(tuya_devices(config))
+
+    # Compact UDP/TCP ingest for remote sensors, if enabled
+    listener.start(ingest_keys(config))
+
+def render_widget(w):
+    """Rendered HTML of one widget, from the render cache when possible."""
+    html, _ = render_cache.get(('widget', id(w)), w.render)
+    return html
+
+def cached_page(key, render):
+    """
+    Serve cached page HTML with ETag / Last-Modified validators, answering
+    304 Not Modified when the browser already has this version. The cache
+    is cleared when config.yaml (or a control config) changes.
+    """
+    html, etag = render_cache.get(key, render)
+    response = make_response(html)
+    response.set_etag(etag)
+    response.last_modified = datetime.utcfromtimestamp(int(render_cache.last_modified))
+    response.headers['Cache-Control'] = 'no-cache'
+    return response.make_conditional(request)
 
 @app.route('/')
 def dashboard():
-    # Build a list of {id, html} so we know which widget this is
-    widget_items = []
+    def render():
+        # Build a list of {id, html} so we know which widget this is
+        widget_items = []
+        for w in widgets:
+            wid = getattr(w, 'device_info', {}).get('id', '')
+            html = render_widget(w)
+            widget_items.append({'id': wid, 'html': html})
+        return render_template('base.html', widgets=widget_items, config=config)
+    return cached_page(('page', 'dashboard'), render)
+
+@app.route('/api/dashboard/snapshot')
+def dashboard_snapshot():
+    """
+    Data for every configured widget in one response, so the page can
+    hydrate with a single round trip. Widgets of the same class are fetched
+    together through get_batch_data(), which batches their queries.
+    Accepts the sensor-data options range= and points=, checked the same way.
+    """
+    # Imported here so startup still loads only the configured widget modules
+    from widgets.sensor import RANGES, MAX_POINTS_PARAM
+
+    options = {"range_key": request.args.get('range', '24h')}
+    if options["range_key"] not in RANGES:
+        return jsonify({"error": f"range must be one of {', '.join(RANGES)}"}), 400
+    if 'points' in request.args:
+        points = request.args.get('points', type=int)
+        if points is None or not 3 <= points <= MAX_POINTS_PARAM:
+            return jsonify({"error": f"points must be between 3 and {MAX_POINTS_PARAM}"}), 400
+        options["points"] = points
+
+    by_class = {}
     for w in widgets:
-        wid = getattr(w, 'device_info', {}).get('id', '')
-        html = w.render()
-        widget_items.append({'id': wid, 'html': html})
-    return render_template('base.html', widgets=widget_items, config=config)
+        by_class.setdefault(type(w), []).append(w)
+
+    data = {}
+    for cls, members in by_class.items():
+        try:
+            data.update(cls.get_batch_data(members, **options))
+        except Exception as e:
+            log.error("Error building snapshot for %s: %s", cls.__name__, e)
+    return jsonify({"ts": datetime.utcnow().isoformat(), "widgets": data})
 
 # — generic ingest endpoint —
 @app.route('/api/ingest', methods=['POST'])
 def api_ingest():
-    payload   = request.get_json(force=True)
-    device_id = payload.get('device_id')
-    ts        = payload.get('ts')
+    """
+    Accept one reading object, a JSON array of readings, or an NDJSON body
+    (one reading object per line). Batches are validated in one pass and
+    written in a single transaction; the response reports a status per
+    record so the client knows which ones to retry.
+    """
+    with ingest_seconds.time():
+        response = make_response(ingest())
+    ingest_requests_total.inc(code=response.status_code)
+    ingest_bytes.observe(request.content_length or 0)
+    return response
+
+def ingest():
+    try:
+        records, batch = parse_ingest_body(request)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    ingest_records.observe(len(records))
+
+    results  = []
+    accepted = []
+    for index, record in enumerate(records):
+        try:
+            accepted.append(validate_ingest_record(record))
+            results.append({"index": index, "status": "ok"})
+        except ValueError as e:
+            results.append({"index": index, "status": "error", "error": str(e)})
+
+    if accepted:
+        try:
+            write_readings(accepted)
+        except QueueFull as e:
+            # Write-behind queue is full: tell the client to back off
+            body = {"error": "write queue full", "retry_after_s": e.retry_after_s}
+            if batch:
+                body["results"] = results
+                for res in results:
+                    if res["status"] == "ok":
+                        res.update(status="error", error="queue full", retry=True)
+            return jsonify(body), 429, {"Retry-After": str(e.retry_after_s)}
+        except BatchTooLarge as e:
+            # More samples than the queue holds at all: the client must split
+            body = {"error": str(e), "max_rows": e.max_rows}
+            if batch:
+                body["results"] = results
+                for res in results:
+                    if res["status"] == "ok":
+                        res.update(status="error", error="batch too large")
+            return jsonify(body), 413
+        except sqlite3.Error as e:
+            log.error("Error writing ingest batch: %s", e)
+            for res in results:
+                if res["status"] == "ok":
+                    res.update(status="error", error="storage error", retry=True)
+            accepted = []
+
+    rejected = len(records) - len(accepted)
+    # Queued for a later group commit rather than committed already
+    ok_code = 202 if writer.enabled else 201
+
+    if not batch:
+        if rejected:
+            return jsonify({"error": results[0]["error"]}), (
+                500 if results[0].get("retry") else 400)
+        return jsonify({"status": "ok"}), ok_code
+
+    if not rejected:
+        code = ok_code
+    elif accepted:
+        code = 207
+    elif any(r.get("retry") for r in results):
+        code = 500
+    else:
+        code = 400
+    return jsonify({
+        "accepted": len(accepted),
+        "rejected": rejected,
+        "results":  results
+    }), code
+
+def parse_ingest_body(req):
+    """
+    Split an ingest request body into records.
+    Returns (records, is_batch). NDJSON lines that fail to parse are kept
+    as raw strings so they get reported as per-record errors.
+    """
+    body = req.get_data(as_text=True)
+    if not body.strip():
+        raise ValueError("empty body")
+
+    ndjson = req.mimetype in ('application/x-ndjson', 'application/jsonl')
+    if not ndjson:
+        try:
+            payload = json.loads(body)
+        except ValueError:
+            # Not a single JSON document; fall back to line-delimited JSON
+            ndjson = True
+        else:
+            if isinstance(payload, list):
+                return payload, True
+            return [payload], False
 
-    if not device_id or not ts:
-        return jsonify({"error": "device_id and ts required"}), 400
+    records = []
+    for line in body.splitlines():
+        if not line.strip():
+            continue
+        try:
+            records.append(json.loads(line))
+        except ValueError:
+            records.append(line)
+    return records, True
+
+def validate_ingest_record(record):
+    """
+    Check one ingest record and return (device_id, ts, measurements).
+    Raises ValueError with a short reason if the record is unusable.
+    """
+    if not isinstance(record, dict):
+        raise ValueError("record must be a JSON object")
+
+    device_id = record.get('device_id')
+    ts        = record.get('ts')
+    if not device_id or ts is None:
+        raise ValueError("device_id and ts required")
+    if not isinstance(device_id, str):
+        raise ValueError("device_id must be a string")
+    if isinstance(ts, bool) or not isinstance(ts, (int, float)):
+        raise ValueError("ts must be a unix timestamp")
+    try:
+        datetime.utcfromtimestamp(ts)
+    except (OverflowError, OSError, ValueError):
+        raise ValueError("ts out of range")
 
     # everything else is a measurement
     measurements = {
-        k: v for k, v in payload.items()
+        k: v for k, v in record.items()
         if k not in ('device_id', 'ts')
     }
+    if not measurements:
+        raise ValueError("no measurements")
+    for metric, value in measurements.items():
+        if not metric.strip():
+            raise ValueError("measurement names must be non-empty")
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            raise ValueError(f"measurement '{metric}' must be numeric")
+        if not math.isfinite(value):
+            raise ValueError(f"measurement '{metric}' must be finite")
 
-    write_reading(device_id, ts, measurements)
-    return jsonify({"status": "ok"}), 201
+    return device_id, ts, measurements
 
 @app.route('/api/readings', methods=['GET'])
 def api_readings():
+    """The 100 newest samples of a device, newest first."""
     device_id = request.args.get('device_id')
-    db        = app.config['DATABASE']
-    conn      = sqlite3.connect(db)
-    cur       = conn.cursor()
-    cur.execute("""
-      SELECT ts, metric, value
-        FROM readings
-       WHERE device_id = ?
-       ORDER BY ts DESC
-       LIMIT 100
-    """, (device_id,))
-    rows = cur.fetchall()
-    conn.close()
+    series    = device_series(device_id)
+    names     = {sid: metric for metric, sid in series.items()}
+    rows      = recent_samples(list(names), 100)
     # return as JSON
     return jsonify([
-      {"ts": ts, "metric": m, "value": v}
-      for ts, m, v in rows
+      {"ts": ms_to_iso(ts), "metric": names[sid], "value": v}
+      for sid, ts, v in rows
     ])
 
+# Wide rows per page of /api/readings/range
+RANGE_PAGE_ROWS = 500
+RANGE_MAX_ROWS  = 5000
+
+def encode_cursor(ts_ms, metric):
+    raw = json.dumps([ts_ms, metric]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        ts_ms, metric = json.loads(raw)
+        return int(ts_ms), str(metric)
+    except (ValueError, TypeError):
+        raise ValueError("invalid cursor")
+
+@app.route('/api/readings/range', methods=['GET'])
+def api_readings_range():
+    """
+    Samples of one device in [from, to), pivoted into one wide row per
+    timestamp, oldest first:
+      /api/readings/range?device_id=&metric=a,b&from=&to=&limit=&cursor=
+
+    metric defaults to every metric of the device; from/to take ISO-8601
+    or unix seconds (to defaults to now). Pages hold up to `limit` rows;
+    pass the returned next_cursor to get the next one (null at the end).
+    """
+    device_id = request.args.get('device_id')
+    if not device_id or 'from' not in request.args:
+        return jsonify({"error": "device_id and from required"}), 400
+    limit = request.args.get('limit', RANGE_PAGE_ROWS, type=int)
+    if not 1 <= limit <= RANGE_MAX_ROWS:
+        return jsonify({"error": f"limit must be between 1 and {RANGE_MAX_ROWS}"}), 400
+    try:
+        start = parse_time_arg(request.args['from'])
+        end = parse_time_arg(request.args['to']) if 'to' in request.args else now_ms()
+        after = decode_cursor(request.args['cursor']) if request.args.get('cursor') else None
+    except (ValueError, OverflowError) as e:
+        return jsonify({"error": str(e)}), 400
+
+    series = device_series(device_id)
+    wanted = [m for m in request.args.get('metric', '').split(',') if m] or sorted(series)
+    unknown = [m for m in wanted if m not in series]
+    if unknown:
+        return jsonify({"error": f"unknown metric(s): {', '.join(unknown)}"}), 400
+    series = {m: series[m] for m in wanted}
+
+    # limit + 1 samples per series tells us whether another page exists
+    rows, more = [], False
+    for ts, metric, value in page_samples(series, start, end, after, limit + 1):
+        if not rows or rows[-1][0] != ts:
+            if len(rows) == limit:
+                more = True
+                break
+            rows.append((ts, {}))
+        rows[-1][1][metric] = value
+
+    next_cursor = None
+    if more:
+        # Rows are never split across pages, so the cursor is the last
+        # (ts, metric) of the last row
+        ts, values = rows[-1]
+        next_cursor = encode_cursor(ts, max(values))
+    return jsonify({
+        "device_id": device_id,
+        "metrics": wanted,
+        "rows": [dict(values, ts=ms_to_iso(ts)) for ts, values in rows],
+        "next_cursor": next_cursor
+    })
+
+@app.route('/api/latest', methods=['GET'])
+def api_latest():
+    """
+    Most recent value of every metric, served from the in-memory cache.
+    Optional ?device_id= narrows the result to one device.
+    """
+    device_id = request.args.get('device_id')
+    result = {}
+    for (dev, metric), (ts, value) in latest.snapshot().items():
+        if device_id and dev != device_id:
+            continue
+        result.setdefault(dev, {})[metric] = {"ts": ms_to_iso(ts), "value": value}
+    return jsonify(result)
+
+def parse_time_arg(value):
+    """
+    A from/to query argument (ISO-8601 or unix seconds) as epoch ms.
+    Raises ValueError for anything else, including inf/nan and times
+    outside what a datetime can hold.
+    """
+    try:
+        seconds = float(value)
+    except ValueError:
+        ms = to_epoch_ms(value)
+    else:
+        if not math.isfinite(seconds):
+            raise ValueError(f"not a finite time: {value!r}")
+        ms = to_epoch_ms(seconds)
+    try:
+        datetime.utcfromtimestamp(ms / 1000)
+    except (OverflowError, OSError, ValueError):
+        raise ValueError(f"time out of range: {value!r}")
+    return ms
+
+# Rows per chunk written to a streamed export
+EXPORT_CHUNK_ROWS = 1000
+
+@app.route('/api/export')
+def api_export():
+    """
+    Stream one device's samples as CSV or NDJSON:
+      /api/export?device_id=&metric=a,b&from=&to=&format=csv|ndjson&gzip=1
+
+    metric defaults to every metric of the device, to to now. Rows come
+    straight off the database cursors (archived days included) in chunks,
+    merged into timestamp order, so memory stays flat however long the
+    range is. gzip=1 compresses the stream as it is produced.
+    """
+    device_id = request.args.get('device_id')
+    fmt = request.args.get('format', 'csv')
+    if not device_id or 'from' not in request.args:
+        return jsonify({"error": "device_id and from required"}), 400
+    if fmt not in ('csv', 'ndjson'):
+        return jsonify({"error": "format must be csv or ndjson"}), 400
+    try:
+        start = parse_time_arg(request.args['from'])
+        end = parse_time_arg(request.args['to']) if 'to' in request.args else now_ms()
+    except (ValueError, OverflowError) as e:
+        return jsonify({"error": f"bad from/to: {e}"}), 400
+
+    metrics = [m for m in request.args.get('metric', '').split(',') if m]
+    if not metrics:
+        metrics = sorted(device_series(device_id))
+    compress = request.args.get('gzip') in ('1', 'true')
+
+    def labelled(metric):
+        # A function, not a generator expression, so each stream keeps its
+        # own metric instead of all seeing the loop variable's last value
+        for ts, value in retention.iter_history(device_id, metric, start, end):
+            yield ts, metric, value
+
+    def rows():
+        streams = [labelled(metric) for metric in metrics]
+        yield from heapq.merge(*streams, key=lambda row: row[0])
+
+    def render(batch):
+        """One chunk of output rows as text."""
+        if fmt == 'csv':
+            # csv.writer quotes ids and names with commas, quotes or
+            # newlines; a NULL value is written as an empty field
+            buf = io.StringIO()
+            csv.writer(buf, lineterminator="\n").writerows(
+                (ms_to_iso(ts), device_id, metric, '' if value is None else value)
+                for ts, metric, value in batch)
+            return buf.getvalue()
+        return ''.join(json.dumps({"ts": ms_to_iso(ts), "device_id": device_id,
+                                   "metric": metric, "value": value}) + "\n"
+                       for ts, metric, value in batch)
+
+    def chunks():
+        z = zlib.compressobj(wbits=31) if compress else None   # 31: gzip framing
+        head = "ts,device_id,metric,value\n" if fmt == 'csv' else ""
+        it = rows()
+        while True:
+            batch = list(islice(it, EXPORT_CHUNK_ROWS))
+            data = (head + render(batch)).encode()
+            head = ""
+            if len(batch) < EXPORT_CHUNK_ROWS:
+                if z:
+                    yield z.compress(data) + z.flush()
+                elif data:
+                    yield data
+                return
+            yield z.compress(data) if z else data
+
+    ext = 'csv' if fmt == 'csv' else 'ndjson'
+    filename = f"{device_id}.{ext}" + ('.gz' if compress else '')
+    mimetype = 'application/gzip' if compress else (
+        'text/csv' if fmt == 'csv' else 'application/x-ndjson')
+    return Response(chunks(), mimetype=mimetype, headers={
+        'Content-Disposition': f'attachment; filename="{filename}"',
+        'X-Accel-Buffering': 'no'
+    })
+
+# Seconds between SSE keepalive comments on an idle stream
+STREAM_KEEPALIVE_S = 15
+
+@app.route('/api/stream')
+def api_stream():
+    """
+    Server-Sent Events feed of committed readings, device state changes and
+    control decisions. Optional ?devices=a,b limits it to those ids.
+    """
+    devices = [d for d in request.args.get('devices', '').split(',') if d]
+
+    def generate():
+        sub = bus.subscribe(devices or None)
+        try:
+            yield "retry: 5000\n\n"
+            while True:
+                try:
+                    event_type, data, _ = sub.get(timeout=STREAM_KEEPALIVE_S)
+                except queue.Empty:
+                    yield ": keepalive\n\n"
+                    continue
+                yield f"event: {event_type}\ndata: {json.dumps(data)}\n\n"
+        finally:
+            bus.unsubscribe(sub)
+
+    return Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+@app.route('/api/controls/engine')
+def api_control_engine():
+    """Control engine counters and commit-to-evaluation latency."""
+    return jsonify(engine.stats())
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """Every process metric in the Prometheus text exposition format."""
+    return Response(registry.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/api/ingest/queue')
+def api_ingest_queue():
+    """Write-behind queue depth, throughput and flush latency."""
+    return jsonify(writer.stats())
+
+@app.route('/api/ingest/binary')
+def api_ingest_binary():
+    """State of the UDP/TCP binary ingest listener."""
+    return jsonify(listener.stats())
+
+@app.route('/api/process')
+def api_process():
+    """Process layout: mode, collector lease holder and outbox position."""
+    return jsonify({
+        "mode": "split" if SPLIT else "single",
+        "pid": os.getpid(),
+        "owns_devices": outbox.owner or not SPLIT,
+        "collector_lease": Lease(COLLECTOR_LEASE).holder() if SPLIT else None,
+        "outbox": outbox.tail.stats() if SPLIT else None
+    })
+
+@app.route('/api/devices/sessions')
+def api_device_sessions():
+    """Tuya session state and sent/skipped/failed command counters."""
+    return jsonify(pool.stats())
+
+@app.route('/api/devices/polls')
+def api_device_polls():
+    """Actual plug states from the background poller, with their age and any drift."""
+    return jsonify(poller.stats())
+
 # NEW API: Diagnostic endpoint to inspect raw data 
 @app.route('/api/diagnostic/readings')
 def diagnostic_readings():
-    """Get raw database readings for debugging"""
+    """
+    Get raw database readings for debugging: the newest `limit` samples,
+    optionally of one device, merged from one index seek per series.
+    """
     limit = request.args.get('limit', 100, type=int)
     device_id = request.args.get('device_id')
-    
-    db = app.config['DATABASE']
-    conn = sqlite3.connect(db)
-    conn.row_factory = sqlite3.Row
-    cur = conn.cursor()
-    
+
+    names = series_names()
     if device_id:
-        cur.execute(
-            "SELECT * FROM readings WHERE device_id=? ORDER BY ts DESC LIMIT ?", 
-            (device_id, limit)
-        )
-    else:
-        cur.execute("SELECT * FROM readings ORDER BY ts DESC LIMIT ?", (limit,))
-    
-    rows = [dict(row) for row in cur.fetchall()]
-    conn.close()
-    
+        names = {sid: name for sid, name in names.items() if name[0] == device_id}
+
+    rows = [
+        {"device_id": names[sid][0], "ts": ms_to_iso(ts), "metric": names[sid][1], "value": value}
+        for sid, ts, value in recent_samples(list(names), limit)
+    ]
+
     return jsonify({
         "count": len(rows),
         "readings": rows
@@ -128,33 +805,32 @@ def diagnostic_readings():
 
 def write_reading(device_id, ts, measurements):
     """Insert one row per (device, timestamp, metric, value)."""
-    db   = app.config['DATABASE']
-    conn = sqlite3.connect(db)
-    cur  = conn.cursor()
-
-    ts_iso = datetime.utcfromtimestamp(ts).isoformat()
+    write_readings([(device_id, ts, measurements)])
 
-    for metric, value in measurements.items():
-        cur.execute("""
-            INSERT OR REPLACE INTO readings
-              (device_id, ts, metric, value)
-            VALUES (?, ?, ?, ?)
-        """, (device_id, ts_iso, metric, value))
-
-    conn.commit()
-    conn.close()
+def write_readings(records):
+    """
+    Insert many (device_id, ts, measurements) records with a single
+    executemany inside one transaction, or queue them for the next group
+    commit when write-behind is enabled (raises QueueFull if it is full).
+    """
+    writer.submit([
+        (device_id, to_epoch_ms(ts), metric, value)
+        for device_id, ts, measurements in records
+        for metric, value in measurements.items()
+    ])
 
 @app.route('/widget/<device_id>')
 def widget_detail(device_id):
     # Find the widget instance matching this device_id
     for w in widgets:
         if getattr(w, 'device_info', {}).get('id') == device_id:
-            html = w.render()
-            return render_template('widget_detail.html',
-                                   widget_html=html,
-                                   config=config)
+            return cached_page(('page', 'detail', device_id), lambda: render_template(
+                'widget_detail.html',
+                widget_html=render_widget(w),
+                config=config))
     return "Widget not found", 404
 
 if __name__ == "__main__":
+    start()
     # Start the Flask development server; adjust host/port as needed
     app.run(host="0.0.0.0", port=5000)
\ No newline at end of file
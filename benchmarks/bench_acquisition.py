@@ -0,0 +1,77 @@
+# bench_acquisition.py — Time store_reading against a simulated I²C bus
+#
+#   python benchmarks/bench_acquisition.py [--sensors N] [--buses N] [--cycles N]
+#
+# Runs the real collection → storage path (pipelined bus reads, CRC
+# checks, samples + rollups transaction, latest cache, event publish) with
+# the "simulated" bus backend, so it needs no Pi and no SHT40. Sensors are
+# spread round-robin over the buses; the database is a throwaway file.
+
+import argparse
+import math
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)  # modules load config.yaml relative to the working directory
+
+import buses  # noqa: E402
+import sensor  # noqa: E402
+import storage  # noqa: E402
+
+def virtual_sensors(count, bus_count):
+    """Sensor device configs at distinct addresses, round-robin over buses."""
+    devices = []
+    for i in range(count):
+        bus_number, slot = i % bus_count, i // bus_count
+        if slot >= 0x78 - 0x08:
+            raise SystemExit(f"{count} sensors need more than {bus_count} buses")
+        devices.append({
+            'id': f"sim{i:04d}",
+            'type': 'sensor',
+            'source': 'local',
+            'sensor_type': 'SHT40',
+            'i2c_bus': bus_number,
+            'address': 0x08 + slot,
+            'metrics': [{'name': 'temperature_C'}, {'name': 'humidity_pct'}],
+        })
+    return devices
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sensors', type=int, default=120)
+    parser.add_argument('--buses', type=int, default=2)
+    parser.add_argument('--cycles', type=int, default=50)
+    args = parser.parse_args()
+
+    buses.cfg.setdefault('sensor', {})['backend'] = 'simulated'
+    sensor.cfg['devices'] = virtual_sensors(args.sensors, args.buses)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        storage.DB = os.path.join(tmp, 'bench.db')
+        storage.init_db()
+
+        sensor.store_reading()  # warm up: open buses, create series
+        cycles, rows = [], 0
+        for _ in range(args.cycles):
+            start = time.perf_counter()
+            rows += len(sensor.store_reading())
+            cycles.append(time.perf_counter() - start)
+        storage.close_connection()
+
+    expected = args.sensors * 2 * args.cycles
+    total = sum(cycles)
+    cycles.sort()
+    print(f"{args.sensors} sensors on {args.buses} buses, {args.cycles} cycles")
+    print(f"cycle   median {statistics.median(cycles) * 1000:7.2f} ms  "
+          f"p95 {cycles[min(len(cycles) - 1, math.ceil(0.95 * len(cycles)) - 1)] * 1000:7.2f} ms  "
+          f"max {cycles[-1] * 1000:7.2f} ms")
+    print(f"rows    {rows}/{expected} stored  {rows / total:9.0f} rows/s  "
+          f"{args.sensors * args.cycles / total:7.0f} sensor reads/s")
+
+if __name__ == "__main__":
+    main()
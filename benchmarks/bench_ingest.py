@@ -0,0 +1,166 @@
+# bench_ingest.py — Compare the HTTP and binary (UDP/TCP) ingest paths
+#
+#   python benchmarks/bench_ingest.py [--records N] [--output FILE]
+#
+# Runs the app in a fresh interpreter against an empty database (the
+# repo's config.yaml, simulated sensors) with a real HTTP server and the
+# binary ingest listener on localhost, then sends N one-reading records
+# of `pico_soil` the way a sensor would, each one waiting for its answer:
+#
+#   http        POST /api/ingest, a new connection per reading (Connection: close)
+#   udp         one datagram per reading, acknowledged
+#   tcp         one persistent connection, one frame per reading, acknowledged
+#   tcp_batch   one persistent connection, 100 frames per write
+#
+# and reports readings/s, µs per reading and bytes on the wire per
+# reading (request only, without IP/TCP/UDP headers). Every reading is
+# checked to be in the samples table afterwards.
+
+import argparse
+import json
+import platform
+import sys
+from datetime import datetime, timezone
+
+from bench_storage import bench_config
+from bench_startup import run_child
+
+KEY = "bench-key"
+
+CHILD = r'''
+import json, logging, random, socket, sys, threading, time
+from werkzeug.serving import make_server
+
+import app
+import binary_ingest
+from binary_ingest import encode_frame, FLAG_ACK, ACK, OK
+from storage import get_connection, now_ms
+
+N, KEY = int(sys.argv[2]), sys.argv[3].encode()
+
+def free_port(kind):
+    with socket.socket(socket.AF_INET, kind) as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+app.start(background=False)
+logging.getLogger('werkzeug').setLevel(logging.WARNING)   # no access log
+server = make_server('127.0.0.1', 0, app.app, threaded=True)
+threading.Thread(target=server.serve_forever, daemon=True).start()
+listener = binary_ingest.listener
+listener.enabled, listener.host = True, '127.0.0.1'
+listener.udp_port, listener.tcp_port = free_port(socket.SOCK_DGRAM), free_port(socket.SOCK_STREAM)
+listener.start({'pico_soil': KEY})
+
+def stored():
+    return get_connection().execute("SELECT count(*) FROM samples").fetchone()[0]
+
+session = random.getrandbits(32)
+seq = 0
+def frame(ts_ms, flags=FLAG_ACK):
+    global seq
+    seq += 1
+    return encode_frame(KEY, 'pico_soil', session, seq, ts_ms, {'soil_moisture': 41.5}, flags)
+
+def check_ack(data):
+    status, _, _ = ACK.unpack(data)
+    assert status == OK, status
+
+def http_run(base):
+    sent = 0
+    for i in range(N):
+        body = json.dumps({"device_id": "pico_soil", "ts": (base + i) / 1000,
+                           "soil_moisture": 41.5}).encode()
+        request = (f"POST /api/ingest HTTP/1.1\r\nHost: 127.0.0.1\r\n"
+                   f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n"
+                   f"Connection: close\r\n\r\n").encode() + body
+        with socket.create_connection(('127.0.0.1', server.server_port)) as s:
+            s.sendall(request)
+            response = b''
+            while chunk := s.recv(4096):
+                response += chunk
+        assert response.split(b' ', 2)[1] in (b'201', b'202'), response[:100]
+        sent += len(request)
+    return sent
+
+def udp_run(base):
+    sent = 0
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+        s.settimeout(5)
+        for i in range(N):
+            data = frame(base + i)
+            s.sendto(data, ('127.0.0.1', listener.udp_port))
+            check_ack(s.recv(64))
+            sent += len(data)
+    return sent
+
+def tcp_run(base):
+    sent = 0
+    with socket.create_connection(('127.0.0.1', listener.tcp_port)) as s:
+        s.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        for i in range(N):
+            data = frame(base + i)
+            s.sendall(data)
+            check_ack(s.recv(ACK.size, socket.MSG_WAITALL))
+            sent += len(data)
+    return sent
+
+def tcp_batch_run(base, batch=100):
+    sent = 0
+    with socket.create_connection(('127.0.0.1', listener.tcp_port)) as s:
+        for start in range(0, N, batch):
+            data = b''.join(frame(base + i) for i in range(start, min(N, start + batch)))
+            s.sendall(data)
+            acks = s.recv(ACK.size * min(batch, N - start), socket.MSG_WAITALL)
+            for pos in range(0, len(acks), ACK.size):
+                check_ack(acks[pos:pos + ACK.size])
+            sent += len(data)
+    return sent
+
+results = {}
+base = now_ms() - 4 * N
+for name, run in [('http', http_run), ('udp', udp_run), ('tcp', tcp_run), ('tcp_batch', tcp_batch_run)]:
+    before = stored()
+    start = time.perf_counter()
+    sent = run(base)
+    elapsed = time.perf_counter() - start
+    assert stored() - before == N, f"{name}: {stored() - before} of {N} readings stored"
+    results[name] = {"readings_per_s": N / elapsed, "us_per_reading": elapsed / N * 1e6,
+                     "bytes_per_reading": sent / N}
+    base += N
+listener.stop()
+server.shutdown()
+with open(sys.argv[1], 'w') as f:
+    json.dump(results, f)
+'''
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--records', type=int, default=2000)
+    parser.add_argument('--output', default='bench_ingest.json')
+    args = parser.parse_args()
+
+    config = bench_config('bench.db')
+    for dev in config.get('devices', []):
+        if dev['id'] == 'pico_soil':
+            dev['ingest_key'] = KEY
+
+    _, modes = run_child(CHILD, config, str(args.records), KEY)
+    results = {
+        "created": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "records": args.records,
+        "modes": modes
+    }
+    for name, run in modes.items():
+        print(f"{name:<10} {run['readings_per_s']:9.0f} readings/s  "
+              f"{run['us_per_reading']:8.1f} µs/reading  "
+              f"{run['bytes_per_reading']:6.1f} bytes/reading", file=sys.stderr)
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"results written to {args.output}", file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
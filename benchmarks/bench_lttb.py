@@ -0,0 +1,66 @@
+# bench_lttb.py — Time the LTTB reducer on a one-million-row window
+#
+#   python benchmarks/bench_lttb.py [--rows N] [--points N]
+#
+# Measures the reducer on an in-memory stream and on a stream read from a
+# SQLite samples table through a chunked cursor (the path the sensor-data
+# endpoint uses), and checks that an injected spike survives reduction.
+
+import argparse
+import math
+import os
+import random
+import sqlite3
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from downsample import lttb  # noqa: E402
+
+def synthetic(rows, spike_at):
+    """Slow sine with noise, one reading a minute, plus one sharp spike."""
+    rnd = random.Random(42)
+    for i in range(rows):
+        y = 24 + 4 * math.sin(i / 720) + rnd.gauss(0, 0.2)
+        if i == spike_at:
+            y += 15
+        yield i * 60000, y
+
+def bench(label, make_stream, rows, points, spike):
+    start = time.perf_counter()
+    out = list(lttb(make_stream(), rows, points))
+    elapsed = time.perf_counter() - start
+    kept = any(abs(y - spike) < 1e-9 for _, y in out)
+    print(f"{label:<10} {rows:>9} rows -> {len(out):>5} points  "
+          f"{elapsed:7.3f} s  {rows / elapsed / 1e6:5.2f} Mrows/s  spike kept: {kept}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--points', type=int, default=1000)
+    args = parser.parse_args()
+
+    spike_at = args.rows // 3
+    spike = dict(synthetic(spike_at + 1, spike_at))[spike_at * 60000]
+
+    bench("memory", lambda: synthetic(args.rows, spike_at), args.rows, args.points, spike)
+
+    conn = sqlite3.connect(':memory:')
+    conn.execute("""
+        CREATE TABLE samples(series_id INTEGER, ts INTEGER, value REAL,
+                             PRIMARY KEY (series_id, ts)) WITHOUT ROWID
+    """)
+    conn.executemany("INSERT INTO samples VALUES (1, ?, ?)", synthetic(args.rows, spike_at))
+
+    def from_cursor():
+        cur = conn.execute("SELECT ts, value FROM samples WHERE series_id = 1 ORDER BY ts")
+        while True:
+            chunk = cur.fetchmany(5000)
+            if not chunk:
+                break
+            yield from chunk
+
+    bench("sqlite", from_cursor, args.rows, args.points, spike)
+
+if __name__ == "__main__":
+    main()
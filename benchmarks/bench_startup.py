@@ -0,0 +1,155 @@
+# bench_startup.py — Time a cold start and applying a config edit
+#
+#   python benchmarks/bench_startup.py [--repeat N] [--output FILE]
+#
+# Each cold-start run is a fresh interpreter in a temporary directory with
+# the repo's config.yaml (simulated sensors, empty database):
+#
+#   process_ms         wall time of the whole child process
+#   import_ms          `import app`
+#   start_ms           app.start(background=False): database, caches, widgets
+#   first_request_ms   GET / and GET /api/dashboard/snapshot
+#
+# It runs once with the configured devices and once without Tuya plugs,
+# recording whether tinytuya was imported. Then, in one process:
+#
+#   reload_ms          edit config.yaml, then the first request that
+#                      serves the edit (hot reload of widgets and routes)
+#
+# which is what replaces a restart (process_ms) after an edit. Run it on
+# the target hardware (a Pi Zero) to get meaningful numbers.
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+import yaml
+
+from bench_storage import ROOT, bench_config
+
+COLD_START = r'''
+import json, sys, time
+t0 = time.perf_counter()
+import app
+t1 = time.perf_counter()
+app.start(background=False)
+t2 = time.perf_counter()
+client = app.app.test_client()
+assert client.get('/').status_code == 200
+assert client.get('/api/dashboard/snapshot').status_code == 200
+t3 = time.perf_counter()
+with open(sys.argv[1], 'w') as f:
+    json.dump({
+        "import_ms": (t1 - t0) * 1000,
+        "start_ms": (t2 - t1) * 1000,
+        "first_request_ms": (t3 - t2) * 1000,
+        "tinytuya_loaded": 'tinytuya' in sys.modules
+    }, f)
+'''
+
+RELOAD = r'''
+import json, os, sys, time
+import yaml
+import app
+app.start(background=False)
+client = app.app.test_client()
+client.get('/')
+with open('config.yaml') as f:
+    config = yaml.safe_load(f)
+times = []
+for i in range(int(sys.argv[2])):
+    config['dashboard_title'] = title = f"Reload {i}"
+    with open('config.yaml', 'w') as f:
+        yaml.safe_dump(config, f)
+    os.utime('config.yaml', (time.time(), time.time() + i + 1))  # always a new mtime
+    app._next_reload_check = 0.0   # skip the once-a-second throttle
+    start = time.perf_counter()
+    body = client.get('/').get_data(as_text=True)
+    times.append((time.perf_counter() - start) * 1000)
+    assert title in body, "edit not served"
+with open(sys.argv[1], 'w') as f:
+    json.dump(times, f)
+'''
+
+def summary(times):
+    times = sorted(times)
+    return {
+        "median_ms": statistics.median(times),
+        "min_ms": times[0],
+        "max_ms": times[-1],
+        "repeat": len(times)
+    }
+
+def run_child(code, config, *args):
+    """Run `code` in a fresh interpreter against `config`; returns (wall ms, result)."""
+    tmp = tempfile.mkdtemp(prefix='growlab-startup-')
+    try:
+        config = dict(config, DATABASE=os.path.join(tmp, 'bench.db'))
+        with open(os.path.join(tmp, 'config.yaml'), 'w') as f:
+            yaml.safe_dump(config, f)
+        out = os.path.join(tmp, 'result.json')
+        env = dict(os.environ, PYTHONPATH=ROOT, PYTHONDONTWRITEBYTECODE='')
+        start = time.perf_counter()
+        subprocess.run([sys.executable, '-c', code, out, *args], cwd=tmp, env=env, check=True)
+        wall = (time.perf_counter() - start) * 1000
+        with open(out) as f:
+            return wall, json.load(f)
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+def cold_start(config, repeat):
+    runs = []
+    for _ in range(repeat + 1):
+        wall, result = run_child(COLD_START, config)
+        runs.append(dict(result, process_ms=wall))
+    runs = runs[1:]   # the first run also fills the page cache and __pycache__
+    report = {key: summary([r[key] for r in runs])
+              for key in ('process_ms', 'import_ms', 'start_ms', 'first_request_ms')}
+    report['tinytuya_loaded'] = any(r['tinytuya_loaded'] for r in runs)
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--output', default='bench_startup.json')
+    args = parser.parse_args()
+
+    config = bench_config('bench.db')
+    no_tuya = dict(config, devices=[
+        d for d in config.get('devices', [])
+        if d.get('device_type') != 'tuya' and d.get('type') != 'control'
+    ])
+
+    results = {
+        "created": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cold_start": cold_start(config, args.repeat),
+        "cold_start_no_tuya": cold_start(no_tuya, args.repeat),
+    }
+    _, reload_times = run_child(RELOAD, config, str(args.repeat))
+    results["reload"] = summary(reload_times)
+
+    for name in ('cold_start', 'cold_start_no_tuya'):
+        run = results[name]
+        print(f"{name:<20} process {run['process_ms']['median_ms']:8.1f} ms  "
+              f"import {run['import_ms']['median_ms']:7.1f} ms  "
+              f"start {run['start_ms']['median_ms']:7.1f} ms  "
+              f"first request {run['first_request_ms']['median_ms']:7.1f} ms  "
+              f"tinytuya {'loaded' if run['tinytuya_loaded'] else 'not loaded'}", file=sys.stderr)
+    print(f"{'reload':<20} median {results['reload']['median_ms']:8.1f} ms", file=sys.stderr)
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"results written to {args.output}", file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,297 @@
+# bench_storage.py — Time the storage-backed code paths as the database grows
+#
+#   python benchmarks/bench_storage.py [--sizes 1e4,1e5,1e6] [--repeat N]
+#                                      [--output FILE] [--baseline FILE]
+#                                      [--thresholds FILE]
+#
+# For each dataset size a fresh database is filled with that many
+# synthetic sensor samples (one a minute per configured series, ending
+# now, rollups backfilled) plus a tenth as many device_logs rows (device
+# intervals and daily duty cycles backfilled), and the app is imported
+# against it in a child process. Each operation is then timed `repeat`
+# times after one warm-up call:
+#
+#   write_reading            app.write_reading, one reading per transaction
+#   store_reading            one collection cycle on the simulated I²C bus
+#   sensor_get_data          SensorWidget.get_data() (24 h from rollups)
+#   sensor_get_data_30d      SensorWidget.get_data("30d")
+#   sensor_get_data_raw      SensorWidget.get_data("24h", points=800) (LTTB)
+#   device_get_data          DeviceWidget.get_data()
+#   control_latest_reading   ControlWidget.get_latest_reading()
+#   api_readings             GET /api/readings?device_id=...
+#   api_readings_range       GET /api/readings/range (one 500-row page, 7 days back)
+#   api_diagnostic           GET /api/diagnostic/readings
+#   api_diagnostic_device    GET /api/diagnostic/readings?device_id=...
+#   api_export               GET /api/export, every metric of a sensor, 24 h as NDJSON
+#
+# Before timing, one multi-metric export is checked row by row against
+# each series read on its own, so a wrong metric label fails the run.
+#
+# Results are written as JSON. Each operation's median is checked against
+# the absolute limit in the thresholds file and, given --baseline (an
+# earlier results file), against the baseline median times (1 + tolerance).
+# The exit status is 1 if any check fails.
+
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+import yaml
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+THRESHOLDS = os.path.join(ROOT, 'benchmarks', 'thresholds.json')
+
+def bench_config(db_path):
+    """The repo's config.yaml, pointed at db_path and made side-effect free."""
+    with open(os.path.join(ROOT, 'config.yaml')) as f:
+        config = yaml.safe_load(f)
+    config['DATABASE'] = db_path
+    config.setdefault('sensor', {})['backend'] = 'simulated'
+    # Keep the scheduler and the control sweep out of the measurements
+    config.setdefault('schedule', {})['reading_interval_s'] = 86400
+    config.setdefault('controls', {})['sweep_interval_s'] = 86400
+    for dev in config.get('devices', []):
+        if dev.get('type') == 'control':
+            dev['enabled'] = 0   # never actuate real plugs
+    return config
+
+def populate(rows, log_rows):
+    """Fill the database with `rows` samples and `log_rows` device_logs rows (with their intervals)."""
+    import storage
+    from datetime import timedelta
+
+    storage.init_db()
+    conn = storage.get_connection()
+    rnd = random.Random(1)
+
+    series = [
+        storage.get_series_id(dev['id'], m['name'], create=True)
+        for dev in storage.cfg.get('devices', []) if dev.get('type') == 'sensor'
+        for m in dev.get('metrics', [])
+    ]
+    per_series = -(-rows // len(series))
+    end = storage.now_ms() - 60000
+    chunk = 50000
+
+    def samples():
+        produced = 0
+        for i in range(per_series):
+            ts = end - (per_series - 1 - i) * 60000
+            for sid in series:
+                if produced == rows:
+                    return
+                produced += 1
+                yield sid, ts, 20 + 10 * rnd.random()
+
+    it = samples()
+    while True:
+        batch = [r for _, r in zip(range(chunk), it)]
+        if not batch:
+            break
+        with conn:
+            conn.executemany("INSERT INTO samples (series_id, ts, value) VALUES (?, ?, ?)", batch)
+    storage.backfill_rollups()
+
+    devices = [d['id'] for d in storage.cfg.get('devices', []) if d.get('type') == 'device']
+    start = datetime.utcnow() - timedelta(minutes=5 * log_rows)
+    logs = (
+        (devices[i % len(devices)],
+         (start + timedelta(minutes=5 * i)).isoformat(),
+         'on' if (i // len(devices)) % 2 else 'off')
+        for i in range(log_rows)
+    )
+    while True:
+        batch = [r for _, r in zip(range(chunk), logs)]
+        if not batch:
+            break
+        with conn:
+            conn.executemany("INSERT INTO device_logs (device_id, ts, state) VALUES (?, ?, ?)", batch)
+    # Build the duty-cycle tables the device widget reads, as the migration would
+    storage.backfill_device_stats()
+
+def measure(fn, repeat):
+    fn()  # warm-up
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - start) * 1000)
+    times.sort()
+    return {
+        "median_ms": statistics.median(times),
+        "p95_ms": times[min(len(times) - 1, math.ceil(0.95 * len(times)) - 1)],   # nearest rank
+        "min_ms": times[0],
+        "max_ms": times[-1],
+        "repeat": repeat
+    }
+
+def check_export(client, url, device_id, start_ms):
+    """Assert that an export of every metric labels each value with its own series."""
+    import retention
+    from storage import device_series, now_ms, ms_to_iso
+
+    metrics = sorted(device_series(device_id))
+    assert len(metrics) > 1, f"{device_id} has one metric; the export check needs several"
+    end = now_ms()
+    exported = sorted((row['metric'], row['ts'], row['value'])
+                      for row in map(json.loads, client.get(url).get_data(as_text=True).splitlines()))
+    expected = sorted((metric, ms_to_iso(ts), value) for metric in metrics
+                      for ts, value in retention.iter_history(device_id, metric, start_ms, end))
+    assert exported == expected, f"export of {metrics} does not match the series read one by one"
+
+def worker(rows, repeat):
+    """Child process: build one dataset, import the app, time every operation."""
+    tmp = tempfile.mkdtemp(prefix='growlab-bench-')
+    try:
+        with open(os.path.join(tmp, 'config.yaml'), 'w') as f:
+            yaml.safe_dump(bench_config(os.path.join(tmp, 'bench.db')), f)
+        os.chdir(tmp)  # modules load config.yaml relative to the working directory
+        sys.path.insert(0, ROOT)
+
+        log_rows = max(1000, rows // 10)
+        start = time.perf_counter()
+        populate(rows, log_rows)
+        setup_s = time.perf_counter() - start
+
+        import app
+        app.start()
+        from storage import now_ms, ms_to_iso
+        from sensor import store_reading
+        from widgets.sensor import SensorWidget
+        from widgets.device import DeviceWidget
+        from widgets.control_widget import ControlWidget
+
+        def first(cls):
+            return next(w for w in app.widgets if isinstance(w, cls))
+        sensor_w, device_w, control_w = first(SensorWidget), first(DeviceWidget), first(ControlWidget)
+        sensor_id = sensor_w.device_info['id']
+        metric = sensor_w.device_info['metrics'][0]['name']
+        client = app.app.test_client()
+
+        clock = [now_ms()]
+        def write_one():
+            clock[0] += 1000
+            app.write_reading(sensor_id, ms_to_iso(clock[0]), {metric: 21.5})
+
+        def get(url):
+            def call():
+                response = client.get(url)
+                assert response.status_code == 200, (url, response.status_code)
+            return call
+
+        day_ago = (now_ms() - 86400000) // 1000
+        export_url = f"/api/export?device_id={sensor_id}&from={day_ago}&format=ndjson"
+        check_export(client, export_url, sensor_id, day_ago * 1000)
+
+        operations = {
+            "write_reading": write_one,
+            "store_reading": store_reading,
+            "sensor_get_data": lambda: sensor_w.get_data(),
+            "sensor_get_data_30d": lambda: sensor_w.get_data("30d"),
+            "sensor_get_data_raw": lambda: sensor_w.get_data("24h", points=800),
+            "device_get_data": lambda: device_w.get_data(),
+            "control_latest_reading": lambda: control_w.get_latest_reading(sensor_id, metric),
+            "api_readings": get(f"/api/readings?device_id={sensor_id}"),
+            "api_readings_range": get(f"/api/readings/range?device_id={sensor_id}"
+                                      f"&from={(now_ms() - 7 * 86400000) // 1000}"),
+            "api_diagnostic": get("/api/diagnostic/readings"),
+            "api_diagnostic_device": get(f"/api/diagnostic/readings?device_id={sensor_id}"),
+            "api_export": get(export_url),
+        }
+        results = {name: measure(fn, repeat) for name, fn in operations.items()}
+        app.engine.stop()
+        app.sched.shutdown(wait=False)
+        return {
+            "rows": rows,
+            "device_log_rows": log_rows,
+            "setup_s": setup_s,
+            "db_bytes": os.path.getsize(os.path.join(tmp, 'bench.db')),
+            "operations": results
+        }
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+def check(results, thresholds, baseline):
+    """Returns a list of human-readable threshold/baseline failures."""
+    failures = []
+    limits = thresholds.get('limits_ms', {})
+    tolerance = thresholds.get('tolerance', 0.25)
+    for size, run in results['sizes'].items():
+        base_ops = (baseline or {}).get('sizes', {}).get(size, {}).get('operations', {})
+        for name, stats in run['operations'].items():
+            median = stats['median_ms']
+            if name in limits and median > limits[name]:
+                failures.append(f"{size} {name}: median {median:.2f} ms > limit {limits[name]} ms")
+            if name in base_ops:
+                allowed = base_ops[name]['median_ms'] * (1 + tolerance)
+                if median > allowed:
+                    failures.append(f"{size} {name}: median {median:.2f} ms > baseline "
+                                    f"{base_ops[name]['median_ms']:.2f} ms + {tolerance:.0%}")
+    return failures
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='1e4,1e5,1e6',
+                        help="comma-separated sample counts (up to 1e7)")
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--output', default='bench_storage.json')
+    parser.add_argument('--baseline', help="earlier results file to compare against")
+    parser.add_argument('--thresholds', default=THRESHOLDS)
+    parser.add_argument('--worker', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--worker-output', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker is not None:
+        run = worker(args.worker, args.repeat)
+        with open(args.worker_output, 'w') as f:
+            json.dump(run, f)
+        return
+
+    results = {
+        "created": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "repeat": args.repeat,
+        "sizes": {}
+    }
+    for size in (int(float(s)) for s in args.sizes.split(',')):
+        print(f"{size:>10} rows ...", file=sys.stderr, flush=True)
+        with tempfile.NamedTemporaryFile(suffix='.json') as out:
+            subprocess.run(
+                [sys.executable, os.path.abspath(__file__), '--worker', str(size),
+                 '--repeat', str(args.repeat), '--worker-output', out.name],
+                check=True
+            )
+            run = json.load(open(out.name))
+        results['sizes'][str(size)] = run
+        for name, stats in run['operations'].items():
+            print(f"{size:>10} {name:<24} median {stats['median_ms']:9.3f} ms  "
+                  f"p95 {stats['p95_ms']:9.3f} ms", file=sys.stderr)
+
+    with open(args.thresholds) as f:
+        thresholds = json.load(f)
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    results['failures'] = check(results, thresholds, baseline)
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    for failure in results['failures']:
+        print(f"FAIL {failure}", file=sys.stderr)
+    print(f"results written to {args.output}", file=sys.stderr)
+    sys.exit(1 if results['failures'] else 0)
+
+if __name__ == "__main__":
+    main()
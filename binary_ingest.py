@@ -0,0 +1,374 @@
+# binary_ingest.py — Compact UDP/TCP ingest for microcontroller sensors
+#
+# An alternative to POSTing JSON to /api/ingest for battery-powered remote
+# sensors: one small authenticated binary frame per reading, sent as a UDP
+# datagram or over a persistent TCP connection. Frames go through the same
+# write path as /api/ingest (the write-behind writer, or write_samples).
+#
+# Frame, network byte order, prefixed by its length as uint16:
+#
+#   magic      2s   b"GL"
+#   version    B    1
+#   flags      B    bit 0: acknowledge this frame
+#   session    I    random, chosen by the sensor at boot
+#   seq        I    +1 per frame within a session
+#   ts_ms      q    reading time, unix milliseconds (UTC)
+#   device_id  B length + UTF-8
+#   count      B    number of measurements, then per measurement:
+#     metric   B length + UTF-8
+#     value    f    float32
+#   tag        16s  HMAC-SHA256(key, all of the above)[:16]
+#
+# A UDP datagram or TCP stream is any number of length-prefixed frames.
+# The key is the device's `ingest_key` in config.yaml; devices without one
+# cannot use the listener. Frames with a bad tag, a timestamp more than
+# max_skew_s from the server clock, or a (session, seq) already seen are
+# dropped. The last `window` sequence numbers of each of a device's last
+# `sessions` sessions are remembered (in memory), so datagrams may arrive
+# out of order or twice, and a frame replayed from an earlier session
+# cannot disturb the window of the current one.
+#
+# Acknowledgements, when asked for, are 9 bytes: status B, session I,
+# seq I, sent back as a datagram or on the TCP connection.
+
+import hashlib
+import hmac
+import logging
+import math
+import selectors
+import socket
+import struct
+import threading
+from collections import OrderedDict
+
+from settings import cfg
+from storage import now_ms
+from write_behind import writer, QueueFull
+from metrics import registry
+
+log = logging.getLogger(__name__)
+
+MAGIC   = b"GL"
+VERSION = 1
+FLAG_ACK = 0x01
+
+LENGTH = struct.Struct('!H')
+HEADER = struct.Struct('!2sBBIIq')
+VALUE  = struct.Struct('!f')
+ACK    = struct.Struct('!BII')
+TAG_SIZE = 16
+
+# Acknowledgement status codes
+OK, DUPLICATE, BAD_TAG, INVALID, BUSY = range(5)
+
+frames_total = registry.counter(
+    'growlab_binary_ingest_frames_total', "Binary ingest frames by transport and outcome.",
+    labels=('transport', 'result'))
+
+RESULTS = {OK: "ok", DUPLICATE: "duplicate", BAD_TAG: "bad_tag", INVALID: "invalid", BUSY: "busy"}
+
+class FrameError(ValueError):
+    """A frame that cannot be decoded."""
+
+def ingest_keys(config):
+    """{device_id: key bytes} for every device with an ingest_key."""
+    return {d['id']: str(d['ingest_key']).encode() for d in config.get('devices', [])
+            if d.get('ingest_key')}
+
+def _sign(key, body):
+    return hmac.new(key, body, hashlib.sha256).digest()[:TAG_SIZE]
+
+def _name(text):
+    data = text.encode()
+    if len(data) > 255:
+        raise ValueError(f"name too long: {text!r}")
+    return bytes([len(data)]) + data
+
+def encode_frame(key, device_id, session, seq, ts_ms, measurements, flags=0):
+    """One length-prefixed frame (for clients, tests and the benchmark)."""
+    body = HEADER.pack(MAGIC, VERSION, flags, session, seq, ts_ms) + _name(device_id)
+    body += bytes([len(measurements)])
+    for metric, value in measurements.items():
+        body += _name(metric) + VALUE.pack(value)
+    frame = body + _sign(key, body)
+    return LENGTH.pack(len(frame)) + frame
+
+def decode_frame(frame):
+    """
+    Split a frame (without its length prefix) into
+    (header fields, device_id, measurements, signed body, tag).
+    Raises FrameError if it is malformed.
+    """
+    try:
+        magic, version, flags, session, seq, ts_ms = HEADER.unpack_from(frame)
+        if magic != MAGIC or version != VERSION:
+            raise FrameError("not a version 1 frame")
+        pos = HEADER.size
+        n = frame[pos]
+        device_id = frame[pos + 1:pos + 1 + n].decode()
+        pos += 1 + n
+        count = frame[pos]
+        pos += 1
+        measurements = {}
+        for _ in range(count):
+            n = frame[pos]
+            metric = frame[pos + 1:pos + 1 + n].decode()
+            pos += 1 + n
+            measurements[metric] = VALUE.unpack_from(frame, pos)[0]
+            pos += VALUE.size
+    except (struct.error, IndexError, UnicodeDecodeError) as e:
+        raise FrameError(f"truncated or garbled frame: {e}") from e
+    if len(frame) != pos + TAG_SIZE:
+        raise FrameError("frame length does not match its contents")
+    return (flags, session, seq, ts_ms), device_id, measurements, frame[:pos], frame[pos:]
+
+def split_frames(buffer):
+    """Complete length-prefixed frames at the start of buffer, and the unused rest."""
+    frames, pos = [], 0
+    while len(buffer) - pos >= LENGTH.size:
+        (size,) = LENGTH.unpack_from(buffer, pos)
+        if len(buffer) - pos - LENGTH.size < size:
+            break
+        frames.append(bytes(buffer[pos + LENGTH.size:pos + LENGTH.size + size]))
+        pos += LENGTH.size + size
+    return frames, buffer[pos:]
+
+class ReplayWindow:
+    """
+    Sequence numbers seen in one session of one device: the highest one
+    and a bitmask of the `size` before it.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.top = -1
+        self.mask = 0
+
+    def seen(self, seq):
+        if seq > self.top:
+            return False
+        if self.top - seq >= self.size:
+            return True   # too old to tell; treat as a replay
+        return bool(self.mask >> (self.top - seq) & 1)
+
+    def mark(self, seq):
+        if seq > self.top:
+            self.mask = (self.mask << (seq - self.top) | 1) & ((1 << self.size) - 1)
+            self.top = seq
+        else:
+            self.mask |= 1 << (self.top - seq)
+
+class BinaryIngestListener:
+    """
+    Serves the UDP and TCP ports from one selector thread. Every frame
+    readable at once (several datagrams, or everything buffered on the
+    TCP connections) is verified and written as one batch, and only then
+    acknowledged and marked as seen, so a frame refused for lack of queue
+    room can simply be sent again.
+    """
+
+    def __init__(self, enabled=False, host='0.0.0.0', udp_port=5001, tcp_port=5001,
+                 max_skew_s=300, window=64, sessions=4, max_batch=500):
+        self.enabled = enabled
+        self.host = host
+        self.udp_port = udp_port
+        self.tcp_port = tcp_port
+        self.max_skew_s = max_skew_s
+        self.window = window
+        self.sessions = sessions
+        self.max_batch = max_batch
+        self.keys = {}
+        self._windows = {}   # device_id -> OrderedDict(session -> ReplayWindow), newest last
+        self._selector = None
+        self._udp = None
+        self._tcp = None
+        self._buffers = {}
+        self._thread = None
+        self._running = False
+
+    def set_keys(self, keys):
+        """Replace the device keys (start() and config reloads)."""
+        self.keys = dict(keys)
+
+    def start(self, keys):
+        """Bind the ports and start serving (idempotent; a no-op when disabled)."""
+        self.set_keys(keys)
+        if not self.enabled or self._thread is not None:
+            return
+        self._selector = selectors.DefaultSelector()
+        if self.udp_port:
+            self._udp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self._udp.bind((self.host, self.udp_port))
+            self._udp.setblocking(False)
+            self._selector.register(self._udp, selectors.EVENT_READ, 'udp')
+        if self.tcp_port:
+            self._tcp = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self._tcp.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            self._tcp.bind((self.host, self.tcp_port))
+            self._tcp.listen()
+            self._tcp.setblocking(False)
+            self._selector.register(self._tcp, selectors.EVENT_READ, 'accept')
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="binary-ingest", daemon=True)
+        self._thread.start()
+        log.info("Binary ingest listening on %s (udp %s, tcp %s)",
+                 self.host, self.udp_port or '-', self.tcp_port or '-')
+
+    def stop(self):
+        self._running = False
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+        for sock in [self._udp, self._tcp, *self._buffers]:
+            if sock is not None:
+                sock.close()
+        self._udp = self._tcp = None
+        self._buffers.clear()
+        if self._selector is not None:
+            self._selector.close()
+            self._selector = None
+
+    def stats(self):
+        return {"enabled": self.enabled, "running": self._thread is not None,
+                "udp_port": self.udp_port, "tcp_port": self.tcp_port,
+                "devices": sorted(self.keys), "connections": len(self._buffers)}
+
+    def _run(self):
+        while self._running:
+            # frames: [(frame, transport, reply target)]
+            frames = []
+            for key, _ in self._selector.select(timeout=0.5):
+                if key.data == 'udp':
+                    self._read_udp(frames)
+                elif key.data == 'accept':
+                    self._accept()
+                else:
+                    self._read_tcp(key.fileobj, frames)
+            if frames:
+                try:
+                    self.handle(frames)
+                except Exception as e:
+                    log.error("Error handling binary ingest frames: %s", e)
+
+    def _read_udp(self, frames):
+        while len(frames) < self.max_batch:
+            try:
+                datagram, addr = self._udp.recvfrom(65535)
+            except BlockingIOError:
+                return
+            chunk, _ = split_frames(datagram)
+            frames.extend((frame, 'udp', addr) for frame in chunk)
+
+    def _accept(self):
+        try:
+            conn, addr = self._tcp.accept()
+        except BlockingIOError:
+            return
+        conn.setblocking(False)
+        conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._buffers[conn] = bytearray()
+        self._selector.register(conn, selectors.EVENT_READ, 'tcp')
+
+    def _read_tcp(self, conn, frames):
+        try:
+            data = conn.recv(65536)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            data = b''
+        if not data:
+            self._selector.unregister(conn)
+            self._buffers.pop(conn, None)
+            conn.close()
+            return
+        chunk, rest = split_frames(self._buffers[conn] + data)
+        self._buffers[conn] = bytearray(rest)
+        frames.extend((frame, 'tcp', conn) for frame in chunk)
+
+    def handle(self, frames):
+        """Verify, deduplicate, write and acknowledge one batch of frames."""
+        now = now_ms()
+        accepted = []     # (device_id, session, seq, reply)
+        rows = []
+        pending = set()   # (device_id, session, seq) accepted in this batch
+        replies = []
+        for frame, transport, target in frames:
+            status, fields, device_id, measurements = self._check(frame, now)
+            if status == OK and (device_id, fields[1], fields[2]) in pending:
+                status = DUPLICATE
+            if status == OK:
+                _, session, seq, ts_ms = fields
+                pending.add((device_id, session, seq))
+                accepted.append((device_id, session, seq, transport))
+                rows.extend((device_id, ts_ms, metric, value)
+                            for metric, value in measurements.items())
+            else:
+                frames_total.inc(transport=transport, result=RESULTS[status])
+            # Only authenticated frames are answered, so spoofed datagrams
+            # cannot make us send to third parties
+            if status != BAD_TAG and fields is not None and fields[0] & FLAG_ACK:
+                replies.append((status, fields[1], fields[2], transport, target))
+
+        busy = False
+        if rows:
+            try:
+                writer.submit(rows)
+            except QueueFull:
+                busy = True
+            except Exception as e:
+                log.error("Error writing binary ingest batch: %s", e)
+                busy = True
+        for device_id, session, seq, transport in accepted:
+            if not busy:
+                self._mark(device_id, session, seq)
+            frames_total.inc(transport=transport, result="busy" if busy else "ok")
+
+        for status, session, seq, transport, target in replies:
+            if status == OK and busy:
+                status = BUSY
+            self._reply(transport, target, ACK.pack(status, session, seq))
+
+    def _check(self, frame, now):
+        """(status, header fields or None, device_id, measurements) of one frame."""
+        try:
+            fields, device_id, measurements, body, tag = decode_frame(frame)
+        except FrameError as e:
+            log.debug("Dropping binary ingest frame: %s", e)
+            return INVALID, None, None, None
+        key = self.keys.get(device_id)
+        if key is None or not hmac.compare_digest(_sign(key, body), tag):
+            log.warning("Dropping binary ingest frame for %r: unknown device or bad tag", device_id)
+            return BAD_TAG, fields, device_id, None
+        _, session, seq, ts_ms = fields
+        # Same rules as /api/ingest: named, finite measurements only
+        if abs(ts_ms - now) > self.max_skew_s * 1000 or not measurements or \
+                not all(metric.strip() and math.isfinite(value)
+                        for metric, value in measurements.items()):
+            # Authentic but unusable: answered (as INVALID) so the sensor can tell
+            return INVALID, fields, device_id, None
+        window = self._windows.get(device_id, {}).get(session)
+        if window is not None and window.seen(seq):
+            return DUPLICATE, fields, device_id, None
+        return OK, fields, device_id, measurements
+
+    def _mark(self, device_id, session, seq):
+        """Record an accepted frame, keeping windows for the newest `sessions` sessions."""
+        windows = self._windows.setdefault(device_id, OrderedDict())
+        window = windows.get(session)
+        if window is None:
+            window = windows[session] = ReplayWindow(self.window)
+            while len(windows) > self.sessions:
+                windows.popitem(last=False)
+        window.mark(seq)
+
+    def _reply(self, transport, target, ack):
+        try:
+            if transport == 'udp':
+                self._udp.sendto(ack, target)
+            else:
+                target.send(ack)
+        except OSError as e:
+            log.debug("Could not acknowledge a binary ingest frame: %s", e)
+
+# Shared instance; started with the collector (app.start_background)
+listener = BinaryIngestListener(**cfg.get('binary_ingest', {}))
@@ -0,0 +1,146 @@
+# buses.py — I²C bus backends: real hardware via smbus2, or a simulated bus of SHT40s
+
+import math
+import random
+import threading
+import time
+
+from settings import cfg
+
+def crc8(data):
+    """Sensirion CRC-8 (polynomial 0x31, init 0xFF) over a byte sequence."""
+    crc = 0xFF
+    for byte in data:
+        crc ^= byte
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x31) & 0xFF if crc & 0x80 else (crc << 1) & 0xFF
+    return crc
+
+class SMBusBackend:
+    """A Linux I²C adapter, through one open smbus2 handle."""
+
+    def __init__(self, bus_number):
+        # Imported here so the simulated backend runs without smbus2
+        from smbus2 import SMBus, i2c_msg
+        self._i2c_msg = i2c_msg
+        self._bus = SMBus(bus_number)
+
+    def write(self, address, data):
+        self._bus.i2c_rdwr(self._i2c_msg.write(address, list(data)))
+
+    def read(self, address, length):
+        msg = self._i2c_msg.read(address, length)
+        self._bus.i2c_rdwr(msg)
+        return bytes(msg)
+
+    def close(self):
+        self._bus.close()
+
+# Synthetic waveforms: f(phase) with phase in [0, 1), output in [-1, 1]
+WAVEFORMS = {
+    "sine":     lambda p: math.sin(2 * math.pi * p),
+    "square":   lambda p: 1.0 if p < 0.5 else -1.0,
+    "sawtooth": lambda p: 2 * p - 1,
+    "triangle": lambda p: 1 - 4 * abs(p - 0.5),
+    "constant": lambda p: 0.0,
+}
+
+class SimulatedSHT40:
+    """
+    One virtual SHT40. Behaves like the chip on the wire: a measure
+    command starts a conversion, reading before it finishes is NACKed
+    (OSError), and results come back as two 16-bit words each followed by
+    its CRC. Values follow the configured waveform, sampled at the moment
+    the conversion was triggered.
+    """
+
+    MEAS_CMDS = {0xFD, 0xF6, 0xE0}   # high / medium / low repeatability
+
+    def __init__(self, address, sim_cfg, rnd):
+        self.address = address
+        self.delay_s = sim_cfg.get('conversion_delay_s', 0.0083)
+        self.period_s = sim_cfg.get('period_s', 86400)
+        self.wave = WAVEFORMS[sim_cfg.get('waveform', 'sine')]
+        self.noise = sim_cfg.get('noise', 0.05)
+        self.temperature = sim_cfg.get('temperature', {'base': 24.0, 'amplitude': 4.0})
+        self.humidity = sim_cfg.get('humidity', {'base': 55.0, 'amplitude': 10.0})
+        # Spread sensors out so they don't all move in lockstep
+        self.phase = rnd.random()
+        self.rnd = rnd
+        self._triggered_at = None
+
+    def _value(self, spec, t, invert=False):
+        phase = (t / self.period_s + self.phase) % 1.0
+        wave = self.wave(phase) * (-1 if invert else 1)
+        return spec.get('base', 0.0) + spec.get('amplitude', 0.0) * wave + self.rnd.gauss(0, self.noise)
+
+    def write(self, data):
+        if not data or data[0] not in self.MEAS_CMDS:
+            raise OSError(f"SHT40 at 0x{self.address:02x}: unsupported command {list(data)}")
+        self._triggered_at = time.time()
+        self._ready_at = time.monotonic() + self.delay_s
+
+    def read(self, length):
+        if self._triggered_at is None or time.monotonic() < self._ready_at:
+            raise OSError(f"SHT40 at 0x{self.address:02x}: NACK (no conversion ready)")
+        t = self._triggered_at
+        self._triggered_at = None
+
+        # Humidity runs opposite to temperature, as it does in a real room
+        temperature = self._value(self.temperature, t)
+        humidity = min(100.0, max(0.0, self._value(self.humidity, t, invert=True)))
+
+        # Inverse of the datasheet conversion used by the driver
+        t_raw = min(65535, max(0, round((temperature + 45) * 65535 / 175)))
+        h_raw = min(65535, max(0, round(humidity * 65535 / 100)))
+        frame = bytearray()
+        for word in (t_raw, h_raw):
+            pair = bytes((word >> 8, word & 0xFF))
+            frame += pair + bytes((crc8(pair),))
+        return bytes(frame[:length])
+
+class SimulatedBus:
+    """
+    A bus on which every 7-bit address answers as a virtual SHT40, so any
+    number of sensors (up to 112 per bus) can be configured without
+    hardware. Each bus gets its own seeded random stream.
+    """
+
+    def __init__(self, bus_number, sim_cfg=None):
+        self.bus_number = bus_number
+        self.sim_cfg = sim_cfg if sim_cfg is not None else (cfg.get('sensor', {}).get('simulated') or {})
+        self._rnd = random.Random(self.sim_cfg.get('seed', 0) * 1000 + bus_number)
+        self._devices = {}
+        self._lock = threading.Lock()
+
+    def _device(self, address):
+        if not 0x08 <= address <= 0x77:
+            raise OSError(f"No device at 0x{address:02x} on simulated bus {self.bus_number}")
+        device = self._devices.get(address)
+        if device is None:
+            device = self._devices[address] = SimulatedSHT40(address, self.sim_cfg, self._rnd)
+        return device
+
+    def write(self, address, data):
+        with self._lock:
+            self._device(address).write(data)
+
+    def read(self, address, length):
+        with self._lock:
+            return self._device(address).read(length)
+
+    def close(self):
+        pass
+
+BACKENDS = {
+    "smbus2": SMBusBackend,
+    "simulated": SimulatedBus,
+}
+
+def open_bus(bus_number):
+    """Open bus `bus_number` with the backend named by sensor.backend in config.yaml."""
+    name = cfg.get('sensor', {}).get('backend', 'smbus2')
+    backend = BACKENDS.get(name)
+    if backend is None:
+        raise ValueError(f"Unknown I²C bus backend: {name}")
+    return backend(bus_number)
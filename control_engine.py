@@ -0,0 +1,241 @@
+# control_engine.py — Event-driven evaluation of sensor → device control rules
+
+import queue
+import logging
+import threading
+import time
+
+from events import bus
+from latest import latest
+from storage import publish_event
+from metrics import registry
+import outbox
+
+log = logging.getLogger(__name__)
+
+eval_lag_seconds = registry.histogram(
+    'growlab_control_eval_lag_seconds',
+    "Time from a reading being committed to its control rules being evaluated.")
+evaluations_total = registry.counter(
+    'growlab_control_evaluations_total', "Control rule evaluations.",
+    labels=('control', 'action'))
+sweeps_total = registry.counter(
+    'growlab_control_sweeps_total', "Safety sweeps over every enabled rule.")
+
+# Comparison operators a control config may use
+OPERATORS = {
+    ">":  lambda value, target: value > target,
+    ">=": lambda value, target: value >= target,
+    "<":  lambda value, target: value < target,
+    "<=": lambda value, target: value <= target,
+    "=":  lambda value, target: abs(value - target) < 0.01,
+}
+
+class ControlEngine:
+    """
+    Single evaluator for every control rule.
+
+    Control configs are kept in memory and indexed by the (sensor_id,
+    metric) pair they watch. One worker thread consumes 'reading' events
+    from the event bus and evaluates only the rules bound to the pairs in
+    that reading, as soon as it is committed. A periodic safety sweep
+    re-evaluates every enabled rule from the latest-value cache, covering
+    anything missed (e.g. events dropped under load).
+    """
+
+    def __init__(self, sweep_interval_s=60):
+        self.sweep_interval_s = sweep_interval_s
+        self._configs = {}    # control_id -> config dict
+        self._actuators = {}  # control_id -> callable(device_id, on) -> bool
+        self._bindings = {}   # (sensor_id, metric) -> {control_id, ...}
+        self._lock = threading.Lock()
+        self._thread = None
+        self._running = False
+
+        # Evaluation latency (commit of a reading -> its rules evaluated)
+        # is recorded in eval_lag_seconds; these add last/max for stats()
+        self.evaluations = 0
+        self.sweeps = 0
+        self.last_latency_ms = None
+        self.max_latency_ms = 0.0
+
+    # — configuration —
+
+    def register(self, control_id, config, actuate):
+        """Add or replace a control rule and the callable that drives its device."""
+        with self._lock:
+            self._actuators[control_id] = actuate
+            self._set_config(control_id, config)
+
+    def replace_all(self, rules):
+        """
+        Make {control_id: (config, actuate)} the complete rule set at once,
+        dropping every rule not in it (config reload: removed or renamed
+        controls must stop driving their devices).
+        """
+        configs = {cid: dict(config) for cid, (config, _) in rules.items()}
+        bindings = {}
+        for cid, config in configs.items():
+            bindings.setdefault((config.get("sensor_id"), config.get("metric")), set()).add(cid)
+        with self._lock:
+            self._configs = configs
+            self._actuators = {cid: actuate for cid, (_, actuate) in rules.items()}
+            self._bindings = bindings
+
+    def update(self, control_id, config):
+        """Apply an updated config and evaluate it straight away."""
+        with self._lock:
+            self._set_config(control_id, config)
+        self.evaluate(control_id)
+
+    def _set_config(self, control_id, config):
+        old = self._configs.get(control_id)
+        if old:
+            key = (old.get("sensor_id"), old.get("metric"))
+            self._bindings.get(key, set()).discard(control_id)
+        self._configs[control_id] = dict(config)
+        key = (config.get("sensor_id"), config.get("metric"))
+        self._bindings.setdefault(key, set()).add(control_id)
+
+    def configs(self):
+        with self._lock:
+            return {cid: dict(cfg) for cid, cfg in self._configs.items()}
+
+    # — evaluation —
+
+    def evaluate(self, control_id, value=None):
+        """
+        Evaluate one rule against `value` (or the latest cached reading)
+        and drive its device. Returns the decision, or None if the rule is
+        disabled, incomplete or has no reading yet.
+        """
+        with self._lock:
+            config = self._configs.get(control_id)
+            actuate = self._actuators.get(control_id)
+        if not config or not config.get("enabled") or actuate is None:
+            return None
+
+        sensor_id = config.get("sensor_id")
+        device_id = config.get("device_id")
+        metric = config.get("metric")
+        operator = config.get("operator")
+        if not sensor_id or not device_id or not metric or operator not in OPERATORS:
+            return None
+
+        if value is None:
+            entry = latest.get(sensor_id, metric)
+            if entry is None:
+                return None
+            value = entry[1]
+
+        target_value = float(config.get("target_value", 0))
+        should_turn_on = OPERATORS[operator](float(value), target_value)
+
+        # A split-mode collector whose lease lapsed must not actuate
+        if not outbox.may_drive():
+            return None
+
+        # Control the device based on condition
+        success = actuate(device_id, should_turn_on)
+        self.evaluations += 1
+        evaluations_total.inc(control=control_id, action="on" if should_turn_on else "off")
+        publish_event('control', {
+            "control_id": control_id,
+            "sensor_id": sensor_id,
+            "device_id": device_id,
+            "metric": metric,
+            "value": value,
+            "operator": operator,
+            "target_value": target_value,
+            "action": "on" if should_turn_on else "off",
+            "success": bool(success)
+        })
+        return should_turn_on
+
+    def on_reading(self, data, published_at=None):
+        """Evaluate the rules bound to each metric of a committed reading."""
+        device_id = data.get("device_id")
+        evaluated = False
+        for metric, value in data.get("values", {}).items():
+            with self._lock:
+                control_ids = list(self._bindings.get((device_id, metric), ()))
+            for control_id in control_ids:
+                if not evaluated and published_at is not None:
+                    # Lag from commit to the first rule evaluation
+                    self._record_latency((time.monotonic() - published_at) * 1000)
+                evaluated = True
+                try:
+                    self.evaluate(control_id, value)
+                except Exception as e:
+                    log.error("Error evaluating control %s: %s", control_id, e)
+
+    def sweep(self):
+        """Safety sweep: re-evaluate every enabled rule from the latest cache."""
+        for control_id in list(self.configs()):
+            try:
+                self.evaluate(control_id)
+            except Exception as e:
+                log.error("Error evaluating control %s: %s", control_id, e)
+        self.sweeps += 1
+        sweeps_total.inc()
+
+    def _record_latency(self, latency_ms):
+        eval_lag_seconds.observe(latency_ms / 1000)
+        self.last_latency_ms = latency_ms
+        self.max_latency_ms = max(self.max_latency_ms, latency_ms)
+
+    def stats(self):
+        """Counters and evaluation-latency figures for diagnostics."""
+        count, total_s = eval_lag_seconds.totals()
+        return {
+            "controls": len(self._configs),
+            "evaluations": self.evaluations,
+            "sweeps": self.sweeps,
+            "latency_ms": {
+                "last": self.last_latency_ms,
+                "avg": total_s * 1000 / count if count else None,
+                "max": self.max_latency_ms if count else None,
+                "samples": count
+            }
+        }
+
+    # — worker —
+
+    def start(self):
+        """Start the worker thread (idempotent)."""
+        if self._thread is not None:
+            return
+        self._running = True
+        self._sub = bus.subscribe(maxsize=1024)
+        self._thread = threading.Thread(target=self._run, name="control-engine", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._running = False
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            bus.unsubscribe(self._sub)
+            self._thread = None
+
+    def _run(self):
+        next_sweep = time.monotonic() + self.sweep_interval_s
+        while self._running:
+            timeout = max(0.0, next_sweep - time.monotonic())
+            try:
+                event_type, data, published_at = self._sub.get(timeout=min(timeout, 1.0))
+                if event_type == 'reading':
+                    self.on_reading(data, published_at)
+                elif event_type == 'control_config':
+                    # Changed in another process (split mode)
+                    self.update(data["control_id"], data)
+            except queue.Empty:
+                pass
+            except Exception as e:
+                log.error("Error in control engine: %s", e)
+
+            if time.monotonic() >= next_sweep:
+                self.sweep()
+                next_sweep = time.monotonic() + self.sweep_interval_s
+
+# Shared instance for the whole process
+engine = ControlEngine()
@@ -1,13 +1,8 @@
 # controller.py
 
-import yaml
-import sqlite3
-from datetime import datetime
 #from gosundpy.plug import Plug
 
-# Load configuration
-cfg = yaml.safe_load(open('config.yaml'))
-DB = cfg.get('DATABASE', 'data.db')
+from storage import log_device_state
 
 # Initialize plugs from config
 #plugs_cfg = cfg.get('plugs', {})
@@ -18,21 +13,7 @@ def log_device(device_id: str, state: str):
     """
     Append a record of each on/off event to the device_logs table.
     """
-    conn = sqlite3.connect(DB)
-    conn.execute("""
-        CREATE TABLE IF NOT EXISTS device_logs(
-            ts         TEXT,
-            device_id  TEXT,
-            state      TEXT
-        )
-    """)
-    ts = datetime.utcnow().isoformat()
-    conn.execute(
-        "INSERT INTO device_logs(ts, device_id, state) VALUES (?, ?, ?)",
-        (ts, device_id, state)
-    )
-    conn.commit()
-    conn.close()
+    log_device_state(device_id, state)
 
 def set_device(device_id: str, on: bool):
     """
@@ -0,0 +1,116 @@
+# daemon.py — Collector/controller process for split mode
+#
+#   python daemon.py
+#
+# With `process.mode: split` in config.yaml the web tier (app.py, under
+# any number of WSGI workers) no longer reads sensors or drives plugs.
+# This process does: it reads the I²C bus on schedule, runs retention and
+# the control engine, and executes plug commands the web workers send
+# through the event outbox.
+#
+# Any number of copies may run; they elect one leader through the
+# `collector` lease in the database. The others wait as hot standbys and
+# take over within lease_ttl_s of the leader going away. A leader that
+# fails to renew its lease stops at once and exits, so two processes
+# never own the bus and the plugs at the same time.
+
+import logging
+import signal
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import app
+import outbox
+from lease import Lease
+from settings import cfg
+from storage import SPLIT, publish_event
+from write_behind import writer
+
+log = logging.getLogger('daemon')
+
+LEASE_TTL_S = (cfg.get('process') or {}).get('lease_ttl_s', 15)
+
+def find_device(device_id):
+    """The current widget that drives device_id, or None."""
+    for widget in app.widgets:
+        if widget.device_info.get('id') == device_id and hasattr(widget, 'set_device_state'):
+            return widget
+    return None
+
+def run_command(data):
+    """Execute a plug command from a web worker and publish the outcome."""
+    widget = find_device(data["device_id"])
+    if widget is None:
+        log.error("Command for unknown device %s", data["device_id"])
+        success = False
+    else:
+        success = widget.set_device_state(data["on"], force=data.get("force", False))
+    publish_event('command_result', {
+        "command_id": data["command_id"],
+        "device_id": data["device_id"],
+        "success": bool(success)
+    })
+
+def terminate(signum, frame):
+    raise SystemExit(0)
+
+def main():
+    if not SPLIT:
+        sys.exit("daemon.py needs `process: {mode: split}` in config.yaml; "
+                 "in single mode app.py runs the collector itself")
+
+    # Stop on SIGTERM like on Ctrl-C: unwind through the finally below
+    signal.signal(signal.SIGTERM, terminate)
+
+    # Database, caches, widgets (which register the control rules) and
+    # the outbox tail, but none of the background work yet
+    app.start(background=False)
+
+    lease = Lease(app.COLLECTOR_LEASE, ttl_s=LEASE_TTL_S)
+    renew_s = LEASE_TTL_S / 3
+    log.info("Waiting for the %s lease as %s", app.COLLECTOR_LEASE, lease.owner)
+    while not lease.try_acquire():
+        time.sleep(renew_s)
+    log.info("Holding the %s lease; starting collection and controls", app.COLLECTOR_LEASE)
+
+    outbox.lease = lease
+    outbox.owner = True
+    # Commands block on the plug's round trip, so they get a thread of
+    # their own instead of holding up event delivery
+    commands = ThreadPoolExecutor(max_workers=1, thread_name_prefix="command")
+    outbox.tail.on('command', lambda data: commands.submit(run_command, data))
+    app.start_background()
+
+    lost = False
+    try:
+        while True:
+            time.sleep(renew_s)
+            # If we stalled past the TTL, collection and actuation have
+            # been fenced off (outbox.may_drive()) since it lapsed; renew()
+            # tells whether another instance took over meanwhile
+            if not lease.held:
+                log.warning("The %s lease lapsed (stalled for over %ss); renewing",
+                            app.COLLECTOR_LEASE, LEASE_TTL_S)
+            if not lease.renew():
+                log.error("Lost the %s lease; stopping so the new holder has the hardware alone",
+                          app.COLLECTOR_LEASE)
+                lost = True
+                break
+            app.reload_if_changed()
+    finally:
+        app.sched.shutdown(wait=False)
+        app.engine.stop()
+        app.poller.stop()
+        app.listener.stop()
+        commands.shutdown(wait=True)
+        outbox.owner = False
+        outbox.lease = None
+        if not lost:
+            lease.release()
+        writer.stop()
+    if lost:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+# downsample.py — Largest-Triangle-Three-Buckets reduction for chart series
+
+from array import array
+from itertools import islice
+
+def lttb(points, n, threshold):
+    """
+    Reduce a time-ordered stream of (x, y) points to `threshold` points
+    while keeping its visual shape (peaks and dips survive, unlike
+    every-Nth-point striding).
+
+    Streaming: `points` may be a lazy iterator such as a database cursor,
+    and only two buckets are held in memory at a time, stored as parallel
+    float arrays rather than per-point objects. `n` is the number of
+    points the stream will produce (a cheap COUNT on the same range); if
+    the stream turns out shorter, the remaining buckets simply come out
+    empty and are skipped.
+
+    Yields the selected (x, y) points in order.
+    """
+    it = iter(points)
+    if threshold >= n or threshold < 3:
+        yield from it
+        return
+
+    first = next(it, None)
+    if first is None:
+        return
+    yield first
+    a_x, a_y = first
+
+    # Bucket k covers stream positions [bound(k), bound(k + 1)); the first
+    # and last points sit in their own single-point buckets.
+    every = (n - 2) / (threshold - 2)
+    def bound(k):
+        return n - 1 if k == threshold - 2 else int(k * every) + 1
+
+    def buckets():
+        for k in range(threshold - 2):
+            xs, ys = array('d'), array('d')
+            for x, y in islice(it, bound(k + 1) - bound(k)):
+                xs.append(x)
+                ys.append(y)
+            yield xs, ys
+        # Whatever is left is the final point (normally exactly one)
+        xs, ys = array('d'), array('d')
+        for x, y in it:
+            xs, ys = array('d', [x]), array('d', [y])
+        yield xs, ys
+
+    stream = buckets()
+    cur_xs, cur_ys = next(stream)
+    for next_xs, next_ys in stream:
+        if cur_xs:
+            if next_xs:
+                c_x = sum(next_xs) / len(next_xs)
+                c_y = sum(next_ys) / len(next_ys)
+            else:
+                c_x, c_y = cur_xs[-1], cur_ys[-1]
+            # Twice the triangle area (a, p, c) is |k_x * p_x + k_y * p_y + k_0|
+            k_x = c_y - a_y
+            k_y = a_x - c_x
+            k_0 = -(k_x * a_x + k_y * a_y)
+            best, best_area = 0, -1.0
+            for j, (x, y) in enumerate(zip(cur_xs, cur_ys)):
+                area = abs(k_x * x + k_y * y + k_0)
+                if area > best_area:
+                    best, best_area = j, area
+            a_x, a_y = cur_xs[best], cur_ys[best]
+            yield a_x, a_y
+        cur_xs, cur_ys = next_xs, next_ys
+
+    if cur_xs:
+        yield cur_xs[-1], cur_ys[-1]
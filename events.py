@@ -0,0 +1,75 @@
+# events.py — In-process publish/subscribe bus for readings, device and control events
+
+import queue
+import threading
+import time
+
+class Subscription:
+    """
+    One subscriber's bounded queue of (event_type, data, published_at)
+    tuples, optionally limited to events that mention one of `devices`.
+    published_at is a time.monotonic() stamp taken when the event was
+    published, so consumers can measure how far behind they are.
+    """
+
+    def __init__(self, devices=None, maxsize=256):
+        self.devices = set(devices) if devices else None
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.dropped = 0
+
+    def matches(self, data):
+        if self.devices is None:
+            return True
+        return any(
+            data.get(key) in self.devices
+            for key in ('device_id', 'sensor_id', 'control_id')
+        )
+
+    def get(self, timeout=None):
+        """
+        Block for the next (event_type, data, published_at); raises
+        queue.Empty on timeout.
+        """
+        return self.queue.get(timeout=timeout)
+
+class EventBus:
+    """
+    Fan-out of committed changes to any number of subscribers (SSE
+    streams, the control engine, ...). Publishing never blocks: a
+    subscriber that falls behind loses its oldest events instead.
+    """
+
+    def __init__(self):
+        self._subscribers = set()
+        self._lock = threading.Lock()
+
+    def subscribe(self, devices=None, maxsize=256):
+        sub = Subscription(devices, maxsize)
+        with self._lock:
+            self._subscribers.add(sub)
+        return sub
+
+    def unsubscribe(self, sub):
+        with self._lock:
+            self._subscribers.discard(sub)
+
+    def publish(self, event_type, data):
+        published_at = time.monotonic()
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for sub in subscribers:
+            if not sub.matches(data):
+                continue
+            while True:
+                try:
+                    sub.queue.put_nowait((event_type, data, published_at))
+                    break
+                except queue.Full:
+                    try:
+                        sub.queue.get_nowait()
+                        sub.dropped += 1
+                    except queue.Empty:
+                        pass
+
+# Shared instance for the whole process
+bus = EventBus()
@@ -0,0 +1,64 @@
+# latest.py — Process-wide cache of the most recent value per (device_id, metric)
+
+import threading
+
+class LatestValues:
+    """
+    Thread-safe map of (device_id, metric) -> (ts_ms, value).
+    Fed by storage.write_samples after each commit, so readers never need
+    to touch SQLite for the current value.
+    """
+
+    def __init__(self):
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def update(self, rows):
+        """Record (device_id, ts_ms, metric, value) rows, keeping the newest per key."""
+        with self._lock:
+            for device_id, ts_ms, metric, value in rows:
+                key  = (device_id, metric)
+                prev = self._values.get(key)
+                if prev is None or ts_ms >= prev[0]:
+                    self._values[key] = (ts_ms, value)
+
+    def get(self, device_id, metric):
+        """Return (ts_ms, value) or None if nothing has been seen yet."""
+        return self._values.get((device_id, metric))
+
+    def device(self, device_id):
+        """Return {metric: (ts_ms, value)} for one device."""
+        with self._lock:
+            return {
+                metric: entry for (dev, metric), entry in self._values.items()
+                if dev == device_id
+            }
+
+    def snapshot(self):
+        """Return a copy of every cached entry."""
+        with self._lock:
+            return dict(self._values)
+
+    def load_from_db(self, conn):
+        """
+        Seed the cache with the newest sample of every series. Each lookup
+        is a single seek to the end of that series' clustered range.
+        """
+        rows = conn.execute("""
+            SELECT d.name, m.name,
+                   (SELECT ts    FROM samples x WHERE x.series_id = s.series_id
+                     ORDER BY ts DESC LIMIT 1) AS ts,
+                   (SELECT value FROM samples x WHERE x.series_id = s.series_id
+                     ORDER BY ts DESC LIMIT 1) AS value
+              FROM series s
+              JOIN devices d ON d.id = s.device
+              JOIN metrics m ON m.id = s.metric
+        """).fetchall()
+        self.update([
+            (device_id, ts, metric, value)
+            for device_id, metric, ts, value in rows
+            if ts is not None and value is not None
+        ])
+
+# Shared instance for the whole process
+latest = LatestValues()
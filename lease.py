@@ -0,0 +1,88 @@
+# lease.py — Leader election through a time-limited lease row in the database
+
+import logging
+import os
+import socket
+import time
+import uuid
+
+from storage import get_connection, now_ms
+
+log = logging.getLogger(__name__)
+
+class Lease:
+    """
+    A named lease in the `leases` table. Whoever holds an unexpired lease
+    is the leader; it must renew() well within ttl_s or another instance
+    may take over once the lease expires. Acquire and renew run under
+    BEGIN IMMEDIATE, so two contenders can never both succeed.
+
+    `held` is judged against our own monotonic clock from the moment the
+    last acquire/renew started, so a stalled leader stops considering
+    itself the leader no later than the database does. The collector
+    checks it (outbox.may_drive()) before every sensor read, plug poll
+    and actuation.
+    """
+
+    def __init__(self, name, ttl_s=15, owner=None):
+        self.name = name
+        self.ttl_s = ttl_s
+        self.owner = owner or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._valid_until = 0.0   # monotonic
+
+    @property
+    def held(self):
+        return time.monotonic() < self._valid_until
+
+    def try_acquire(self):
+        """Take the lease if it is free, expired or already ours. Returns True if held."""
+        started = time.monotonic()
+        now = now_ms()
+        conn = get_connection()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT owner, expires FROM leases WHERE name = ?", (self.name,)
+            ).fetchone()
+            if row is not None and row[0] != self.owner and row[1] > now:
+                return False
+            conn.execute(
+                "INSERT OR REPLACE INTO leases (name, owner, expires) VALUES (?, ?, ?)",
+                (self.name, self.owner, now + int(self.ttl_s * 1000))
+            )
+        if row is not None and row[0] != self.owner:
+            log.warning("Took over lease %s from %s (expired)", self.name, row[0])
+        self._valid_until = started + self.ttl_s
+        return True
+
+    def renew(self):
+        """Extend the lease; False if it was lost to another instance."""
+        started = time.monotonic()
+        conn = get_connection()
+        with conn:
+            renewed = conn.execute(
+                "UPDATE leases SET expires = ? WHERE name = ? AND owner = ?",
+                (now_ms() + int(self.ttl_s * 1000), self.name, self.owner)
+            ).rowcount == 1
+        if renewed:
+            self._valid_until = started + self.ttl_s
+        else:
+            self._valid_until = 0.0
+        return renewed
+
+    def release(self):
+        """Give the lease up so a standby can take over at once."""
+        self._valid_until = 0.0
+        conn = get_connection()
+        with conn:
+            conn.execute("DELETE FROM leases WHERE name = ? AND owner = ?",
+                         (self.name, self.owner))
+
+    def holder(self):
+        """{"owner", "expires_in_s"} of the current lease row, or None."""
+        row = get_connection().execute(
+            "SELECT owner, expires FROM leases WHERE name = ?", (self.name,)
+        ).fetchone()
+        if row is None:
+            return None
+        return {"owner": row[0], "expires_in_s": (row[1] - now_ms()) / 1000}
@@ -0,0 +1,72 @@
+# logs.py — Leveled, rate-limited logging for the collector, controls and web app
+
+import logging
+import threading
+import time
+
+from metrics import registry
+
+suppressed_total = registry.counter(
+    'growlab_log_suppressed_total',
+    "Log records dropped by the rate limiter.",
+    labels=('logger',))
+
+class RateLimitFilter(logging.Filter):
+    """
+    Lets at most `burst` records with the same logger and message template
+    through per `interval_s`. A sensor that fails every cycle logs a few
+    lines, then stays quiet; the next record let through carries the
+    number of lines suppressed in between. DEBUG records are not limited
+    (they are off by default).
+    """
+
+    def __init__(self, burst=5, interval_s=60):
+        super().__init__()
+        self.burst = burst
+        self.interval_s = interval_s
+        self._windows = {}   # (logger, msg) -> [window start, emitted, suppressed]
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno <= logging.DEBUG:
+            return True
+        key = (record.name, record.msg)
+        now = time.monotonic()
+        with self._lock:
+            window = self._windows.get(key)
+            if window is None or now - window[0] >= self.interval_s:
+                suppressed = window[2] if window else 0
+                window = self._windows[key] = [now, 0, 0]
+                if suppressed:
+                    record.msg = f"{record.msg} [{suppressed} similar suppressed]"
+            if window[1] >= self.burst:
+                window[2] += 1
+                suppressed_total.inc(logger=record.name)
+                return False
+            window[1] += 1
+        return True
+
+_configured = False
+
+def configure(log_cfg=None):
+    """
+    Set up the root logger once per process from the `logging:` section
+    of config.yaml (level, format, rate_limit_burst, rate_limit_interval_s).
+    """
+    global _configured
+    if _configured:
+        return
+    _configured = True
+    log_cfg = log_cfg or {}
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter(
+        log_cfg.get('format', '%(asctime)s %(levelname)s %(name)s: %(message)s')))
+    handler.addFilter(RateLimitFilter(
+        burst=log_cfg.get('rate_limit_burst', 5),
+        interval_s=log_cfg.get('rate_limit_interval_s', 60)))
+    root = logging.getLogger()
+    root.addHandler(handler)
+    root.setLevel(log_cfg.get('level', 'INFO'))
+    # APScheduler logs every job run at INFO; misfires and errors are
+    # counted in /metrics instead
+    logging.getLogger('apscheduler').setLevel(log_cfg.get('scheduler_level', 'WARNING'))
@@ -0,0 +1,116 @@
+# manage.py — Maintenance commands for the GrowLab database
+#
+#   python manage.py migrate [--batch-size N] [--drop-legacy]
+#   python manage.py rollup-backfill
+#   python manage.py device-stats-backfill
+#   python manage.py compact
+#   python manage.py enable-incremental-vacuum
+#   python manage.py archive-query DEVICE METRIC --from ISO [--to ISO]
+
+import argparse
+import json
+
+import storage
+
+def cmd_migrate(args):
+    """
+    Copy the legacy `readings` table into the compact samples schema.
+    Safe to run while the dashboard and collector are up, and resumable.
+    """
+    storage.init_db()
+    # The collector used to stamp local sensors with local time
+    local_devices = [
+        d['id'] for d in storage.cfg.get('devices', [])
+        if d.get('type') == 'sensor' and d.get('source', 'local') == 'local'
+    ]
+    copied = storage.migrate_legacy_readings(
+        batch_size=args.batch_size,
+        local_devices=local_devices,
+        drop=args.drop_legacy,
+        progress=lambda n: print(f"  {n} rows copied", end='\r')
+    )
+    print(f"Migrated {copied} readings")
+
+def cmd_rollup_backfill(args):
+    """
+    Rebuild the 1m/15m/1h/1d rollup tables from raw samples. Only needed
+    for data written before rollups existed; new writes maintain them.
+    """
+    storage.init_db()
+    count = storage.backfill_rollups(
+        progress=lambda done, total: print(f"  {done}/{total} series", end='\r')
+    )
+    print(f"Rebuilt rollups for {count} series")
+
+def cmd_device_stats_backfill(args):
+    """
+    Rebuild device on/off intervals and daily duty cycles from device_logs.
+    Only needed for logs written before they existed; new writes maintain them.
+    """
+    storage.init_db()
+    count = storage.backfill_device_stats(
+        progress=lambda done, total: print(f"  {done}/{total} devices", end='\r')
+    )
+    print(f"Rebuilt duty-cycle stats for {count} devices")
+
+def cmd_compact(args):
+    """Apply the retention policy now (the app also runs it on a schedule)."""
+    import retention
+    storage.init_db()
+    stats = retention.compact()
+    print(json.dumps(stats))
+
+def cmd_enable_incremental_vacuum(args):
+    """
+    Switch an existing database to auto_vacuum=INCREMENTAL. This rewrites
+    the whole file with VACUUM, so stop the app and collector first.
+    """
+    conn = storage.get_connection()
+    conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+    conn.execute("VACUUM")
+    print(f"auto_vacuum = {conn.execute('PRAGMA auto_vacuum').fetchone()[0]}")
+
+def cmd_archive_query(args):
+    """Print archived and live samples of one series as NDJSON."""
+    import retention
+    start = storage.to_epoch_ms(args.start)
+    end = storage.to_epoch_ms(args.end) if args.end else storage.now_ms()
+    for ts, value in retention.iter_history(args.device_id, args.metric, start, end):
+        print(json.dumps({"ts": storage.ms_to_iso(ts), "value": value}))
+
+def main():
+    parser = argparse.ArgumentParser(description="GrowLab database maintenance")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p = sub.add_parser('migrate', help="migrate legacy readings to the samples schema")
+    p.add_argument('--batch-size', type=int, default=5000)
+    p.add_argument('--drop-legacy', action='store_true',
+                   help="drop the readings table once everything is copied")
+    p.set_defaults(func=cmd_migrate)
+
+    p = sub.add_parser('rollup-backfill', help="rebuild rollup tables from raw samples")
+    p.set_defaults(func=cmd_rollup_backfill)
+
+    p = sub.add_parser('device-stats-backfill',
+                       help="rebuild device intervals and daily duty cycles from device logs")
+    p.set_defaults(func=cmd_device_stats_backfill)
+
+    p = sub.add_parser('compact', help="archive and delete data past its retention")
+    p.set_defaults(func=cmd_compact)
+
+    p = sub.add_parser('enable-incremental-vacuum',
+                       help="convert the database so compaction can shrink the file")
+    p.set_defaults(func=cmd_enable_incremental_vacuum)
+
+    p = sub.add_parser('archive-query', help="read one series, archive included")
+    p.add_argument('device_id')
+    p.add_argument('metric')
+    p.add_argument('--from', dest='start', required=True, help="ISO timestamp (UTC)")
+    p.add_argument('--to', dest='end', help="ISO timestamp (UTC), default now")
+    p.set_defaults(func=cmd_archive_query)
+
+    args = parser.parse_args()
+    args.func(args)
+
+if __name__ == "__main__":
+    main()
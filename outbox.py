@@ -0,0 +1,159 @@
+# outbox.py — Cross-process event delivery through the `events` table (split mode)
+
+import json
+import logging
+import queue
+import threading
+import time
+import uuid
+
+from settings import cfg
+from storage import SPLIT, get_connection, publish_event, now_ms, to_epoch_ms
+from events import bus
+from latest import latest
+from render_cache import render_cache
+from metrics import registry
+
+log = logging.getLogger(__name__)
+
+process_cfg       = cfg.get('process') or {}
+POLL_MS           = process_cfg.get('outbox_poll_ms', 250)
+KEEP_S            = process_cfg.get('outbox_keep_s', 600)
+COMMAND_TIMEOUT_S = process_cfg.get('command_timeout_s', 10)
+
+delivered_total = registry.counter(
+    'growlab_outbox_delivered_total', "Outbox events delivered to this process.",
+    labels=('type',))
+
+# True in the process that holds the collector lease (daemon.py): it
+# drives the plugs itself; everyone else sends it commands
+owner = False
+
+# That process's Lease, set by daemon.py; see may_drive()
+lease = None
+
+def may_drive():
+    """
+    Whether this process may read the bus and drive the plugs right now.
+    Always True in single mode. In split mode only while the collector
+    lease is held by our own clock, so a leader that stalled past its TTL
+    stops acting even before its next renew() notices another holder.
+    """
+    return not SPLIT or (lease is not None and lease.held)
+
+class OutboxTail:
+    """
+    Follows the `events` table and replays each new row on this process's
+    event bus, so SSE streams, the control engine and the latest-value
+    cache see changes committed by any process. Starts at the newest
+    event; nothing from before the process started is replayed.
+
+    Handlers added with on() run in the tail thread after the bus publish.
+    """
+
+    def __init__(self, poll_ms=POLL_MS, batch=1000):
+        self.poll_ms = poll_ms
+        self.batch = batch
+        self.last_id = None
+        self.delivered = 0
+        self._handlers = {}
+        self._thread = None
+        self._running = False
+
+    def on(self, event_type, handler):
+        """Call handler(data) for every delivered event of event_type."""
+        self._handlers.setdefault(event_type, []).append(handler)
+
+    def start(self):
+        """Start the tail thread (idempotent)."""
+        if self._thread is not None:
+            return
+        self.last_id = get_connection().execute(
+            "SELECT coalesce(max(id), 0) FROM events").fetchone()[0]
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="outbox-tail", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._running = False
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def poll(self):
+        """Deliver every event newer than last_id; returns how many."""
+        rows = get_connection().execute(
+            "SELECT id, type, data FROM events WHERE id > ? ORDER BY id LIMIT ?",
+            (self.last_id, self.batch)
+        ).fetchall()
+        for event_id, event_type, data in rows:
+            self.last_id = event_id
+            try:
+                self.deliver(event_type, json.loads(data))
+            except Exception as e:
+                log.error("Error delivering outbox event %d (%s): %s", event_id, event_type, e)
+        return len(rows)
+
+    def deliver(self, event_type, data):
+        if event_type == 'reading':
+            ts_ms = to_epoch_ms(data["ts"])
+            latest.update([(data["device_id"], ts_ms, metric, value)
+                           for metric, value in data["values"].items()])
+        elif event_type == 'control_config':
+            render_cache.invalidate()
+        bus.publish(event_type, data)
+        self.delivered += 1
+        delivered_total.inc(type=event_type)
+        for handler in self._handlers.get(event_type, ()):
+            handler(data)
+
+    def stats(self):
+        return {"last_id": self.last_id, "delivered": self.delivered,
+                "poll_ms": self.poll_ms, "running": self._thread is not None}
+
+    def _run(self):
+        while self._running:
+            try:
+                if self.poll() == self.batch:
+                    continue   # more waiting
+            except Exception as e:
+                log.error("Error reading the event outbox: %s", e)
+            time.sleep(self.poll_ms / 1000)
+
+def send_command(device_id, on, force=False, timeout=COMMAND_TIMEOUT_S):
+    """
+    Ask the process that owns the plugs to switch one, and wait for its
+    answer. Returns True on success, False on failure or if no answer
+    arrives within `timeout` seconds (no collector running, say).
+    """
+    command_id = uuid.uuid4().hex
+    sub = bus.subscribe(devices=[device_id])
+    try:
+        publish_event('command', {
+            "command_id": command_id, "device_id": device_id,
+            "on": bool(on), "force": bool(force)
+        })
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise queue.Empty
+            event_type, data, _ = sub.get(timeout=remaining)
+            if event_type == 'command_result' and data.get("command_id") == command_id:
+                return bool(data.get("success"))
+    except queue.Empty:
+        log.warning("No answer from the collector to command for %s within %ss",
+                    device_id, timeout)
+        return False
+    finally:
+        bus.unsubscribe(sub)
+
+def prune(keep_s=KEEP_S):
+    """Delete outbox events older than keep_s; returns how many."""
+    conn = get_connection()
+    with conn:
+        return conn.execute("DELETE FROM events WHERE ts < ?",
+                            (now_ms() - int(keep_s * 1000),)).rowcount
+
+# Shared instance; started by app.start() in split mode
+tail = OutboxTail()
@@ -0,0 +1,222 @@
+# plug_poller.py — Background polling of the actual on/off state of Tuya plugs
+
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from settings import cfg
+from storage import current_device_state, log_device_state, publish_event, now_ms, ms_to_iso
+from tuya_pool import pool
+from metrics import registry
+import outbox
+
+log = logging.getLogger(__name__)
+
+polls_total = registry.counter(
+    'growlab_plug_polls_total', "Plug state polls by outcome (ok, failed, timeout).",
+    labels=('device', 'result'))
+poll_seconds = registry.histogram(
+    'growlab_plug_poll_seconds', "Round-trip time of plug state polls.",
+    labels=('device',))
+drift_total = registry.counter(
+    'growlab_plug_state_drift_total', "Plugs found in a different state than logged.",
+    labels=('device',))
+
+def tuya_devices(config):
+    """The device entries of a config that the poller should watch."""
+    return [d for d in config.get('devices', []) if d.get('device_type') == 'tuya']
+
+class PlugPoller:
+    """
+    Asks every Tuya plug for its real state on a bounded thread pool and
+    keeps the answers in memory with their age, so /api/<id>/status never
+    waits on a plug.
+
+    Each plug is polled every interval_s, varied by up to ±jitter (a
+    fraction) so the plugs drift apart instead of all being asked at
+    once. A poll that has not answered within timeout_s is reported as
+    timed out; that plug is not asked again until the call returns, so a
+    dead plug ties up at most one worker.
+
+    A plug found in another state than the one last logged on `confirm`
+    polls in a row (one mismatch may just be a command being logged) is
+    drift: it is counted, logged, and written to the device log so the
+    intervals and duty cycle follow what the plug actually did.
+
+    Every answer is published as a `plug_state` event; in split mode the
+    web workers fill their cache from those through the outbox.
+    """
+
+    def __init__(self, enabled=True, interval_s=30, jitter=0.2, timeout_s=3,
+                 max_workers=4, confirm=2):
+        self.enabled = enabled
+        self.interval_s = interval_s
+        self.jitter = jitter
+        self.timeout_s = timeout_s
+        self.max_workers = max_workers
+        self.confirm = confirm
+        self._devices = {}    # device_id -> device_info
+        self._due = {}        # device_id -> monotonic time of the next poll
+        self._inflight = {}   # device_id -> monotonic start of the running poll
+        self._timed_out = set()
+        self._mismatches = {}
+        self._cache = {}      # device_id -> last published plug_state
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._executor = None
+        self._thread = None
+
+    def set_devices(self, devices):
+        """Watch exactly these device entries (start() and config reloads)."""
+        now = time.monotonic()
+        with self._lock:
+            self._devices = {d['id']: d for d in devices}
+            for device_id in self._devices:
+                # New plugs are asked soon, spread over the first couple of seconds
+                self._due.setdefault(device_id, now + random.uniform(0, min(2.0, self.interval_s)))
+            for device_id in list(self._due):
+                if device_id not in self._devices:
+                    del self._due[device_id]
+                    self._cache.pop(device_id, None)
+        self._wake.set()
+
+    def start(self, devices):
+        """Start polling `devices` (idempotent; a no-op when disabled)."""
+        self.set_devices(devices)
+        if not self.enabled or self._thread is not None:
+            return
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers,
+                                            thread_name_prefix="plug-poll")
+        self._thread = threading.Thread(target=self._run, name="plug-poller", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        thread, self._thread = self._thread, None
+        if thread is not None:
+            self._wake.set()
+            thread.join(timeout=5)
+            self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def get(self, device_id):
+        """The last known actual state of a plug with its age, or None."""
+        entry = self._cache.get(device_id)
+        if entry is None:
+            return None
+        entry = dict(entry)
+        if entry["checked_ms"] is not None:
+            entry["age_s"] = round((now_ms() - entry["checked_ms"]) / 1000, 1)
+            entry["fresh"] = entry["age_s"] <= 2 * self.interval_s
+        return entry
+
+    def remember(self, data):
+        """Cache a published plug_state (the outbox handler in web workers)."""
+        self._cache[data["device_id"]] = data
+
+    def stats(self):
+        return {
+            "enabled": self.enabled,
+            "running": self._thread is not None,
+            "interval_s": self.interval_s,
+            "timeout_s": self.timeout_s,
+            "in_flight": sorted(self._inflight),
+            "devices": {device_id: self.get(device_id) for device_id in self._cache}
+        }
+
+    def _next_interval(self):
+        return self.interval_s * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    def _run(self):
+        while self._thread is not None:
+            now = time.monotonic()
+            # Only the collector holding the lease talks to the plugs
+            driving = outbox.may_drive()
+            with self._lock:
+                due = [info for device_id, info in self._devices.items()
+                       if driving and self._due.get(device_id, 0) <= now
+                       and device_id not in self._inflight]
+                for info in due:
+                    self._inflight[info['id']] = now
+                    self._due[info['id']] = now + self._next_interval()
+                overdue = [device_id for device_id, started in self._inflight.items()
+                           if now - started > self.timeout_s and device_id not in self._timed_out]
+                self._timed_out.update(overdue)
+                next_due = min(self._due.values(), default=now + self.interval_s)
+            for info in due:
+                future = self._executor.submit(pool.session(info).get_state)
+                future.add_done_callback(
+                    lambda f, info=info, started=now: self._finish(info, started, f))
+            for device_id in overdue:
+                polls_total.inc(device=device_id, result="timeout")
+                log.warning("Plug %s did not answer a state poll within %ss",
+                            device_id, self.timeout_s)
+                self._record(device_id, None, f"no answer within {self.timeout_s}s")
+            # Wake for the next due poll or to check the running ones' deadlines
+            if not driving:
+                next_due = time.monotonic() + 1.0
+            self._wake.wait(max(0.05, min(next_due - time.monotonic(), self.timeout_s / 2)))
+            self._wake.clear()
+
+    def _finish(self, info, started, future):
+        device_id = info['id']
+        with self._lock:
+            self._inflight.pop(device_id, None)
+            late = device_id in self._timed_out
+            self._timed_out.discard(device_id)
+        if future.cancelled():
+            return
+        poll_seconds.observe(time.monotonic() - started, device=device_id)
+        try:
+            on = future.result()
+        except Exception as e:
+            if not late:
+                polls_total.inc(device=device_id, result="failed")
+                log.debug("State poll of plug %s failed: %s", device_id, e)
+                self._record(device_id, None, str(e))
+            return
+        if not late:
+            polls_total.inc(device=device_id, result="ok")
+        try:
+            self._record(device_id, 'on' if on else 'off', None)
+        except Exception as e:
+            log.error("Error recording the state of plug %s: %s", device_id, e)
+
+    def _record(self, device_id, state, error):
+        """Cache and publish one poll outcome; state is None if it failed."""
+        previous = self._cache.get(device_id) or {}
+        now = now_ms()
+        entry = {
+            "device_id": device_id,
+            "state": state if error is None else previous.get("state"),
+            "checked_ms": now if error is None else previous.get("checked_ms"),
+            "checked_at": ms_to_iso(now) if error is None else previous.get("checked_at"),
+            "error": error,
+            "drift": previous.get("drift")
+        }
+        if error is None:
+            entry["drift"] = self._check_drift(device_id, state) or entry["drift"]
+        self._cache[device_id] = entry
+        publish_event('plug_state', entry)
+
+    def _check_drift(self, device_id, state):
+        """Compare an observed state with the logged one; returns a drift record or None."""
+        logged = current_device_state([device_id]).get(device_id)
+        if logged is not None and logged[1] == state:
+            self._mismatches.pop(device_id, None)
+            return None
+        if logged is not None:
+            self._mismatches[device_id] = self._mismatches.get(device_id, 0) + 1
+            if self._mismatches[device_id] < self.confirm:
+                return None
+            drift_total.inc(device=device_id)
+            log.warning("Plug %s is %s but was logged %s (switched by hand?); logging the change",
+                        device_id, state, logged[1])
+        self._mismatches.pop(device_id, None)
+        log_device_state(device_id, state)
+        if logged is None:
+            return None
+        return {"at": ms_to_iso(now_ms()), "logged": logged[1], "actual": state}
+
+# Shared instance; started with the collector (app.start_background)
+poller = PlugPoller(**cfg.get('plug_poll', {}))
@@ -0,0 +1,470 @@
+# profiling.py — Opt-in per-request phase timing, slow-query log and sampled cProfile
+
+import cProfile
+import heapq
+import hmac
+import io
+import logging
+import os
+import pstats
+import random
+import re
+import sqlite3
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from flask import jsonify, request
+from flask.json.provider import DefaultJSONProvider
+from jinja2 import Template
+
+from settings import cfg
+from metrics import registry
+
+log = logging.getLogger(__name__)
+
+# Time is attributed to one of these; "python" is whatever is left
+PHASES = ('sql', 'pivot', 'render', 'json', 'python')
+
+phase_seconds = registry.histogram(
+    'growlab_request_phase_seconds', "Request time per phase (profiling only).",
+    labels=('endpoint', 'phase'))
+slow_queries_total = registry.counter(
+    'growlab_slow_queries_total', "SQL statements slower than profiling.slow_query_ms.")
+
+_local = threading.local()
+
+class RequestProfile:
+    """Phase timings of the request running on this thread."""
+
+    def __init__(self, endpoint, path):
+        self.endpoint = endpoint
+        self.path = path
+        self.started = time.time()
+        self.start = time.perf_counter()
+        self.phases = dict.fromkeys(PHASES, 0.0)
+        self.queries = 0
+        self.profile = None
+
+def current():
+    """The RequestProfile of this thread's request, or None."""
+    return getattr(_local, 'request', None)
+
+@contextmanager
+def phase(name):
+    """
+    Attribute the time of a `with` block to `name` in the request's phase
+    breakdown. Time spent in a phase nested inside the block (SQL, say)
+    stays with that phase, so every moment is counted once.
+    A no-op outside a profiled request.
+    """
+    req = current()
+    if req is None:
+        yield
+        return
+    attributed = sum(req.phases.values())
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        nested = sum(req.phases.values()) - attributed
+        req.phases[name] += elapsed - nested
+
+# — SQL —
+
+_PLANNED = re.compile(r'\s*(SELECT|WITH|INSERT|UPDATE|DELETE|REPLACE)\b', re.I)
+
+class ProfiledCursor(sqlite3.Cursor):
+    """
+    Cursor that adds its execute and fetch time to the request's "sql"
+    phase, and reports the statement to the profiler once it is done if
+    it took longer than the slow-query threshold.
+    """
+
+    _sql = None
+    _params = None
+    _elapsed = 0.0
+
+    def _begin(self, sql, params):
+        self._report()
+        self._sql, self._params, self._elapsed = sql, params, 0.0
+
+    def _account(self, elapsed):
+        self._elapsed += elapsed
+        req = current()
+        if req is not None:
+            req.phases['sql'] += elapsed
+
+    def _report(self):
+        if self._sql is not None:
+            profiler.record_query(self.connection, self._sql, self._params, self._elapsed)
+            self._sql = None
+
+    def execute(self, sql, parameters=()):
+        self._begin(sql, parameters)
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            self._account(time.perf_counter() - start)
+            req = current()
+            if req is not None:
+                req.queries += 1
+            if self.description is None:   # no rows to fetch
+                self._report()
+
+    def executemany(self, sql, seq_of_parameters):
+        self._begin(sql, None)
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            self._account(time.perf_counter() - start)
+            self._report()
+
+    def __next__(self):
+        start = time.perf_counter()
+        try:
+            row = super().__next__()
+        except StopIteration:
+            self._account(time.perf_counter() - start)
+            self._report()
+            raise
+        self._account(time.perf_counter() - start)
+        return row
+
+    def fetchone(self):
+        start = time.perf_counter()
+        row = super().fetchone()
+        self._account(time.perf_counter() - start)
+        if row is None:
+            self._report()
+        return row
+
+    def fetchmany(self, size=None):
+        start = time.perf_counter()
+        try:
+            return super().fetchmany(size) if size is not None else super().fetchmany()
+        finally:
+            self._account(time.perf_counter() - start)
+
+    def fetchall(self):
+        start = time.perf_counter()
+        try:
+            return super().fetchall()
+        finally:
+            self._account(time.perf_counter() - start)
+            self._report()
+
+    def close(self):
+        self._report()
+        super().close()
+
+class ProfiledConnection(sqlite3.Connection):
+    """sqlite3 connection whose statements all run through ProfiledCursor."""
+
+    def cursor(self, factory=ProfiledCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+def connection_factory():
+    """The sqlite3 connection class storage.get_connection() should open."""
+    return ProfiledConnection if profiler.enabled else sqlite3.Connection
+
+# — templates and JSON —
+
+class ProfiledTemplate(Template):
+    """Jinja template whose render() time counts as the "render" phase."""
+
+    def render(self, *args, **kwargs):
+        with phase('render'):
+            return super().render(*args, **kwargs)
+
+class ProfiledJSONProvider(DefaultJSONProvider):
+    """JSON provider whose serialization time counts as the "json" phase."""
+
+    def dumps(self, obj, **kwargs):
+        with phase('json'):
+            return super().dumps(obj, **kwargs)
+
+# — profiler —
+
+class Profiler:
+    """
+    Collects the phase breakdown of every request while enabled: totals
+    per endpoint, the slowest requests, and statements slower than
+    slow_query_ms together with their EXPLAIN QUERY PLAN.
+
+    With sample_rate > 0 that fraction of requests also runs under
+    cProfile (one at a time; cProfile cannot nest), and the pstats of the
+    keep_slowest slowest ones are kept in profile_dir.
+    """
+
+    def __init__(self, enabled=False, slow_query_ms=100, sample_rate=0.0,
+                 keep_slowest=10, profile_dir='profiles', token=None, history=200):
+        self.enabled = enabled
+        self.slow_query_ms = slow_query_ms
+        self.sample_rate = sample_rate
+        self.keep_slowest = keep_slowest
+        self.profile_dir = profile_dir
+        self.token = token
+
+        self._lock = threading.Lock()
+        self._profile_lock = threading.Lock()   # held while a request is under cProfile
+        self._endpoints = {}                    # endpoint -> totals
+        self._recent = deque(maxlen=history)
+        self._slowest = []                      # min-heap of (total_ms, seq, record)
+        self._slow_queries = deque(maxlen=history)
+        self._profiles = []                     # min-heap of (total_ms, path)
+        self._seq = 0
+
+    # — request hooks —
+
+    def before_request(self):
+        if not self.enabled:
+            return
+        req = _local.request = RequestProfile(request.endpoint, request.path)
+        if (self.sample_rate > 0 and random.random() < self.sample_rate
+                and self._profile_lock.acquire(blocking=False)):
+            req.profile = cProfile.Profile()
+            req.profile.enable()
+
+    def after_request(self, response):
+        req = current()
+        if req is None:
+            return response
+        _local.request = None
+        if req.profile is not None:
+            req.profile.disable()
+            self._profile_lock.release()
+
+        total = time.perf_counter() - req.start
+        phases = dict(req.phases)
+        phases['python'] = max(total - sum(phases.values()), 0.0)
+        response.headers['Server-Timing'] = ', '.join(
+            f"{name};dur={seconds * 1000:.1f}" for name, seconds in phases.items()
+        ) + f", total;dur={total * 1000:.1f}"
+
+        endpoint = req.endpoint or 'unmatched'
+        for name, seconds in phases.items():
+            phase_seconds.observe(seconds, endpoint=endpoint, phase=name)
+        record = {
+            "ts": req.started,
+            "endpoint": endpoint,
+            "path": req.path,
+            "status": response.status_code,
+            "total_ms": total * 1000,
+            "phases_ms": {name: seconds * 1000 for name, seconds in phases.items()},
+            "queries": req.queries
+        }
+        with self._lock:
+            self._seq += 1
+            totals = self._endpoints.setdefault(endpoint, {
+                "count": 0, "total_ms": 0.0, "max_ms": 0.0,
+                "phases_ms": dict.fromkeys(PHASES, 0.0)
+            })
+            totals["count"] += 1
+            totals["total_ms"] += record["total_ms"]
+            totals["max_ms"] = max(totals["max_ms"], record["total_ms"])
+            for name, ms in record["phases_ms"].items():
+                totals["phases_ms"][name] += ms
+            self._recent.append(record)
+            entry = (record["total_ms"], self._seq, record)
+            if len(self._slowest) < self.keep_slowest:
+                heapq.heappush(self._slowest, entry)
+            elif entry > self._slowest[0]:
+                heapq.heapreplace(self._slowest, entry)
+        if req.profile is not None:
+            self._keep_profile(req.profile, record)
+        return response
+
+    def teardown_request(self, exc):
+        # after_request does not run when the view raised
+        req = current()
+        if req is not None:
+            _local.request = None
+            if req.profile is not None:
+                req.profile.disable()
+                self._profile_lock.release()
+
+    # — slow queries —
+
+    def record_query(self, conn, sql, params, elapsed):
+        """Log `sql` with its query plan if it ran longer than slow_query_ms."""
+        ms = elapsed * 1000
+        if ms < self.slow_query_ms:
+            return
+        slow_queries_total.inc()
+        plan = None
+        if _PLANNED.match(sql):
+            try:
+                # A plain cursor, so the EXPLAIN is not profiled itself
+                plan = [row[-1] for row in sqlite3.Cursor(conn).execute(
+                    "EXPLAIN QUERY PLAN " + sql, params if params is not None else ())]
+            except sqlite3.Error as e:
+                plan = [f"unavailable: {e}"]
+        statement = ' '.join(sql.split())
+        req = current()
+        log.warning("Slow query (%.1f ms%s): %s | plan: %s", ms,
+                    f", {req.endpoint}" if req else "", statement,
+                    '; '.join(plan) if plan else '-')
+        with self._lock:
+            self._slow_queries.append({
+                "ts": time.time(),
+                "endpoint": req.endpoint if req else None,
+                "ms": ms,
+                "sql": statement,
+                "plan": plan
+            })
+
+    # — cProfile dumps —
+
+    def _keep_profile(self, profile, record):
+        """Dump the request's pstats if it is among the keep_slowest slowest."""
+        ms = record["total_ms"]
+        with self._lock:
+            if len(self._profiles) >= self.keep_slowest and ms <= self._profiles[0][0]:
+                return
+            os.makedirs(self.profile_dir, exist_ok=True)
+            name = "%s-%s-%dms.pstats" % (
+                time.strftime('%Y%m%dT%H%M%S', time.gmtime(record["ts"])),
+                re.sub(r'[^A-Za-z0-9_.-]', '_', record["endpoint"]), ms)
+            path = os.path.join(self.profile_dir, name)
+            profile.dump_stats(path)
+            heapq.heappush(self._profiles, (ms, path))
+            while len(self._profiles) > self.keep_slowest:
+                _, dropped = heapq.heappop(self._profiles)
+                try:
+                    os.remove(dropped)
+                except OSError:
+                    pass
+
+    def profile_report(self, name, sort='cumulative', limit=40):
+        """Text report of one saved profile, or None if it is not kept."""
+        with self._lock:
+            paths = {os.path.basename(path): path for _, path in self._profiles}
+        path = paths.get(name)
+        if path is None or not os.path.exists(path):
+            return None
+        out = io.StringIO()
+        pstats.Stats(path, stream=out).sort_stats(sort).print_stats(limit)
+        return out.getvalue()
+
+    # — reporting —
+
+    def stats(self):
+        """Per-endpoint averages, slowest and recent requests, slow queries."""
+        with self._lock:
+            endpoints = {
+                endpoint: {
+                    "count": t["count"],
+                    "avg_ms": t["total_ms"] / t["count"],
+                    "max_ms": t["max_ms"],
+                    "avg_phases_ms": {n: ms / t["count"] for n, ms in t["phases_ms"].items()}
+                }
+                for endpoint, t in self._endpoints.items()
+            }
+            slowest = [record for _, _, record in sorted(self._slowest, reverse=True)]
+            recent = list(self._recent)[-20:]
+            slow_queries = list(self._slow_queries)
+            profiles = [
+                {"name": os.path.basename(path), "total_ms": ms}
+                for ms, path in sorted(self._profiles, reverse=True)
+            ]
+        return {
+            "enabled": self.enabled,
+            "slow_query_ms": self.slow_query_ms,
+            "sample_rate": self.sample_rate,
+            "keep_slowest": self.keep_slowest,
+            "endpoints": endpoints,
+            "slowest": slowest,
+            "recent": recent,
+            "slow_queries": slow_queries,
+            "profiles": profiles
+        }
+
+    def reset(self):
+        with self._lock:
+            self._endpoints.clear()
+            self._recent.clear()
+            self._slowest.clear()
+            self._slow_queries.clear()
+
+    # — Flask wiring —
+
+    def authorized(self):
+        """
+        Whether the caller may use the profile endpoint: the configured
+        token in X-Diagnostic-Token, or, with no token set, loopback only.
+        """
+        if self.token:
+            supplied = request.headers.get('X-Diagnostic-Token', '')
+            return hmac.compare_digest(supplied.encode(), str(self.token).encode())
+        return request.remote_addr in ('127.0.0.1', '::1')
+
+    def instrument(self, app):
+        """
+        Register the request hooks on `app`. Templates and JSON are only
+        timed when profiling is enabled in config.yaml, so a disabled
+        profiler costs one attribute check per request.
+        """
+        if self.enabled:
+            app.jinja_env.template_class = ProfiledTemplate
+            app.json = ProfiledJSONProvider(app)
+        app.before_request(self.before_request)
+        app.after_request(self.after_request)
+        app.teardown_request(self.teardown_request)
+
+    def init_app(self, app):
+        """instrument() `app` and add /api/diagnostic/profile to it."""
+        self.instrument(app)
+        app.add_url_rule('/api/diagnostic/profile', 'diagnostic_profile',
+                         self.profile_view, methods=['GET', 'POST', 'DELETE'])
+
+    def profile_view(self):
+        """
+        GET: the stats() report, or with ?name= the pstats text of one kept
+        profile (?sort= any pstats key, default cumulative).
+        POST: change sample_rate, slow_query_ms or keep_slowest at runtime.
+        DELETE: clear the collected timings.
+        """
+        if not self.authorized():
+            return jsonify({"error": "forbidden"}), 403
+        if request.method == 'DELETE':
+            self.reset()
+            return jsonify({"status": "ok"})
+        if request.method == 'POST':
+            body = request.get_json(silent=True) or {}
+            try:
+                if 'sample_rate' in body:
+                    rate = float(body['sample_rate'])
+                    if not 0 <= rate <= 1:
+                        raise ValueError("sample_rate must be between 0 and 1")
+                    self.sample_rate = rate
+                if 'slow_query_ms' in body:
+                    self.slow_query_ms = float(body['slow_query_ms'])
+                if 'keep_slowest' in body:
+                    self.keep_slowest = max(int(body['keep_slowest']), 1)
+            except (TypeError, ValueError) as e:
+                return jsonify({"error": str(e)}), 400
+            return jsonify(self.stats())
+        name = request.args.get('name')
+        if name:
+            try:
+                report = self.profile_report(name, sort=request.args.get('sort', 'cumulative'))
+            except KeyError as e:
+                return jsonify({"error": f"bad sort key {e}"}), 400
+            if report is None:
+                return jsonify({"error": "profile not found"}), 404
+            return report, 200, {"Content-Type": "text/plain; charset=utf-8"}
+        return jsonify(self.stats())
+
+# Shared instance, configured under `profiling:` in config.yaml
+profiler = Profiler(**(cfg.get('profiling') or {}))
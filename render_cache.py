@@ -0,0 +1,63 @@
+# render_cache.py — Cache of rendered widget and page HTML with validators
+
+import hashlib
+import threading
+import time
+
+class RenderCache:
+    """
+    Keeps rendered HTML by key until invalidated. Widget shells only change
+    when config.yaml or a control's config changes, so every page load in
+    between is served from here.
+
+    Each entry carries an ETag and the time the cache was last invalidated
+    (used as Last-Modified) so browsers can revalidate with a 304.
+
+    Renders run outside the lock. Each key has a generation, bumped by
+    every invalidation that covers it; a render only stores its result if
+    the generation it started under is still current, so an invalidate()
+    that lands mid-render is never overwritten by the stale HTML.
+    """
+
+    def __init__(self):
+        self._entries = {}
+        self._generations = {}   # key -> invalidations of that key alone
+        self._epoch = 0          # invalidations of everything
+        self._lock = threading.Lock()
+        self.last_modified = time.time()
+
+    def _generation(self, key):
+        return self._epoch, self._generations.get(key, 0)
+
+    def get(self, key, render):
+        """
+        Return (html, etag) for key, calling render() to build it on a miss.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            generation = self._generation(key)
+        if entry is None:
+            html = render()
+            etag = hashlib.sha1(html.encode('utf-8')).hexdigest()
+            entry = (html, etag)
+            with self._lock:
+                if self._generation(key) == generation:
+                    self._entries[key] = entry
+        return entry
+
+    def invalidate(self, key=None):
+        """
+        Drop one cached entry, or every entry when key is None (config or
+        control settings changed).
+        """
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+                self._epoch += 1
+            else:
+                self._entries.pop(key, None)
+                self._generations[key] = self._generations.get(key, 0) + 1
+            self.last_modified = time.time()
+
+# Shared instance for the whole process
+render_cache = RenderCache()
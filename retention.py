@@ -0,0 +1,256 @@
+# retention.py — Expire old data into compressed archives and reclaim the space
+
+import gzip
+import heapq
+import json
+import logging
+import os
+import time
+from datetime import datetime, timedelta, timezone
+
+from storage import (cfg, get_connection, get_series_id, iter_samples, series_names,
+                     ROLLUP_TIERS, now_ms, ms_to_iso, to_epoch_ms)
+
+log = logging.getLogger(__name__)
+
+DAY_MS = 24 * 60 * 60 * 1000
+
+# Retention policy (overridable under `retention:` in config.yaml). A
+# value of None keeps that data forever.
+retention_cfg  = cfg.get('retention') or {}
+RAW_DAYS       = retention_cfg.get('raw_days', 90)
+ROLLUP_DAYS    = {name: None for name, _ in ROLLUP_TIERS}
+ROLLUP_DAYS.update(retention_cfg.get('rollup_days') or {})
+DEVICE_LOG_DAYS = retention_cfg.get('device_log_days', 365)
+ARCHIVE_DIR    = retention_cfg.get('archive_dir', 'archive')
+BATCH_SIZE     = retention_cfg.get('batch_size', 5000)
+BATCH_PAUSE_S  = retention_cfg.get('batch_pause_s', 0.05)
+VACUUM_PAGES   = retention_cfg.get('vacuum_pages', 1000)
+INTERVAL_S     = retention_cfg.get('interval_s', 3600)
+
+def _day(ts_ms):
+    return datetime.fromtimestamp(ts_ms / 1000, tz=timezone.utc).strftime('%Y-%m-%d')
+
+def _append_partitions(kind, lines_by_day):
+    """
+    Append NDJSON lines to archive/<kind>/<YYYY-MM-DD>.ndjson.gz, one file
+    per UTC day, and fsync them before returning. Each append adds a gzip
+    member; readers see the members as one stream.
+    """
+    folder = os.path.join(ARCHIVE_DIR, kind)
+    os.makedirs(folder, exist_ok=True)
+    for day, lines in lines_by_day.items():
+        path = os.path.join(folder, f"{day}.ndjson.gz")
+        with open(path, 'ab') as raw:
+            with gzip.GzipFile(fileobj=raw, mode='ab') as gz:
+                gz.write(''.join(lines).encode())
+            raw.flush()
+            os.fsync(raw.fileno())
+
+def archive_samples(cutoff_ms, batch_size=BATCH_SIZE, pause_s=BATCH_PAUSE_S):
+    """
+    Move raw samples older than cutoff_ms into the archive.
+
+    Works one series and at most batch_size rows per transaction: the
+    batch is read, appended to its day partitions and fsynced, then
+    deleted, all while holding the write lock for just that batch.
+    Between batches the lock is released for pause_s so the collector and
+    ingest never wait long. If the process dies after the archive write
+    but before the commit, the batch is archived again on the next run;
+    query_archive() drops such duplicates.
+    Returns the number of rows archived.
+    """
+    conn  = get_connection()
+    names = series_names()
+    moved = 0
+    for sid, (device_id, metric) in names.items():
+        while True:
+            with conn:
+                conn.execute("BEGIN IMMEDIATE")
+                rows = conn.execute("""
+                    SELECT ts, value FROM samples
+                     WHERE series_id = ? AND ts < ?
+                     ORDER BY ts LIMIT ?
+                """, (sid, cutoff_ms, batch_size)).fetchall()
+                if not rows:
+                    break
+                lines = {}
+                for ts, value in rows:
+                    lines.setdefault(_day(ts), []).append(json.dumps({
+                        "device_id": device_id, "metric": metric,
+                        "ts": ms_to_iso(ts), "ts_ms": ts, "value": value
+                    }) + "\n")
+                _append_partitions('samples', lines)
+                conn.execute(
+                    "DELETE FROM samples WHERE series_id = ? AND ts >= ? AND ts <= ?",
+                    (sid, rows[0][0], rows[-1][0])
+                )
+            moved += len(rows)
+            if len(rows) < batch_size:
+                break
+            time.sleep(pause_s)
+    return moved
+
+def archive_device_logs(cutoff_iso, batch_size=BATCH_SIZE, pause_s=BATCH_PAUSE_S):
+    """Move device_logs rows older than cutoff_iso into the archive, in batches."""
+    conn  = get_connection()
+    moved = 0
+    while True:
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            rows = conn.execute("""
+                SELECT rowid, ts, device_id, state FROM device_logs
+                 WHERE ts < ?
+                 ORDER BY rowid LIMIT ?
+            """, (cutoff_iso, batch_size)).fetchall()
+            if not rows:
+                break
+            lines = {}
+            for _, ts, device_id, state in rows:
+                lines.setdefault(ts[:10], []).append(json.dumps({
+                    "device_id": device_id, "ts": ts, "state": state
+                }) + "\n")
+            _append_partitions('device_logs', lines)
+            conn.executemany("DELETE FROM device_logs WHERE rowid = ?",
+                             [(r[0],) for r in rows])
+        moved += len(rows)
+        if len(rows) < batch_size:
+            break
+        time.sleep(pause_s)
+    return moved
+
+def expire_rollups(tier, cutoff_ms, batch_size=BATCH_SIZE, pause_s=BATCH_PAUSE_S):
+    """
+    Delete buckets of one rollup tier older than cutoff_ms. Not archived:
+    the raw archive holds everything they were built from.
+    """
+    conn    = get_connection()
+    series  = [r[0] for r in conn.execute("SELECT series_id FROM series")]
+    deleted = 0
+    for sid in series:
+        while True:
+            with conn:
+                count = conn.execute(f"""
+                    DELETE FROM rollup_{tier}
+                     WHERE series_id = ? AND bucket IN (
+                        SELECT bucket FROM rollup_{tier}
+                         WHERE series_id = ? AND bucket < ?
+                         ORDER BY bucket LIMIT ?)
+                """, (sid, sid, cutoff_ms, batch_size)).rowcount
+            deleted += count
+            if count < batch_size:
+                break
+            time.sleep(pause_s)
+    return deleted
+
+def expire_device_stats(cutoff_ms):
+    """
+    Delete device intervals that ended before cutoff_ms and the daily
+    duty cycles of days before it. Not archived: the device log archive
+    holds everything they were built from.
+    """
+    conn = get_connection()
+    with conn:
+        deleted = conn.execute("DELETE FROM device_intervals WHERE end < ?",
+                               (cutoff_ms,)).rowcount
+        deleted += conn.execute("DELETE FROM device_daily WHERE day < ?",
+                                (_day(cutoff_ms),)).rowcount
+    return deleted
+
+def incremental_vacuum(pages=VACUUM_PAGES, pause_s=BATCH_PAUSE_S):
+    """
+    Return free pages to the filesystem, `pages` at a time. Needs
+    auto_vacuum=INCREMENTAL (new databases get it from init_db; run
+    `manage.py enable-incremental-vacuum` once on older ones).
+    Returns the number of pages released.
+    """
+    conn = get_connection()
+    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+        return 0
+    released = 0
+    while True:
+        free = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        if not free:
+            break
+        conn.execute(f"PRAGMA incremental_vacuum({int(min(free, pages))})").fetchall()
+        released += min(free, pages)
+        time.sleep(pause_s)
+    return released
+
+def compact():
+    """
+    Apply the retention policy: archive expired raw samples and device
+    logs, drop expired rollup buckets, then reclaim the freed pages.
+    Scheduled by the app; also available as `manage.py compact`.
+    """
+    now   = now_ms()
+    stats = {"samples": 0, "device_logs": 0, "device_stats": 0, "rollups": {}, "pages": 0}
+    if RAW_DAYS is not None:
+        stats["samples"] = archive_samples(now - RAW_DAYS * DAY_MS)
+    if DEVICE_LOG_DAYS is not None:
+        cutoff = (datetime.utcnow() - timedelta(days=DEVICE_LOG_DAYS)).isoformat()
+        stats["device_logs"] = archive_device_logs(cutoff)
+        stats["device_stats"] = expire_device_stats(now - DEVICE_LOG_DAYS * DAY_MS)
+    for tier, days in ROLLUP_DAYS.items():
+        if days is not None:
+            stats["rollups"][tier] = expire_rollups(tier, now - days * DAY_MS)
+    stats["pages"] = incremental_vacuum()
+    if stats["samples"] or stats["device_logs"] or any(stats["rollups"].values()):
+        log.info("Retention: archived %d samples and %d device logs, expired rollups %s, "
+                 "released %d pages", stats['samples'], stats['device_logs'],
+                 stats['rollups'], stats['pages'])
+    return stats
+
+def _read_partition(path):
+    with gzip.open(path, 'rt') as f:
+        for line in f:
+            yield json.loads(line)
+
+def _partitions(kind, start_ms, end_ms):
+    """Archive files of `kind` whose day overlaps [start_ms, end_ms)."""
+    folder = os.path.join(ARCHIVE_DIR, kind)
+    if not os.path.isdir(folder):
+        return []
+    first, last = _day(start_ms), _day(end_ms - 1)
+    return sorted(
+        os.path.join(folder, name) for name in os.listdir(folder)
+        if name.endswith('.ndjson.gz') and first <= name[:10] <= last
+    )
+
+def query_archive(device_id, metric, start_ms, end_ms):
+    """
+    Yield archived (ts_ms, value) samples of one series in
+    [start_ms, end_ms), oldest first, without duplicates. Only the day
+    partitions overlapping the range are opened.
+    """
+    for path in _partitions('samples', start_ms, end_ms):
+        found = {}
+        for rec in _read_partition(path):
+            if (rec["device_id"] == device_id and rec["metric"] == metric
+                    and start_ms <= rec["ts_ms"] < end_ms):
+                found[rec["ts_ms"]] = rec["value"]
+        yield from sorted(found.items())
+
+def query_archive_device_logs(device_id, start_ms, end_ms):
+    """Yield archived (ts, state) rows of one device in [start_ms, end_ms), oldest first."""
+    for path in _partitions('device_logs', start_ms, end_ms):
+        found = {}
+        for rec in _read_partition(path):
+            if rec["device_id"] == device_id and start_ms <= to_epoch_ms(rec["ts"]) < end_ms:
+                found[rec["ts"]] = rec["state"]
+        yield from sorted(found.items())
+
+def iter_history(device_id, metric, start_ms, end_ms):
+    """
+    Samples of one series from the archive and the live table merged into
+    one ordered stream, for ranges that reach past the raw retention.
+    """
+    live = iter(())
+    sid = get_series_id(device_id, metric)
+    if sid is not None:
+        live = iter_samples(sid, start_ms, end_ms)
+    last = None
+    for ts, value in heapq.merge(query_archive(device_id, metric, start_ms, end_ms), live):
+        if ts != last:
+            yield ts, value
+            last = ts
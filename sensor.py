@@ -1,130 +1,247 @@
 # sensor.py — Reading and storing sensor data for all configured sensors
 
-import yaml
-import sqlite3
 import time
-from datetime import datetime
-from smbus2 import SMBus, i2c_msg
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
-# Load configuration
-cfg = yaml.safe_load(open('config.yaml'))
-DB = cfg.get('DATABASE', 'data.db')
+from settings import cfg
+from buses import crc8, open_bus
+from storage import now_ms
+from write_behind import writer
+from metrics import registry
 
-def init_db():
+log = logging.getLogger(__name__)
+
+i2c_read_seconds = registry.histogram(
+    'growlab_i2c_read_seconds',
+    "I²C bus time per sensor read (trigger + fetch, excluding the conversion wait).",
+    labels=('sensor',))
+i2c_errors_total = registry.counter(
+    'growlab_i2c_errors_total', "Failed sensor triggers or reads.", labels=('sensor',))
+store_reading_seconds = registry.histogram(
+    'growlab_store_reading_seconds', "Duration of one store_reading collection cycle.")
+
+class SHT40:
     """
-    Create the readings table (with device_id) if it doesn’t exist yet.
+    Split-phase SHT40 driver: trigger() starts a conversion and returns at
+    once, fetch() reads the result back once delay_s has passed. Splitting
+    the two lets every sensor on a bus convert at the same time.
     """
-    conn = sqlite3.connect(DB)
-    conn.execute("""
-        CREATE TABLE IF NOT EXISTS readings (
-        device_id TEXT    NOT NULL,
-        ts        TEXT    NOT NULL,   -- ISO timestamp
-        metric    TEXT    NOT NULL,
-        value     REAL,
-        PRIMARY KEY (device_id, ts, metric)
-        );
-    """)
-    conn.commit()
-    conn.close()
+
+    # I²C measurement constants for SHT40
+    MEAS_CMD = 0xFD    # high-repeatability measurement, no clock-stretch
+    delay_s  = 0.02    # 20 ms conversion delay
+
+    @classmethod
+    def trigger(cls, bus, address):
+        """Send the measure command."""
+        bus.write(address, [cls.MEAS_CMD])
+
+    @classmethod
+    def fetch(cls, bus, address):
+        """
+        Read 6 bytes back from a triggered sensor.
+        Returns dict with temperature and humidity values.
+        """
+        data = bus.read(address, 6)
+
+        # Each 16-bit word is followed by its CRC
+        if crc8(data[0:2]) != data[2] or crc8(data[3:5]) != data[5]:
+            raise IOError(f"CRC mismatch from SHT40 at 0x{address:02x}")
+
+        # Parse raw values
+        t_raw = (data[0] << 8) | data[1]
+        h_raw = (data[3] << 8) | data[4]
+
+        # Convert per datasheet
+        temperature = -45 + (175 * t_raw / 65535)
+        humidity    = 100 * (h_raw / 65535)
+
+        # Return dictionary with metric names as keys
+        return {
+            "temperature_C": temperature,
+            "humidity_pct": humidity
+        }
 
 # Sensor type registry for different sensor hardware
 SENSOR_TYPES = {
-    # Each type maps to a function that returns {metric_name: value} dict
-    "SHT40": "read_sht40_sensor"
+    # Each type maps to a driver with delay_s, trigger() and fetch()
+    "SHT40": SHT40
 }
 
-# I²C measurement constants for SHT40
-MEAS_CMD = 0xFD    # high-repeatability measurement, no clock-stretch
-DELAY_S  = 0.02    # 20 ms conversion delay
+def sensor_bus(device_config):
+    """I²C bus number a sensor sits on (per-device override, else global)."""
+    return device_config.get('i2c_bus', cfg.get('sensor', {}).get('i2c_bus', 1))
+
+def sensor_address(device_config):
+    return device_config.get('address', cfg.get('sensor', {}).get('address', 0x44))
 
-def read_sht40_sensor(bus_number, address):
+def sensor_driver(device_config):
+    # Determine sensor type - default to SHT40 for backward compatibility
+    sensor_type = device_config.get('sensor_type', 'SHT40')
+    driver = SENSOR_TYPES.get(sensor_type)
+    if not driver:
+        raise ValueError(f"Unknown sensor type: {sensor_type}")
+    return driver
+
+class BusReader:
     """
-    Read from SHT40 temperature/humidity sensor.
-    Returns dict with temperature and humidity values.
+    Pipelined reads of every sensor on one I²C bus through a single
+    long-lived handle (from the configured bus backend): trigger all
+    conversions, wait once for the slowest, then read them all back. A
+    cycle costs one conversion delay however many sensors share the bus.
     """
-    with SMBus(bus_number) as bus:
-        # Send measure command
-        write = i2c_msg.write(address, [MEAS_CMD])
-        bus.i2c_rdwr(write)
-        # Wait for conversion
-        time.sleep(DELAY_S)
-        # Read 6 bytes
-        read = i2c_msg.read(address, 6)
-        bus.i2c_rdwr(read)
-        data = list(read)
-    
-    # Parse raw values
-    t_raw = (data[0] << 8) | data[1]
-    h_raw = (data[3] << 8) | data[4]
-    
-    # Convert per datasheet
-    temperature = -45 + (175 * t_raw / 65535)
-    humidity    = 100 * (h_raw / 65535)
-    
-    # Return dictionary with metric names as keys
-    return {
-        "temperature_C": temperature,
-        "humidity_pct": humidity
-    }
+
+    def __init__(self, bus_number):
+        self.bus_number = bus_number
+        self._bus = None
+        self._lock = threading.Lock()
+
+    def _handle(self):
+        if self._bus is None:
+            self._bus = open_bus(self.bus_number)
+        return self._bus
+
+    def close(self):
+        if self._bus is not None:
+            try:
+                self._bus.close()
+            except Exception:
+                pass
+            self._bus = None
+
+    def acquire(self, sensors):
+        """
+        Read every sensor config in `sensors`.
+        Returns [(device_id, ts_ms, {metric: value}), ...]; a sensor that
+        fails is reported and left out.
+        """
+        results = []
+        with self._lock:
+            try:
+                bus = self._handle()
+            except Exception as e:
+                log.error("Error opening I²C bus %s: %s", self.bus_number, e)
+                return results
+
+            # 1) start every conversion; a sample is stamped when its
+            #    conversion starts
+            triggered = []
+            for dev in sensors:
+                try:
+                    driver = sensor_driver(dev)
+                    t0 = time.monotonic()
+                    driver.trigger(bus, sensor_address(dev))
+                    triggered.append((dev, driver, now_ms(), t0, time.monotonic() - t0))
+                except Exception as e:
+                    i2c_errors_total.inc(sensor=dev['id'])
+                    log.error("Error reading sensor %s: %s", dev['id'], e)
+            if not triggered:
+                if sensors:
+                    # Nothing answered: reopen the handle next cycle
+                    self.close()
+                return results
+
+            # 2) wait once, for the slowest conversion still in flight
+            ready_at = max(t0 + driver.delay_s for _, driver, _, t0, _ in triggered)
+            time.sleep(max(0.0, ready_at - time.monotonic()))
+
+            # 3) read everything back
+            for dev, driver, ts, _, trigger_s in triggered:
+                try:
+                    t1 = time.monotonic()
+                    results.append((dev['id'], ts, driver.fetch(bus, sensor_address(dev))))
+                    i2c_read_seconds.observe(trigger_s + time.monotonic() - t1, sensor=dev['id'])
+                except Exception as e:
+                    i2c_errors_total.inc(sensor=dev['id'])
+                    log.error("Error reading sensor %s: %s", dev['id'], e)
+        return results
+
+class AcquisitionEngine:
+    """
+    Reads all local sensors, one BusReader per I²C bus. Buses are
+    independent, so when there is more than one they are sampled in
+    parallel.
+    """
+
+    def __init__(self):
+        self._readers = {}
+        self._pool = None
+        self._workers = 0
+
+    def reader(self, bus_number):
+        reader = self._readers.get(bus_number)
+        if reader is None:
+            reader = self._readers[bus_number] = BusReader(bus_number)
+        return reader
+
+    def acquire(self, sensors):
+        """Returns [(device_id, ts_ms, {metric: value}), ...] for `sensors`."""
+        by_bus = {}
+        for dev in sensors:
+            by_bus.setdefault(sensor_bus(dev), []).append(dev)
+
+        if len(by_bus) <= 1:
+            return [r for bus_number, devs in by_bus.items()
+                    for r in self.reader(bus_number).acquire(devs)]
+
+        if self._workers < len(by_bus):
+            if self._pool is not None:
+                self._pool.shutdown(wait=False)
+            self._workers = len(by_bus)
+            self._pool = ThreadPoolExecutor(max_workers=self._workers,
+                                            thread_name_prefix="i2c")
+        futures = [self._pool.submit(self.reader(bus_number).acquire, devs)
+                   for bus_number, devs in by_bus.items()]
+        return [r for f in futures for r in f.result()]
+
+    def close(self):
+        for reader in self._readers.values():
+            reader.close()
+
+# Shared instance: keeps the bus handles open between cycles
+acquisition = AcquisitionEngine()
 
 def read_sensor(device_config):
     """
-    Read a sensor based on its configuration.
+    Read a single sensor based on its configuration.
     Returns a dictionary of metric values.
     """
-    # Get sensor parameters from device config 
-    bus_num = cfg.get('sensor', {}).get('i2c_bus', 1)
-    address = device_config.get('address', cfg.get('sensor', {}).get('address', 0x44))
-    
-    # Determine sensor type - default to SHT40 for backward compatibility
-    sensor_type = device_config.get('sensor_type', 'SHT40')
-    
-    # Get and call the appropriate sensor reading function
-    reader_func_name = SENSOR_TYPES.get(sensor_type)
-    if not reader_func_name:
-        raise ValueError(f"Unknown sensor type: {sensor_type}")
-    
-    # Call the sensor's read function dynamically
-    reader_func = globals()[reader_func_name]
-    return reader_func(bus_num, address)
+    results = acquisition.reader(sensor_bus(device_config)).acquire([device_config])
+    if not results:
+        raise IOError(f"No reading from sensor {device_config['id']}")
+    return results[0][2]
 
 def store_reading():
     """
-    Read all sensors listed in config.yaml and append results to readings.
-    Returns list of inserted rows: [(device_id, ts, metric, value), ...].
+    Read all sensors listed in config.yaml and append results to the samples table.
+    Returns list of inserted rows: [(device_id, ts_ms, metric, value), ...].
     """
+    with store_reading_seconds.time():
+        return _store_reading()
+
+def _store_reading():
     # Find all configured sensor devices
     sensor_devs = [
         d for d in cfg.get('devices', [])
         if d.get('type') == 'sensor' and d.get('source', 'local') == 'local'
     ]
-    ts = datetime.now().isoformat()
+    config_metrics = {
+        dev['id']: [m["name"] for m in dev.get("metrics", [])]
+        for dev in sensor_devs
+    }
     rows = []
 
-    # For each sensor, read values and store one row per metric
-    for dev in sensor_devs:
-        try:
-            # Read all metrics from this sensor
-            metrics_data = read_sensor(dev)
-            
-            # Get the metrics defined in config for this device
-            config_metrics = [m["name"] for m in dev.get("metrics", [])]
-            
-            # For each metric defined in config, store its value
-            for metric in config_metrics:
-                if metric in metrics_data:
-                    rows.append((dev['id'], ts, metric, metrics_data[metric]))
-        except Exception as e:
-            print(f"Error reading sensor {dev['id']}: {e}")
-            continue
-
-    # Insert into SQLite with generic key-value schema
-    conn = sqlite3.connect(DB)
-    conn.executemany(
-        "INSERT OR REPLACE INTO readings (device_id, ts, metric, value) VALUES (?, ?, ?, ?)",
-        rows
-    )
-    conn.commit()
-    conn.close()
-
-    return rows
\ No newline at end of file
+    # Store one row per metric defined in config, each sample with its own ts
+    for device_id, ts, metrics_data in acquisition.acquire(sensor_devs):
+        for metric in config_metrics[device_id]:
+            if metric in metrics_data:
+                rows.append((device_id, ts, metric, metrics_data[metric]))
+
+    # Insert into the samples table in one transaction (or queue them for
+    # the next group commit); the collector waits for room rather than
+    # dropping a cycle
+    writer.submit(rows, block=True, timeout=30)
+
+    return rows
@@ -0,0 +1,50 @@
+# settings.py — config.yaml, loaded once and shared by every module
+
+import os
+import threading
+
+import yaml
+
+# Override with GROWLAB_CONFIG to run against another file (benchmarks, tests)
+CONFIG_PATH = os.environ.get('GROWLAB_CONFIG', 'config.yaml')
+
+_lock = threading.Lock()
+
+def mtime(path=CONFIG_PATH):
+    """Modification time of the config file, or None if it is missing."""
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return None
+
+def read(path=CONFIG_PATH):
+    """Parse the config file into a new dict."""
+    with open(path) as f:
+        return yaml.safe_load(f) or {}
+
+# The shared config. Modules import this dict instead of reading the file;
+# reload() updates it in place, so they all see the new values.
+loaded_mtime = mtime()
+cfg = read()
+
+def apply(fresh, stamp=None):
+    """
+    Make `fresh` (from read()) the shared config, updating `cfg` in place.
+    Values that modules copied into constants at import time (database
+    path, retention policy, ...) keep their old value until a restart.
+    """
+    global loaded_mtime
+    with _lock:
+        cfg.clear()
+        cfg.update(fresh)
+        loaded_mtime = stamp if stamp is not None else mtime()
+    return cfg
+
+def reload():
+    """Re-read the config file into `cfg`; raises if it does not parse."""
+    stamp = mtime()
+    return apply(read(), stamp)
+
+def changed():
+    """True if the config file was modified since it was last loaded."""
+    return mtime() != loaded_mtime
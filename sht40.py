@@ -1,5 +1,6 @@
 import time
-from smbus2 import SMBus, i2c_msg
+
+from buses import crc8, open_bus
 
 def read(bus_number=1, address=0x44, meas_cmd=0xFD, delay=0.02):
     """
@@ -14,18 +15,22 @@ def read(bus_number=1, address=0x44, meas_cmd=0xFD, delay=0.02):
     Returns:
       (temperature_celsius, relative_humidity_percent)
     """
-    with SMBus(bus_number) as bus:
+    # bus backend (smbus2 or simulated) comes from config.yaml
+    bus = open_bus(bus_number)
+    try:
         # 1) send measure command
-        write = i2c_msg.write(address, [meas_cmd])
-        read  = i2c_msg.read(address, 6)
-        bus.i2c_rdwr(write)
+        bus.write(address, [meas_cmd])
         
         # 2) wait for conversion
         time.sleep(delay)
         
         # 3) read 6 bytes back
-        bus.i2c_rdwr(read)
-        data = list(read)
+        data = bus.read(address, 6)
+    finally:
+        bus.close()
+
+    if crc8(data[0:2]) != data[2] or crc8(data[3:5]) != data[5]:
+        raise IOError("CRC mismatch reading SHT40")
 
     # parse raw values
     t_raw = (data[0] << 8) | data[1]
@@ -0,0 +1,30 @@
+/**
+ * One-round-trip hydration for the dashboard.
+ *
+ * Fetches /api/dashboard/snapshot once per page load; widgets call
+ * GrowLabSnapshot.widget(id) for their initial data and only fall back to
+ * their own endpoint if the snapshot is missing or failed.
+ */
+window.GrowLabSnapshot = (() => {
+  const SNAPSHOT_POINTS = 400;
+  let pending = null;
+
+  function load() {
+    if (pending === null) {
+      pending = fetch(`/api/dashboard/snapshot?range=24h&points=${SNAPSHOT_POINTS}`)
+        .then(res => (res.ok ? res.json() : null))
+        .catch(err => {
+          console.error('Dashboard snapshot failed:', err);
+          return null;
+        });
+    }
+    return pending;
+  }
+
+  async function widget(id) {
+    const snapshot = await load();
+    return snapshot && snapshot.widgets ? snapshot.widgets[id] || null : null;
+  }
+
+  return { load, widget };
+})();
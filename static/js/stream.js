@@ -0,0 +1,83 @@
+/**
+ * Shared live-update stream for all widgets on the page.
+ *
+ * Opens one EventSource to /api/stream per tab. Widgets register with
+ * GrowLabStream.subscribe(deviceIds, handlers, poll, interval): handlers
+ * map event types ('reading', 'device', 'control', 'plug_state') to callbacks, and
+ * poll() is called every `interval` ms only while the stream is down
+ * (or when EventSource is not supported), so polling is just a fallback.
+ */
+window.GrowLabStream = (() => {
+  const subscriptions = [];
+  let source = null;
+  let connectScheduled = false;
+  let openedBefore = false;
+
+  function isLive() {
+    return source !== null && source.readyState === EventSource.OPEN;
+  }
+
+  function dispatch(type, event) {
+    let data;
+    try {
+      data = JSON.parse(event.data);
+    } catch (err) {
+      console.error('Bad stream event:', err);
+      return;
+    }
+    subscriptions.forEach(sub => {
+      const handler = sub.handlers[type];
+      if (!handler) return;
+      const ids = [data.device_id, data.sensor_id, data.control_id];
+      if (sub.deviceIds.length === 0 || ids.some(id => sub.deviceIds.includes(id))) {
+        handler(data);
+      }
+    });
+  }
+
+  function connect() {
+    connectScheduled = false;
+    if (!('EventSource' in window)) return;
+
+    // One connection for every widget, filtered to the devices on the page
+    const ids = new Set();
+    let everything = false;
+    subscriptions.forEach(sub => {
+      if (sub.deviceIds.length === 0) everything = true;
+      sub.deviceIds.forEach(id => ids.add(id));
+    });
+    const query = everything || ids.size === 0 ? '' : `?devices=${encodeURIComponent([...ids].join(','))}`;
+
+    source = new EventSource(`/api/stream${query}`);
+    ['reading', 'device', 'control', 'plug_state'].forEach(type => {
+      source.addEventListener(type, event => dispatch(type, event));
+    });
+    // After a reconnect, catch up on anything missed while we were down
+    source.addEventListener('open', () => {
+      if (openedBefore) {
+        subscriptions.forEach(sub => sub.poll && sub.poll());
+      }
+      openedBefore = true;
+    });
+  }
+
+  function subscribe(deviceIds, handlers, poll, interval = 60000) {
+    const sub = { deviceIds: deviceIds.filter(Boolean), handlers, poll };
+    subscriptions.push(sub);
+
+    if (poll) {
+      setInterval(() => {
+        if (!isLive()) poll();
+      }, interval);
+    }
+
+    // Widgets subscribe during DOMContentLoaded; connect once they all have
+    if (!connectScheduled && source === null) {
+      connectScheduled = true;
+      setTimeout(connect, 0);
+    }
+    return sub;
+  }
+
+  return { subscribe, isLive };
+})();
@@ -13,7 +13,13 @@ document.addEventListener('DOMContentLoaded', () => {
     }
   }
 
-  // Initial update and polling every second
-  updateClock();
+  // Initial value from the dashboard snapshot, then polling every second
+  GrowLabSnapshot.widget('clock').then(snapshot => {
+    if (snapshot) {
+      display.textContent = snapshot.datetime;
+    } else {
+      updateClock();
+    }
+  });
   setInterval(updateClock, 1000);
 });
\ No newline at end of file
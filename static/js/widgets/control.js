@@ -21,11 +21,23 @@ class DeviceController {
     // Set up the chart for historical data
     this.initChart();
     
-    // Initial data fetch
-    this.fetchStatus();
+    // Initial data from the dashboard snapshot (falls back to a fetch)
+    GrowLabSnapshot.widget(deviceId).then(snapshot => {
+      if (snapshot) {
+        this.updateUI(snapshot);
+      } else {
+        this.fetchStatus();
+      }
+    });
     
-    // Set up polling for updates
-    setInterval(() => this.fetchStatus(), 60000); // Update every minute
+    // Refresh on state changes and control decisions from the shared
+    // stream; poll every minute only while the stream is unavailable
+    GrowLabStream.subscribe([deviceId], {
+      device: () => this.fetchStatus(),
+      control: data => {
+        if (data.device_id === this.deviceId) this.fetchStatus();
+      }
+    }, () => this.fetchStatus(), 60000);
   }
   
   replaceButtonsWithToggle() {
@@ -6,6 +6,23 @@ document.addEventListener('DOMContentLoaded', () => {
     const deviceId = widgetId.split('-')[1];
 
     const statusSpan = widget.querySelector('.device-status');
+    const dutySpan = widget.querySelector('.device-duty');
+    const actualSpan = widget.querySelector('.device-actual');
+    let loggedState = null;
+
+    // What the plug itself reported to the background poller
+    function showActual(actual) {
+      if (!actualSpan) return;
+      if (!actual || !actual.state) {
+        actualSpan.textContent = '';
+        return;
+      }
+      const age = actual.checked_at ? Math.round((Date.now() - new Date(actual.checked_at)) / 1000) : null;
+      let text = `plug reports ${actual.state}` + (age !== null ? ` (${age}s ago)` : '');
+      if (actual.error) text += ', not answering';
+      actualSpan.textContent = text;
+      actualSpan.classList.toggle('device-drift', loggedState !== null && actual.state !== loggedState);
+    }
     const toggleSwitch = widget.querySelector('.device-toggle');
     const toggleLabel = widget.querySelector('.toggle-label');
     const chartCanvas = widget.querySelector(`#device-chart-${deviceId}`);
@@ -40,13 +57,17 @@ document.addEventListener('DOMContentLoaded', () => {
     });
 
     // Fetch status and history, then update UI/chart
-    async function updateDevice() {
+    async function updateDevice(preloaded = null) {
       try {
-        const res = await fetch(`/api/${deviceId}/status`);
-        const json = await res.json();
+        let json = preloaded;
+        if (!json) {
+          const res = await fetch(`/api/${deviceId}/status`);
+          json = await res.json();
+        }
 
         // Update current status
         const current = json.current.state;
+        loggedState = current || null;
         statusSpan.textContent = current ? current.charAt(0).toUpperCase() + current.slice(1) : '--';
         
         // Update toggle switch without triggering event
@@ -56,6 +77,16 @@ document.addEventListener('DOMContentLoaded', () => {
           toggleLabel.textContent = isOn ? 'On' : 'Off';
         }
 
+        showActual(json.actual);
+
+        // Duty cycle over the range
+        if (json.stats && dutySpan) {
+          const hours = json.stats.on_ms / 3600000;
+          const longest = json.stats.longest_on_ms / 60000;
+          dutySpan.textContent = `on ${hours.toFixed(1)} h (${json.stats.on_pct}%), ` +
+            `${json.stats.switches} switches, longest ${longest.toFixed(0)} min`;
+        }
+
         // Prepare history
         if (json.history && json.history.length > 0) {
           const times = json.history.map(item => {
@@ -94,8 +125,10 @@ document.addEventListener('DOMContentLoaded', () => {
       }
     });
 
-    // Initial load and polling
-    updateDevice();
-    setInterval(updateDevice, POLL_INTERVAL);
+    // Initial load from the dashboard snapshot, then refresh whenever the
+    // stream reports a state change; polling is only used while the
+    // stream is unavailable
+    GrowLabSnapshot.widget(deviceId).then(snapshot => updateDevice(snapshot));
+    GrowLabStream.subscribe([deviceId], { device: () => updateDevice(), plug_state: showActual }, () => updateDevice(), POLL_INTERVAL);
   });
 });
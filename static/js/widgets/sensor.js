@@ -1,5 +1,7 @@
 document.addEventListener('DOMContentLoaded', () => {
   const POLL_INTERVAL = 60000; // 60s
+  const RANGE = '24h';
+  const MAX_POINTS = 5000;
   
   // Keep track of widget instances to prevent duplicate initialization
   const initializedWidgets = new Set();
@@ -77,14 +79,32 @@ document.addEventListener('DOMContentLoaded', () => {
       });
     });
 
+    // Timestamps are UTC ISO strings; show them in local time
+    function formatTime(ts) {
+      const date = new Date(ts);
+      return isNaN(date) ? ts : date.toLocaleTimeString([], { hour: '2-digit', minute: '2-digit' });
+    }
+
+    // Point budget: roughly one point per horizontal pixel of the chart
+    function pointBudget() {
+      const canvas = widget.querySelector('canvas');
+      const width = canvas ? canvas.clientWidth || canvas.width : 400;
+      return Math.min(MAX_POINTS, Math.max(3, Math.round(width)));
+    }
+
     // Fetch and render the data
-    async function updateSensorData() {
+    async function updateSensorData(preloaded = null) {
       try {
-        console.log(`Fetching sensor data for ${deviceId}...`);
-        const res = await fetch(`/api/${deviceId}/sensor_data`);
-        const json = await res.json();
+        let json = preloaded;
+        if (!json) {
+          console.log(`Fetching sensor data for ${deviceId}...`);
+          // Ask the server for about one point per chart pixel; it reduces
+          // the full window with LTTB so peaks are kept
+          const res = await fetch(`/api/${deviceId}/sensor_data?range=${RANGE}&points=${pointBudget()}`);
+          json = await res.json();
+        }
         
-        const { current, history, has_data } = json;
+        const { current, history, series, has_data } = json;
 
         // Update current readings
         metrics.forEach(m => {
@@ -145,34 +165,14 @@ document.addEventListener('DOMContentLoaded', () => {
         const noDataMessages = widget.querySelectorAll('.no-data-message');
         noDataMessages.forEach(msg => msg.remove());
 
-        // Prepare timeline and series per metric (limited to reasonable number of points)
-        const maxPoints = 20; // Limit points for better performance
-        let displayHistory = history;
-        if (history.length > maxPoints) {
-          const step = Math.floor(history.length / maxPoints);
-          displayHistory = history.filter((_, i) => i % step === 0);
-        }
-        
-        // Extract just the time portion for display
-        const times = displayHistory.map(r => {
-          const ts = r.ts;
-          return ts.split('T').length > 1 ? ts.split('T')[1].substring(0, 5) : ts;
-        });
-        
-        // Update each chart with its metric data
+        // Update each chart with exactly the points the server selected
         metrics.forEach(m => {
           const chart = charts[m.name];
           if (!chart) return; // Skip if chart not initialized
           
-          const data = displayHistory.map(r => {
-            const val = r[m.name];
-            if (val === undefined || val === null) return null;
-            return typeof val === 'string' ? parseFloat(val) : val;
-          });
-          
-          // Update chart data
-          chart.data.labels = times;
-          chart.data.datasets[0].data = data;
+          const points = (series && series[m.name]) || [];
+          chart.data.labels = points.map(([ts]) => formatTime(ts));
+          chart.data.datasets[0].data = points.map(([, val]) => val);
           
           // Use the 'none' mode to avoid animation which can cause layout issues
           chart.update('none');
@@ -182,13 +182,14 @@ document.addEventListener('DOMContentLoaded', () => {
         tableBody.innerHTML = '';
         
         // Add rows but limit to latest 10 for readability
-        const tableHistory = history.slice(0, 10);
+        const tableHistory = history.slice(-10).reverse();
         
         tableHistory.forEach(r => {
           const tr = document.createElement('tr');
           // Timestamp cell
           const tdTime = document.createElement('td');
-          tdTime.textContent = r.ts;
+          const date = new Date(r.ts);
+          tdTime.textContent = isNaN(date) ? r.ts : date.toLocaleString();
           tr.appendChild(tdTime);
           // Metric cells
           metrics.forEach(m => {
@@ -210,8 +211,57 @@ document.addEventListener('DOMContentLoaded', () => {
       }
     }
 
-    // Initial draw and periodic updates
-    updateSensorData();
-    setInterval(updateSensorData, POLL_INTERVAL);
+    // Apply one streamed reading without another round trip
+    function applyReading(reading) {
+      const values = reading.values || {};
+      const label = formatTime(reading.ts);
+
+      metrics.forEach(m => {
+        const value = values[m.name];
+        if (value === undefined || value === null) return;
+
+        const span = spans[m.name];
+        if (span) {
+          span.textContent = Number(value).toFixed(2);
+          span.classList.remove('no-data');
+        }
+
+        const chart = charts[m.name];
+        if (chart) {
+          chart.data.labels.push(label);
+          chart.data.datasets[0].data.push(value);
+          if (chart.data.labels.length > pointBudget()) {
+            chart.data.labels.shift();
+            chart.data.datasets[0].data.shift();
+          }
+          chart.update('none');
+        }
+      });
+
+      widget.querySelectorAll('.no-data-message').forEach(msg => msg.remove());
+
+      if (tableBody) {
+        const tr = document.createElement('tr');
+        const tdTime = document.createElement('td');
+        const date = new Date(reading.ts);
+        tdTime.textContent = isNaN(date) ? reading.ts : date.toLocaleString();
+        tr.appendChild(tdTime);
+        metrics.forEach(m => {
+          const td = document.createElement('td');
+          const value = values[m.name];
+          td.textContent = value === undefined || value === null ? '--' : Number(value).toFixed(2);
+          tr.appendChild(td);
+        });
+        tableBody.prepend(tr);
+        while (tableBody.rows.length > 10) {
+          tableBody.deleteRow(-1);
+        }
+      }
+    }
+
+    // Initial draw from the dashboard snapshot, then live updates from the
+    // shared stream; polling is only used while the stream is unavailable
+    GrowLabSnapshot.widget(deviceId).then(snapshot => updateSensorData(snapshot));
+    GrowLabStream.subscribe([deviceId], { reading: applyReading }, () => updateSensorData(), POLL_INTERVAL);
   });
 });
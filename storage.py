@@ -0,0 +1,827 @@
+# storage.py — Shared SQLite access for the collector, controller and dashboard
+
+import heapq
+import json
+import logging
+import sqlite3
+import threading
+from itertools import islice
+from datetime import datetime, timezone
+
+from settings import cfg
+from latest import latest
+from events import bus
+from metrics import sqlite_seconds
+import profiling
+
+log = logging.getLogger(__name__)
+
+DB = cfg.get('DATABASE', 'data.db')
+
+# Connection tuning (overridable under `storage:` in config.yaml)
+storage_cfg     = cfg.get('storage') or {}
+BUSY_TIMEOUT_MS = storage_cfg.get('busy_timeout_ms', 5000)
+MMAP_SIZE       = storage_cfg.get('mmap_size', 64 * 1024 * 1024)
+
+# In "split" mode the collector daemon and any number of web workers
+# share events through the `events` outbox table instead of one
+# in-process bus (see outbox.py)
+SPLIT = (cfg.get('process') or {}).get('mode', 'single') == 'split'
+
+# One connection per (thread, database path), reused across calls
+_local = threading.local()
+
+# Rollup tiers, finest first: (name, bucket width in ms). Each width
+# divides the next, so every tier can be rebuilt from the one below it.
+ROLLUP_TIERS = [
+    ('1m',  60 * 1000),
+    ('15m', 15 * 60 * 1000),
+    ('1h',  60 * 60 * 1000),
+    ('1d',  24 * 60 * 60 * 1000),
+]
+
+# (device_id, metric) -> series_id, shared by every thread
+_series_cache = {}
+_series_lock  = threading.Lock()
+
+def get_connection(db_path=None):
+    """
+    Return this thread's connection to the database, opening and tuning it
+    on first use. Callers must not close it; use `with conn:` for writes so
+    they commit (or roll back) as one transaction.
+    """
+    path  = db_path or DB
+    conns = getattr(_local, 'conns', None)
+    if conns is None:
+        conns = _local.conns = {}
+
+    conn = conns.get(path)
+    if conn is None:
+        conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT_MS / 1000,
+                               factory=profiling.connection_factory())
+        _configure(conn)
+        conns[path] = conn
+    return conn
+
+def close_connection(db_path=None):
+    """Close and forget this thread's connection, if it has one."""
+    conns = getattr(_local, 'conns', {})
+    conn  = conns.pop(db_path or DB, None)
+    if conn is not None:
+        conn.close()
+
+def _configure(conn):
+    """
+    Apply the pragmas every connection should run with:
+    - WAL so readers never block the writer (and vice versa)
+    - synchronous=NORMAL, which is durable enough under WAL and avoids an
+      fsync per commit
+    - a busy timeout so concurrent writers wait instead of failing with
+      "database is locked"
+    - memory-mapped reads
+    - auto_vacuum=INCREMENTAL, so retention can hand freed pages back;
+      this only takes effect on a brand-new database (it must precede
+      the switch to WAL), existing ones need `manage.py
+      enable-incremental-vacuum` once
+    """
+    conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA busy_timeout={int(BUSY_TIMEOUT_MS)}")
+    conn.execute(f"PRAGMA mmap_size={int(MMAP_SIZE)}")
+
+def init_db():
+    """
+    Create every table the application uses if it doesn’t exist yet.
+    """
+    conn = get_connection()
+    with conn:
+        # Time series: small integer ids for device/metric names, one
+        # series per (device, metric) pair, and samples clustered on
+        # (series_id, ts) so a range scan is a single b-tree seek.
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS devices(
+                id    INTEGER PRIMARY KEY,
+                name  TEXT NOT NULL UNIQUE
+            )
+        """)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS metrics(
+                id    INTEGER PRIMARY KEY,
+                name  TEXT NOT NULL UNIQUE
+            )
+        """)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS series(
+                series_id  INTEGER PRIMARY KEY,
+                device     INTEGER NOT NULL REFERENCES devices(id),
+                metric     INTEGER NOT NULL REFERENCES metrics(id),
+                UNIQUE (device, metric)
+            )
+        """)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS samples(
+                series_id  INTEGER NOT NULL,
+                ts         INTEGER NOT NULL,   -- epoch milliseconds, UTC
+                value      REAL,
+                PRIMARY KEY (series_id, ts)
+            ) WITHOUT ROWID
+        """)
+        # Per-bucket aggregates; mean is sum / count
+        for name, _ in ROLLUP_TIERS:
+            conn.execute(f"""
+                CREATE TABLE IF NOT EXISTS rollup_{name}(
+                    series_id  INTEGER NOT NULL,
+                    bucket     INTEGER NOT NULL,   -- bucket start, epoch ms
+                    count      INTEGER NOT NULL,
+                    min        REAL,
+                    max        REAL,
+                    sum        REAL,
+                    last       REAL,
+                    last_ts    INTEGER,
+                    PRIMARY KEY (series_id, bucket)
+                ) WITHOUT ROWID
+            """)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS meta(
+                key    TEXT PRIMARY KEY,
+                value  TEXT
+            )
+        """)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS device_logs(
+                ts         TEXT,
+                device_id  TEXT,
+                state      TEXT
+            )
+        """)
+        conn.execute("""
+            CREATE INDEX IF NOT EXISTS device_logs_device_ts
+                ON device_logs(device_id, ts)
+        """)
+        # One row per period a device spent in one state (end is NULL
+        # while it lasts) and per-day duty-cycle totals, both maintained
+        # by log_device_state() as changes are logged
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS device_intervals(
+                device_id  TEXT NOT NULL,
+                start      INTEGER NOT NULL,   -- epoch milliseconds, UTC
+                end        INTEGER,
+                state      TEXT NOT NULL,
+                PRIMARY KEY (device_id, start)
+            ) WITHOUT ROWID
+        """)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS device_daily(
+                device_id      TEXT NOT NULL,
+                day            TEXT NOT NULL,   -- YYYY-MM-DD, UTC
+                on_ms          INTEGER NOT NULL DEFAULT 0,
+                switches       INTEGER NOT NULL DEFAULT 0,
+                longest_on_ms  INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (device_id, day)
+            ) WITHOUT ROWID
+        """)
+        # Outbox of events for other processes (split mode); AUTOINCREMENT
+        # so ids never go backwards after old events are pruned
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS events(
+                id    INTEGER PRIMARY KEY AUTOINCREMENT,
+                ts    INTEGER NOT NULL,   -- epoch milliseconds
+                type  TEXT NOT NULL,
+                data  TEXT NOT NULL       -- JSON
+            )
+        """)
+        # Leader election: one row per lease (see lease.py)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS leases(
+                name     TEXT PRIMARY KEY,
+                owner    TEXT NOT NULL,
+                expires  INTEGER NOT NULL   -- epoch milliseconds
+            )
+        """)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS control_configs(
+                control_id TEXT PRIMARY KEY,
+                sensor_id TEXT,
+                device_id TEXT,
+                metric TEXT,
+                operator TEXT,
+                target_value REAL,
+                enabled INTEGER
+            )
+        """)
+
+    if conn.execute("SELECT EXISTS (SELECT 1 FROM device_intervals)").fetchone()[0] == 0 and \
+            conn.execute("SELECT EXISTS (SELECT 1 FROM device_logs)").fetchone()[0] == 1:
+        log.warning("Device duty-cycle tables are empty; run `python manage.py "
+                    "device-stats-backfill` to build them from device_logs")
+
+def log_device_state(device_id: str, state: str):
+    """
+    Append a record of an on/off event to the device_logs table and
+    update the device's intervals and daily duty cycle in the same
+    transaction.
+    """
+    ts   = datetime.utcnow().isoformat()
+    conn = get_connection()
+    event = {"device_id": device_id, "ts": ts, "state": state}
+    with sqlite_seconds.time(site='log_device_state', op='commit'), conn:
+        conn.execute(
+            "INSERT INTO device_logs(ts, device_id, state) VALUES (?, ?, ?)",
+            (ts, device_id, state)
+        )
+        record_device_state(conn, device_id, to_epoch_ms(ts), state)
+        if SPLIT:
+            publish_event('device', event, conn)
+    if not SPLIT:
+        publish_event('device', event)
+
+# — device duty cycle —
+
+DAY_MS = 24 * 60 * 60 * 1000
+
+def _day(ts_ms):
+    return datetime.fromtimestamp(ts_ms / 1000, timezone.utc).strftime('%Y-%m-%d')
+
+def _day_pieces(start_ms, end_ms):
+    """Split [start_ms, end_ms) at UTC midnights into (day, length_ms) pieces."""
+    while start_ms < end_ms:
+        piece_end = min(end_ms, start_ms - start_ms % DAY_MS + DAY_MS)
+        yield _day(start_ms), piece_end - start_ms
+        start_ms = piece_end
+
+def record_device_state(conn, device_id, ts_ms, state):
+    """
+    Fold one logged state into device_intervals and device_daily. Must be
+    called inside the caller's write transaction.
+
+    A state equal to the current one (a re-sent command) changes nothing.
+    Otherwise the open interval is closed at ts_ms (its on-time, split at
+    UTC midnight, is added to the daily totals) and a new one is opened,
+    counting one switch for the day.
+    """
+    row = conn.execute("""
+        SELECT start, state FROM device_intervals
+         WHERE device_id = ? ORDER BY start DESC LIMIT 1
+    """, (device_id,)).fetchone()
+    if row is not None:
+        start, previous = row
+        if previous == state:
+            return
+        ts_ms = max(ts_ms, start)
+        if previous == 'on':
+            conn.executemany("""
+                INSERT INTO device_daily (device_id, day, on_ms, longest_on_ms)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT (device_id, day) DO UPDATE SET
+                    on_ms         = on_ms + excluded.on_ms,
+                    longest_on_ms = max(longest_on_ms, excluded.longest_on_ms)
+            """, [(device_id, day, ms, ms) for day, ms in _day_pieces(start, ts_ms)])
+        if ts_ms == start:
+            # Changed again within the same millisecond: replace it
+            conn.execute("DELETE FROM device_intervals WHERE device_id = ? AND start = ?",
+                         (device_id, start))
+        else:
+            conn.execute("UPDATE device_intervals SET end = ? WHERE device_id = ? AND start = ?",
+                         (ts_ms, device_id, start))
+    conn.execute("INSERT INTO device_intervals (device_id, start, end, state) VALUES (?, ?, NULL, ?)",
+                 (device_id, ts_ms, state))
+    conn.execute("""
+        INSERT INTO device_daily (device_id, day, switches) VALUES (?, ?, 1)
+        ON CONFLICT (device_id, day) DO UPDATE SET switches = switches + 1
+    """, (device_id, _day(ts_ms)))
+
+def backfill_device_stats(progress=None):
+    """
+    Rebuild device_intervals and device_daily from device_logs, one device
+    per transaction. Only needed for logs written before they existed.
+    Returns the number of devices.
+    """
+    conn    = get_connection()
+    devices = [r[0] for r in conn.execute("SELECT DISTINCT device_id FROM device_logs")]
+    for done, device_id in enumerate(devices, 1):
+        with conn:
+            conn.execute("DELETE FROM device_intervals WHERE device_id = ?", (device_id,))
+            conn.execute("DELETE FROM device_daily WHERE device_id = ?", (device_id,))
+            rows = conn.execute(
+                "SELECT ts, state FROM device_logs WHERE device_id = ? ORDER BY ts",
+                (device_id,)
+            ).fetchall()
+            for ts, state in rows:
+                record_device_state(conn, device_id, to_epoch_ms(ts), state)
+        if progress:
+            progress(done, len(devices))
+    return len(devices)
+
+def device_intervals(device_id, start_ms, end_ms, limit=None):
+    """
+    (start, end, state) intervals of one device overlapping
+    [start_ms, end_ms), oldest first; end is None for the current one.
+    The interval in progress at start_ms is included. With `limit`, only
+    the newest `limit` of them.
+    """
+    conn = get_connection()
+    with sqlite_seconds.time(site='device_intervals', op='query'):
+        first = conn.execute("""
+            SELECT start, end, state FROM device_intervals
+             WHERE device_id = ? AND start < ?
+             ORDER BY start DESC LIMIT 1
+        """, (device_id, start_ms)).fetchone()
+        rows = conn.execute(f"""
+            SELECT start, end, state FROM (
+                SELECT start, end, state FROM device_intervals
+                 WHERE device_id = ? AND start >= ? AND start < ?
+                 ORDER BY start DESC {'LIMIT ?' if limit else ''}
+            ) ORDER BY start
+        """, (device_id, start_ms, end_ms, *([limit] if limit else []))).fetchall()
+    if first is not None and (first[1] is None or first[1] > start_ms) \
+            and (not limit or len(rows) < limit):
+        rows.insert(0, first)
+    return rows
+
+def device_daily(device_id, first_day, last_day, until_ms=None):
+    """
+    {day: (on_ms, switches, longest_on_ms)} for days in [first_day,
+    last_day]. The table only holds closed runs; with `until_ms`, an on
+    run still in progress is counted up to then.
+    """
+    conn = get_connection()
+    with sqlite_seconds.time(site='device_daily', op='query'):
+        rows = conn.execute("""
+            SELECT day, on_ms, switches, longest_on_ms FROM device_daily
+             WHERE device_id = ? AND day >= ? AND day <= ?
+             ORDER BY day
+        """, (device_id, first_day, last_day)).fetchall()
+        last = conn.execute("""
+            SELECT start, end, state FROM device_intervals
+             WHERE device_id = ? ORDER BY start DESC LIMIT 1
+        """, (device_id,)).fetchone()
+    days = {day: tuple(values) for day, *values in rows}
+    if until_ms is not None and last is not None and last[1] is None and last[2] == 'on':
+        for day, ms in _day_pieces(last[0], until_ms):
+            if first_day <= day <= last_day:
+                on_ms, switches, longest = days.get(day, (0, 0, 0))
+                days[day] = (on_ms + ms, switches, max(longest, ms))
+    return dict(sorted(days.items()))
+
+def device_stats(device_id, start_ms, end_ms):
+    """
+    {"on_ms", "on_pct", "switches", "longest_on_ms"} of one device within
+    [start_ms, end_ms), in one aggregate over the intervals overlapping
+    it. Runs are clipped to the range; the one in progress counts up to
+    end_ms.
+    """
+    with sqlite_seconds.time(site='device_stats', op='query'):
+        on_ms, switches, longest = get_connection().execute("""
+            SELECT coalesce(sum(CASE WHEN state = 'on'
+                                THEN min(coalesce(end, :end), :end) - max(start, :start) END), 0),
+                   count(CASE WHEN start >= :start THEN 1 END),
+                   coalesce(max(CASE WHEN state = 'on'
+                                THEN min(coalesce(end, :end), :end) - max(start, :start) END), 0)
+              FROM device_intervals
+             WHERE device_id = :device AND start < :end
+               AND start >= (SELECT coalesce(max(start), :start) FROM device_intervals
+                              WHERE device_id = :device AND start <= :start)
+        """, {"device": device_id, "start": start_ms, "end": end_ms}).fetchone()
+    return {"on_ms": on_ms, "on_pct": round(100 * on_ms / (end_ms - start_ms), 1),
+            "switches": switches, "longest_on_ms": longest}
+
+def current_device_state(device_ids):
+    """{device_id: (since_ms, state)} from each device's open interval."""
+    conn = get_connection()
+    result = {}
+    with sqlite_seconds.time(site='device_current', op='query'):
+        for device_id in device_ids:
+            row = conn.execute("""
+                SELECT start, state FROM device_intervals
+                 WHERE device_id = ? ORDER BY start DESC LIMIT 1
+            """, (device_id,)).fetchone()
+            if row is not None:
+                result[device_id] = tuple(row)
+    return result
+
+# — events —
+
+def publish_event(event_type, data, conn=None):
+    """
+    Announce a change. In single-process mode it goes straight to the
+    in-process event bus, so call it after the change commits. In split
+    mode it is appended to the `events` outbox, inside `conn`'s
+    transaction when given so it commits together with the change, and
+    each process's OutboxTail delivers it to its own bus.
+    """
+    if not SPLIT:
+        bus.publish(event_type, data)
+        return
+    row = (now_ms(), event_type, json.dumps(data))
+    if conn is not None:
+        conn.execute("INSERT INTO events (ts, type, data) VALUES (?, ?, ?)", row)
+        return
+    conn = get_connection()
+    with conn:
+        conn.execute("INSERT INTO events (ts, type, data) VALUES (?, ?, ?)", row)
+
+# — timestamps —
+
+def to_epoch_ms(ts, local=False):
+    """
+    Normalise a timestamp to integer epoch milliseconds (UTC).
+    Accepts unix seconds, datetimes and ISO strings (with either a 'T' or a
+    space separator). Naive values are read as UTC unless local=True.
+    """
+    if isinstance(ts, (int, float)) and not isinstance(ts, bool):
+        return int(round(ts * 1000))
+    if isinstance(ts, str):
+        ts = datetime.fromisoformat(ts.strip().replace('Z', '+00:00'))
+    if not isinstance(ts, datetime):
+        raise ValueError(f"Unsupported timestamp: {ts!r}")
+    if ts.tzinfo is None and not local:
+        ts = ts.replace(tzinfo=timezone.utc)
+    # Naive datetimes are interpreted as local time by .timestamp()
+    return int(round(ts.timestamp() * 1000))
+
+def now_ms():
+    """Current time in epoch milliseconds."""
+    return to_epoch_ms(datetime.now(timezone.utc))
+
+def ms_to_iso(ms):
+    """Format epoch milliseconds as an ISO-8601 UTC string."""
+    dt = datetime.fromtimestamp(ms / 1000, timezone.utc)
+    return dt.isoformat(timespec='milliseconds').replace('+00:00', 'Z')
+
+# — series dictionary —
+
+def get_series_id(device_id, metric, create=False):
+    """
+    Return the series_id for (device_id, metric), or None if it doesn't
+    exist and create is False. Ids are cached for the life of the process.
+    """
+    key = (device_id, metric)
+    sid = _series_cache.get(key)
+    if sid is not None or not create:
+        if sid is None:
+            sid = _lookup_series(get_connection(), device_id, metric)
+            if sid is not None:
+                _series_cache[key] = sid
+        return sid
+
+    with _series_lock:
+        sid = _series_cache.get(key)
+        if sid is None:
+            conn = get_connection()
+            # Committed on its own so the id stays valid even if the
+            # caller's sample transaction later rolls back
+            with conn:
+                conn.execute("INSERT OR IGNORE INTO devices(name) VALUES (?)", (device_id,))
+                conn.execute("INSERT OR IGNORE INTO metrics(name) VALUES (?)", (metric,))
+                conn.execute("""
+                    INSERT OR IGNORE INTO series(device, metric)
+                    SELECT d.id, m.id FROM devices d, metrics m
+                     WHERE d.name = ? AND m.name = ?
+                """, (device_id, metric))
+            sid = _lookup_series(conn, device_id, metric)
+            _series_cache[key] = sid
+    return sid
+
+def _lookup_series(conn, device_id, metric):
+    row = conn.execute("""
+        SELECT s.series_id
+          FROM series s
+          JOIN devices d ON d.id = s.device
+          JOIN metrics m ON m.id = s.metric
+         WHERE d.name = ? AND m.name = ?
+    """, (device_id, metric)).fetchone()
+    return row[0] if row else None
+
+def device_series(device_id):
+    """Return {metric_name: series_id} for every series of a device."""
+    rows = get_connection().execute("""
+        SELECT m.name, s.series_id
+          FROM series s
+          JOIN devices d ON d.id = s.device
+          JOIN metrics m ON m.id = s.metric
+         WHERE d.name = ?
+    """, (device_id,)).fetchall()
+    return dict(rows)
+
+# — samples —
+
+def write_samples(rows):
+    """
+    Store (device_id, ts_ms, metric, value) rows with one executemany in a
+    single transaction, refresh the rollup buckets they touch in the same
+    transaction, then publish them to the latest-value cache and the
+    event bus (in split mode, to the outbox in the same transaction).
+    """
+    if not rows:
+        return
+    params = [
+        (get_series_id(device_id, metric, create=True), ts_ms, value)
+        for device_id, ts_ms, metric, value in rows
+    ]
+    conn = get_connection()
+    with sqlite_seconds.time(site='write_samples', op='commit'), conn:
+        conn.executemany(
+            "INSERT OR REPLACE INTO samples (series_id, ts, value) VALUES (?, ?, ?)",
+            params
+        )
+        refresh_rollups(conn, params)
+        if SPLIT:
+            publish_readings(rows, conn)
+    latest.update(rows)
+    if not SPLIT:
+        publish_readings(rows)
+
+def publish_readings(rows, conn=None):
+    """Announce committed rows as events, one per (device, ts)."""
+    grouped = {}
+    for device_id, ts_ms, metric, value in rows:
+        grouped.setdefault((device_id, ts_ms), {})[metric] = value
+    for (device_id, ts_ms), values in sorted(grouped.items(), key=lambda kv: kv[0][1]):
+        publish_event('reading', {
+            "device_id": device_id,
+            "ts": ms_to_iso(ts_ms),
+            "values": values
+        }, conn)
+
+def count_samples(series_id, start_ms, end_ms):
+    """Number of samples of one series in [start_ms, end_ms)."""
+    return get_connection().execute(
+        "SELECT count(*) FROM samples WHERE series_id = ? AND ts >= ? AND ts < ?",
+        (series_id, start_ms, end_ms)
+    ).fetchone()[0]
+
+def iter_samples(series_id, start_ms, end_ms, chunk_size=5000):
+    """
+    Yield (ts_ms, value) for one series in [start_ms, end_ms), oldest
+    first, fetching from the cursor in chunks so memory stays flat.
+    """
+    cur = get_connection().execute(
+        "SELECT ts, value FROM samples WHERE series_id = ? AND ts >= ? AND ts < ? ORDER BY ts",
+        (series_id, start_ms, end_ms)
+    )
+    while True:
+        rows = cur.fetchmany(chunk_size)
+        if not rows:
+            break
+        yield from rows
+
+def count_samples_many(series_ids, start_ms, end_ms):
+    """{series_id: sample count in [start_ms, end_ms)} in one query."""
+    if not series_ids:
+        return {}
+    rows = get_connection().execute(f"""
+        SELECT series_id, count(*) FROM samples
+         WHERE series_id IN ({','.join('?' * len(series_ids))})
+           AND ts >= ? AND ts < ? AND value IS NOT NULL
+         GROUP BY series_id
+    """, (*series_ids, start_ms, end_ms)).fetchall()
+    return dict(rows)
+
+def iter_samples_many(series_ids, start_ms, end_ms, chunk_size=5000):
+    """
+    Yield (series_id, ts_ms, value) for several series in one query,
+    grouped by series and oldest first within each.
+    """
+    if not series_ids:
+        return
+    cur = get_connection().execute(f"""
+        SELECT series_id, ts, value FROM samples
+         WHERE series_id IN ({','.join('?' * len(series_ids))})
+           AND ts >= ? AND ts < ? AND value IS NOT NULL
+         ORDER BY series_id, ts
+    """, (*series_ids, start_ms, end_ms))
+    while True:
+        rows = cur.fetchmany(chunk_size)
+        if not rows:
+            break
+        yield from rows
+
+def page_samples(series, start_ms, end_ms, after=None, limit=500):
+    """
+    One page of samples for several series, oldest first, as
+    (ts_ms, metric, value) ordered by (ts, metric). `series` maps
+    metric -> series_id; `after` is the (ts_ms, metric) position of the
+    last sample already returned.
+
+    Each series is read with its own seek on the (series_id, ts) primary
+    key, LIMIT `limit`, and the streams are merged here, so a page costs
+    the same whether it is the first or the thousandth (no OFFSET, no
+    sort of the whole range).
+    """
+    conn = get_connection()
+    streams = []
+    for metric, sid in sorted(series.items()):
+        lo, op = start_ms, '>='
+        if after is not None:
+            after_ts, after_metric = after
+            # Same timestamp: metrics up to the cursor's were already sent
+            lo, op = (after_ts, '>') if metric <= after_metric else (max(after_ts, start_ms), '>=')
+        with sqlite_seconds.time(site='page_samples', op='query'):
+            rows = conn.execute(f"""
+                SELECT ts, value FROM samples
+                 WHERE series_id = ? AND ts {op} ? AND ts < ?
+                 ORDER BY ts LIMIT ?
+            """, (sid, lo, end_ms, limit)).fetchall()
+        streams.append([(ts, metric, value) for ts, value in rows])
+    return list(heapq.merge(*streams))
+
+def recent_samples(series_ids, limit=100):
+    """
+    The `limit` newest samples across several series, newest first, as
+    (series_id, ts_ms, value). One backwards index seek per series merged
+    in Python, rather than a sort of every matching row.
+    """
+    conn = get_connection()
+    with sqlite_seconds.time(site='recent_samples', op='query'):
+        streams = [
+            [(ts, sid, value) for ts, value in conn.execute(
+                "SELECT ts, value FROM samples WHERE series_id = ? ORDER BY ts DESC LIMIT ?",
+                (sid, limit)
+            )]
+            for sid in series_ids
+        ]
+    merged = heapq.merge(*streams, reverse=True)
+    return [(sid, ts, value) for ts, sid, value in islice(merged, limit)]
+
+def series_names():
+    """{series_id: (device_name, metric_name)} for every series."""
+    return {
+        sid: (device, metric)
+        for sid, device, metric in get_connection().execute("""
+            SELECT s.series_id, d.name, m.name
+              FROM series s
+              JOIN devices d ON d.id = s.device
+              JOIN metrics m ON m.id = s.metric
+        """)
+    }
+
+# — rollups —
+
+def _rollup_statements(level):
+    """
+    SQL that rebuilds rollup buckets of ROLLUP_TIERS[level] for one series
+    over a [start, end) time range, reading from the tier below (or from
+    samples for the finest tier). Returns (insert_sql, last_value_sql).
+    """
+    name, width = ROLLUP_TIERS[level]
+    if level == 0:
+        insert = f"""
+            INSERT OR REPLACE INTO rollup_{name}
+                   (series_id, bucket, count, min, max, sum, last_ts)
+            SELECT series_id, ts - ts % {width}, count(value),
+                   min(value), max(value), sum(value), max(ts)
+              FROM samples
+             WHERE series_id = ? AND ts >= ? AND ts < ?
+             GROUP BY series_id, ts - ts % {width}
+        """
+        last = f"""
+            UPDATE rollup_{name}
+               SET last = (SELECT value FROM samples x
+                            WHERE x.series_id = rollup_{name}.series_id
+                              AND x.ts = rollup_{name}.last_ts)
+             WHERE series_id = ? AND bucket >= ? AND bucket < ?
+        """
+    else:
+        below, below_width = ROLLUP_TIERS[level - 1]
+        insert = f"""
+            INSERT OR REPLACE INTO rollup_{name}
+                   (series_id, bucket, count, min, max, sum, last_ts)
+            SELECT series_id, bucket - bucket % {width}, sum(count),
+                   min(min), max(max), sum(sum), max(last_ts)
+              FROM rollup_{below}
+             WHERE series_id = ? AND bucket >= ? AND bucket < ?
+             GROUP BY series_id, bucket - bucket % {width}
+        """
+        last = f"""
+            UPDATE rollup_{name}
+               SET last = (SELECT last FROM rollup_{below} x
+                            WHERE x.series_id = rollup_{name}.series_id
+                              AND x.bucket = rollup_{name}.last_ts
+                                             - rollup_{name}.last_ts % {below_width})
+             WHERE series_id = ? AND bucket >= ? AND bucket < ?
+        """
+    return insert, last
+
+_ROLLUP_SQL = [_rollup_statements(level) for level in range(len(ROLLUP_TIERS))]
+
+def refresh_rollups(conn, samples):
+    """
+    Recompute every rollup bucket touched by (series_id, ts_ms, ...) rows.
+    Each tier is rebuilt from the one below it, so a refresh reads at most
+    a handful of rows per tier and stays correct when samples are replaced.
+    Must be called inside the caller's write transaction.
+    """
+    keys = {(sample[0], sample[1]) for sample in samples}
+    for level, (name, width) in enumerate(ROLLUP_TIERS):
+        buckets = {(sid, ts - ts % width) for sid, ts in keys}
+        ranges  = [(sid, start, start + width) for sid, start in buckets]
+        insert, last = _ROLLUP_SQL[level]
+        conn.executemany(insert, ranges)
+        conn.executemany(last, ranges)
+
+def backfill_rollups(progress=None):
+    """
+    Rebuild every rollup tier from the samples table, one series and one
+    tier per transaction so writers are never blocked for long.
+    """
+    conn   = get_connection()
+    series = [r[0] for r in conn.execute("SELECT series_id FROM series")]
+    bounds = (-2 ** 62, 2 ** 62)
+    for done, sid in enumerate(series, 1):
+        for insert, last in _ROLLUP_SQL:
+            with conn:
+                conn.execute(insert, (sid, *bounds))
+                conn.execute(last, (sid, *bounds))
+        if progress:
+            progress(done, len(series))
+    return len(series)
+
+def read_rollup(tier, series_ids, start_ms, end_ms=None):
+    """
+    Return (series_id, bucket, count, min, max, mean, last) rows of one
+    tier for the given series, oldest bucket first.
+    """
+    if tier not in dict(ROLLUP_TIERS):
+        raise ValueError(f"Unknown rollup tier: {tier}")
+    if not series_ids:
+        return []
+    end_ms = end_ms if end_ms is not None else 2 ** 62
+    with sqlite_seconds.time(site='read_rollup', op='query'):
+        return get_connection().execute(f"""
+            SELECT series_id, bucket, count, min, max, sum / count, last
+              FROM rollup_{tier}
+             WHERE series_id IN ({','.join('?' * len(series_ids))})
+               AND bucket >= ? AND bucket < ?
+               AND sum IS NOT NULL
+             ORDER BY bucket
+        """, (*series_ids, start_ms, end_ms)).fetchall()
+
+# — migration from the legacy readings table —
+
+def migrate_legacy_readings(batch_size=5000, local_devices=(), drop=False, progress=None):
+    """
+    Copy rows from the legacy `readings` table (TEXT device/metric/ISO ts)
+    into the compact `samples` schema.
+
+    Runs online: each batch is its own short transaction, so the collector
+    and web app keep writing while it runs, and progress is stored in
+    `meta` so an interrupted migration resumes where it stopped.
+    Timestamps for devices in local_devices are read as local time (the
+    collector used to write datetime.now()); all others are read as UTC.
+    Returns the number of rows copied.
+    """
+    conn = get_connection()
+    if not conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'readings'"
+    ).fetchone():
+        return 0
+
+    row = conn.execute(
+        "SELECT value FROM meta WHERE key = 'migrate_readings_rowid'"
+    ).fetchone()
+    last_rowid = int(row[0]) if row else 0
+    local_devices = set(local_devices)
+    copied = 0
+
+    while True:
+        batch = conn.execute("""
+            SELECT rowid, device_id, ts, metric, value
+              FROM readings
+             WHERE rowid > ?
+             ORDER BY rowid
+             LIMIT ?
+        """, (last_rowid, batch_size)).fetchall()
+        if not batch:
+            break
+
+        params = []
+        for rowid, device_id, ts, metric, value in batch:
+            try:
+                ts_ms = to_epoch_ms(ts, local=device_id in local_devices)
+            except ValueError:
+                log.warning("Skipping legacy reading %s: bad timestamp %r", rowid, ts)
+                continue
+            sid = get_series_id(device_id, metric, create=True)
+            params.append((sid, ts_ms, value))
+
+        last_rowid = batch[-1][0]
+        with conn:
+            conn.executemany(
+                "INSERT OR IGNORE INTO samples (series_id, ts, value) VALUES (?, ?, ?)",
+                params
+            )
+            refresh_rollups(conn, params)
+            conn.execute(
+                "INSERT OR REPLACE INTO meta(key, value) VALUES ('migrate_readings_rowid', ?)",
+                (str(last_rowid),)
+            )
+        copied += len(params)
+        if progress:
+            progress(copied)
+
+    if drop:
+        with conn:
+            conn.execute("DROP TABLE readings")
+            conn.execute("DELETE FROM meta WHERE key = 'migrate_readings_rowid'")
+    return copied
@@ -0,0 +1,238 @@
+# tuya_pool.py — Long-lived Tuya plug sessions with state-aware command suppression
+
+import threading
+import time
+
+from settings import cfg
+from metrics import registry
+
+command_seconds = registry.histogram(
+    'growlab_tuya_command_seconds', "Round-trip time of Tuya plug commands.",
+    labels=('device', 'result'))
+commands_total = registry.counter(
+    'growlab_tuya_commands_total', "Tuya plug commands by outcome (sent, skipped, failed).",
+    labels=('device', 'result'))
+
+class TuyaCommandError(Exception):
+    """Raised when a plug reports an error or cannot be reached."""
+
+class TuyaSession:
+    """
+    One persistent connection to a Tuya plug.
+
+    The socket (and the protocol 3.4/3.5 session key negotiated on it) is
+    kept open between commands and refreshed by the pool's keepalive. A
+    failed command drops the connection and is retried once on a fresh one.
+
+    The last state we successfully set is remembered, so a command that
+    matches it is skipped instead of sent. That knowledge expires after
+    state_ttl_s, after which the next command is sent again to re-assert
+    the state in case the plug was switched by hand.
+    """
+
+    def __init__(self, device_info, timeout_s=5, state_ttl_s=600):
+        self.device_id = device_info['id']
+        self.device_info = device_info
+        self.timeout_s = timeout_s
+        self.state_ttl_s = state_ttl_s
+        self.lock = threading.Lock()
+        self._device = None
+
+        self.known_state = None   # True/False once a command succeeded
+        self.known_at = 0.0
+        self.sent = 0
+        self.skipped = 0
+        self.failures = 0
+        self.reconnects = 0
+        self.last_rtt_ms = None
+        self.last_error = None
+
+    def _connect(self):
+        if self._device is None:
+            # tinytuya pulls in its crypto backend; only pay for it once a
+            # plug is actually used
+            from tinytuya import OutletDevice
+            info = self.device_info
+            device = OutletDevice(
+                dev_id=info.get('dev_id'),
+                address=info.get('ip'),
+                local_key=info.get('local_key'),
+                version=info.get('version', 3.5),
+                connection_timeout=self.timeout_s,
+                persist=True
+            )
+            device.set_socketPersistent(True)
+            device.set_socketTimeout(self.timeout_s)
+            self._device = device
+        return self._device
+
+    def _disconnect(self):
+        if self._device is not None:
+            try:
+                self._device.close()
+            except Exception:
+                pass
+            self._device = None
+        # We can no longer vouch for the plug's state
+        self.known_state = None
+
+    def _call(self, method, *args):
+        """Run a tinytuya call, raising on the error dicts it returns."""
+        result = getattr(self._connect(), method)(*args)
+        if isinstance(result, dict) and result.get('Error'):
+            raise TuyaCommandError(result.get('Error'))
+        return result
+
+    def state_is_known(self, on):
+        return (self.known_state is on and
+                time.monotonic() - self.known_at < self.state_ttl_s)
+
+    def set_state(self, on: bool, force=False):
+        """
+        Switch the plug. Returns "sent" or "skipped"; raises
+        TuyaCommandError if the plug could not be switched.
+        """
+        with self.lock:
+            if not force and self.state_is_known(on):
+                self.skipped += 1
+                commands_total.inc(device=self.device_id, result="skipped")
+                return "skipped"
+
+            method = 'turn_on' if on else 'turn_off'
+            start = time.perf_counter()
+            try:
+                try:
+                    self._call(method)
+                except Exception:
+                    # Stale socket or session key: reconnect and retry once
+                    self._disconnect()
+                    self.reconnects += 1
+                    self._call(method)
+            except Exception as e:
+                self._disconnect()
+                self.failures += 1
+                self.last_error = str(e)
+                command_seconds.observe(time.perf_counter() - start,
+                                        device=self.device_id, result="failed")
+                commands_total.inc(device=self.device_id, result="failed")
+                raise TuyaCommandError(str(e)) from e
+
+            elapsed = time.perf_counter() - start
+            command_seconds.observe(elapsed, device=self.device_id, result="sent")
+            commands_total.inc(device=self.device_id, result="sent")
+            self.last_rtt_ms = elapsed * 1000
+            self.sent += 1
+            self.known_state = on
+            self.known_at = time.monotonic()
+            return "sent"
+
+    def get_state(self):
+        """
+        Ask the plug whether it is switched on (data point `switch_dps`,
+        1 by default). Returns True/False and refreshes known_state;
+        raises TuyaCommandError if the plug does not answer, or if a
+        command holds the session for longer than timeout_s.
+        """
+        if not self.lock.acquire(timeout=self.timeout_s):
+            raise TuyaCommandError("session busy with a command")
+        try:
+            try:
+                try:
+                    status = self._call('status')
+                except Exception:
+                    # Stale socket or session key: reconnect and retry once
+                    self._disconnect()
+                    self.reconnects += 1
+                    status = self._call('status')
+                key = str(self.device_info.get('switch_dps', 1))
+                dps = (status or {}).get('dps') or {}
+                if key not in dps:
+                    raise TuyaCommandError(f"status has no data point {key}: {status!r}")
+            except Exception as e:
+                self._disconnect()
+                self.last_error = str(e)
+                raise TuyaCommandError(str(e)) from e
+            self.known_state = bool(dps[key])
+            self.known_at = time.monotonic()
+            return self.known_state
+        finally:
+            self.lock.release()
+
+    def keepalive(self):
+        """Heartbeat an open connection; drop it if the plug doesn't answer."""
+        with self.lock:
+            if self._device is None:
+                return
+            try:
+                self._call('heartbeat', False)
+            except Exception as e:
+                self.last_error = str(e)
+                self._disconnect()
+
+    def stats(self):
+        return {
+            "connected": self._device is not None,
+            "known_state": None if self.known_state is None else ("on" if self.known_state else "off"),
+            "sent": self.sent,
+            "skipped": self.skipped,
+            "failures": self.failures,
+            "reconnects": self.reconnects,
+            "last_rtt_ms": self.last_rtt_ms,
+            "last_error": self.last_error
+        }
+
+class TuyaPool:
+    """
+    Process-wide registry of TuyaSession objects, one per plug, plus a
+    background thread that keeps their connections alive.
+    """
+
+    def __init__(self, keepalive_s=20, timeout_s=5, state_ttl_s=600):
+        self.keepalive_s = keepalive_s
+        self.timeout_s = timeout_s
+        self.state_ttl_s = state_ttl_s
+        self._sessions = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def session(self, device_info):
+        """
+        Return the session for a device, creating it on first use. A
+        device whose settings changed (config reload) gets a new session.
+        """
+        device_id = device_info['id']
+        session = self._sessions.get(device_id)
+        if session is None or session.device_info != device_info:
+            with self._lock:
+                session = self._sessions.get(device_id)
+                if session is not None and session.device_info != device_info:
+                    with session.lock:
+                        session._disconnect()
+                    session = None
+                if session is None:
+                    session = self._sessions[device_id] = TuyaSession(
+                        device_info, self.timeout_s, self.state_ttl_s
+                    )
+            self._start_keepalive()
+        return session
+
+    def stats(self):
+        return {device_id: s.stats() for device_id, s in self._sessions.items()}
+
+    def _start_keepalive(self):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(
+                        target=self._keepalive_loop, name="tuya-keepalive", daemon=True
+                    )
+                    self._thread.start()
+
+    def _keepalive_loop(self):
+        while True:
+            time.sleep(self.keepalive_s)
+            for session in list(self._sessions.values()):
+                session.keepalive()
+
+# Shared instance for the whole process
+pool = TuyaPool(**cfg.get('tuya', {}))
@@ -29,6 +29,14 @@ class BaseWidget:
         """
         pass
 
+    @property
+    def widget_id(self):
+        """
+        Identifier used in API payloads: the device id for device-scoped
+        widgets, otherwise the class name without "Widget" (e.g. "clock").
+        """
+        return self.device_info.get('id') or type(self).__name__.replace('Widget', '').lower()
+
     def get_data(self):
         """
         Override in subclasses to fetch data (current or historical).
@@ -36,6 +44,15 @@ class BaseWidget:
         """
         return {}
 
+    @classmethod
+    def get_batch_data(cls, widgets, **options):
+        """
+        Fetch get_data() for several widgets of this class at once and
+        return {widget_id: data}. Override to batch the underlying queries;
+        the default simply calls get_data() on each widget.
+        """
+        return {w.widget_id: w.get_data() for w in widgets}
+
     def render(self):
         """
         Override in subclasses to render and return the widget's HTML.
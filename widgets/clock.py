@@ -11,9 +11,15 @@ class ClockWidget(BaseWidget):
         # API endpoint to fetch the current server time
         @self.app.route("/api/clock")
         def api_clock():
-            ts = time.time()
-            dt = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(ts))
-            return jsonify({"ts": ts, "datetime": dt})
+            return jsonify(self.get_data())
+
+    def get_data(self):
+        """
+        Current server time as a unix timestamp and a formatted string.
+        """
+        ts = time.time()
+        dt = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(ts))
+        return {"ts": ts, "datetime": dt}
 
     def render(self):
         """
@@ -1,22 +1,29 @@
 from .base_widget import BaseWidget
+import logging
 import sqlite3
-import threading
-import time
-from flask import jsonify, request, current_app as app
+from flask import jsonify, request
+
+from storage import SPLIT, get_connection, publish_event
+from latest import latest
+from control_engine import engine
+from render_cache import render_cache
+
+log = logging.getLogger(__name__)
 
 class ControlWidget(BaseWidget):
     """
     Widget for automated control of a device based on sensor readings.
     Allows setting target values and control logic for sensor-driven automation.
     """
-    def __init__(self, app, config, device_info=None):
-        super().__init__(app, config, device_info)
-        # Start the control loop in a background thread
-        self.running = True
-        self.thread = threading.Thread(target=self.control_loop)
-        self.thread.daemon = True  # Thread will exit when main program exits
-        self.thread.start()
-        
+    def engine_rule(self):
+        """
+        (config, actuate) for the shared control engine, which evaluates
+        the rule whenever its sensor metric gets a new reading. The app
+        hands the rules of a whole widget set to engine.replace_all() once
+        the set is built.
+        """
+        return self.get_config(), self.control_device
+
     def register_routes(self):
         # Use get() with a default value to avoid KeyError if 'id' isn't present
         control_id = self.device_info.get('id', 'control')
@@ -58,23 +65,9 @@ class ControlWidget(BaseWidget):
 
     def get_config(self):
         """Get the current control configuration from database"""
-        db_path = app.config.get("DATABASE", "data.db")
-        conn = sqlite3.connect(db_path)
-        conn.row_factory = sqlite3.Row
+        conn = get_connection()
         cursor = conn.cursor()
-        
-        # Create table if it doesn't exist
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS control_configs(
-                control_id TEXT PRIMARY KEY,
-                sensor_id TEXT,
-                device_id TEXT,
-                metric TEXT,
-                operator TEXT,
-                target_value REAL,
-                enabled INTEGER
-            )
-        """)
+        cursor.row_factory = sqlite3.Row
         
         # Use get() to avoid KeyError
         control_id = self.device_info.get('id', 'control')
@@ -97,17 +90,17 @@ class ControlWidget(BaseWidget):
             enabled = self.device_info.get("enabled", 0)
             
             # Insert default config
-            cursor.execute("""
-                INSERT INTO control_configs(
+            with conn:
+                cursor.execute("""
+                    INSERT OR IGNORE INTO control_configs(
+                        control_id, sensor_id, device_id, metric, 
+                        operator, target_value, enabled
+                    )
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                """, (
                     control_id, sensor_id, device_id, metric, 
                     operator, target_value, enabled
-                )
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-            """, (
-                control_id, sensor_id, device_id, metric, 
-                operator, target_value, enabled
-            ))
-            conn.commit()
+                ))
             
             # Get the newly inserted config
             cursor.execute("""
@@ -116,43 +109,66 @@ class ControlWidget(BaseWidget):
             row = cursor.fetchone()
         
         result = dict(row) if row else {}
-        conn.close()
         
         return result
 
+    @classmethod
+    def get_batch_data(cls, widgets, **options):
+        """
+        Control configs for many widgets with one SELECT; any control that
+        has no row yet falls back to get_config(), which creates it.
+        """
+        ids = [w.device_info.get('id', 'control') for w in widgets]
+        cursor = get_connection().cursor()
+        cursor.row_factory = sqlite3.Row
+        cursor.execute(f"""
+            SELECT * FROM control_configs
+            WHERE control_id IN ({','.join('?' * len(ids))})
+        """, ids)
+        rows = {row["control_id"]: dict(row) for row in cursor.fetchall()}
+        return {
+            w.widget_id: rows.get(w.device_info.get('id', 'control')) or w.get_config()
+            for w in widgets
+        }
+
     def update_config(self, config):
         """Update the control configuration in the database"""
-        db_path = app.config.get("DATABASE", "data.db")
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
+        conn = get_connection()
         
         # Update all fields
-        cursor.execute("""
-            UPDATE control_configs
-            SET sensor_id = ?,
-                device_id = ?,
-                metric = ?,
-                operator = ?,
-                target_value = ?,
-                enabled = ?
-            WHERE control_id = ?
-        """, (
-            config.get("sensor_id", ""),
-            config.get("device_id", ""),
-            config.get("metric", ""),
-            config.get("operator", ">"),
-            config.get("target_value", 0.0),
-            1 if config.get("enabled", False) else 0,
-            self.device_info["id"]
-        ))
-        
-        conn.commit()
-        conn.close()
+        with conn:
+            conn.execute("""
+                UPDATE control_configs
+                SET sensor_id = ?,
+                    device_id = ?,
+                    metric = ?,
+                    operator = ?,
+                    target_value = ?,
+                    enabled = ?
+                WHERE control_id = ?
+            """, (
+                config.get("sensor_id", ""),
+                config.get("device_id", ""),
+                config.get("metric", ""),
+                config.get("operator", ">"),
+                config.get("target_value", 0.0),
+                1 if config.get("enabled", False) else 0,
+                self.device_info["id"]
+            ))
+
+        # The rendered widget shows the config, so cached HTML is now stale
+        render_cache.invalidate()
+        if SPLIT:
+            # The collector's engine (and every web worker's cache) picks
+            # it up from the outbox
+            publish_event('control_config', self.get_config())
+        else:
+            engine.update(self.widget_id, self.get_config())
 
     def control_device(self, device_id, on):
         """Control a device using the DeviceWidget instance"""
         # Find the DeviceWidget instance for this device
-        for widget in app.config.get("_widgets", []):
+        for widget in self.app.config.get("_widgets", []):
             if (hasattr(widget, 'device_info') and 
                 widget.device_info.get('id') == device_id):
                 if hasattr(widget, 'set_device_state'):
@@ -164,77 +180,14 @@ class ControlWidget(BaseWidget):
             set_device(device_id, on)
             return True
         except Exception as e:
-            print(f"Error controlling device {device_id}: {e}")
+            log.error("Error controlling device %s: %s", device_id, e)
             return False
 
     def get_latest_reading(self, sensor_id, metric):
         """Get the most recent reading for a sensor metric"""
-        db_path = app.config.get("DATABASE", "data.db")
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute("""
-            SELECT value
-            FROM readings
-            WHERE device_id = ? AND metric = ?
-            ORDER BY ts DESC
-            LIMIT 1
-        """, (sensor_id, metric))
-        
-        row = cursor.fetchone()
-        conn.close()
-        
-        return float(row[0]) if row else None
+        entry = latest.get(sensor_id, metric)
+        return float(entry[1]) if entry else None
 
-    def control_loop(self):
-        """Background thread that checks conditions and controls devices"""
-        while self.running:
-            try:
-                config = self.get_config()
-                
-                # Skip if not enabled or missing required config
-                if not config or not config.get("enabled"):
-                    time.sleep(10)
-                    continue
-                
-                sensor_id = config.get("sensor_id")
-                device_id = config.get("device_id")
-                metric = config.get("metric")
-                operator = config.get("operator")
-                target_value = float(config.get("target_value", 0))
-                
-                if not sensor_id or not device_id or not metric:
-                    time.sleep(10)
-                    continue
-                
-                # Get latest reading
-                current_value = self.get_latest_reading(sensor_id, metric)
-                if current_value is None:
-                    time.sleep(10)
-                    continue
-                
-                # Evaluate condition
-                should_turn_on = False
-                if operator == ">":
-                    should_turn_on = current_value > target_value
-                elif operator == ">=":
-                    should_turn_on = current_value >= target_value
-                elif operator == "<":
-                    should_turn_on = current_value < target_value
-                elif operator == "<=":
-                    should_turn_on = current_value <= target_value
-                elif operator == "=":
-                    should_turn_on = abs(current_value - target_value) < 0.01
-                
-                # Control the device based on condition
-                self.control_device(device_id, should_turn_on)
-                
-            except Exception as e:
-                print(f"Error in control loop: {e}")
-            
-            # Check every minute
-            time.sleep(60)
-    
     def render(self):
         """Render the control widget template"""
         template = self.app.jinja_env.get_template('widgets/control.html')
@@ -243,7 +196,7 @@ class ControlWidget(BaseWidget):
         sensors = []
         devices = []
         
-        for widget in app.config.get("_widgets", []):
+        for widget in self.app.config.get("_widgets", []):
             if hasattr(widget, 'device_info'):
                 device_type = widget.device_info.get('type')
                 if device_type == 'sensor':
@@ -1,8 +1,18 @@
 from .base_widget import BaseWidget
-import sqlite3
-from flask import jsonify, request, current_app as app
-from tinytuya import OutletDevice
-from datetime import datetime
+import logging
+from flask import jsonify, request
+
+from storage import (SPLIT, DAY_MS, log_device_state, device_intervals, device_daily,
+                     device_stats, current_device_state, now_ms, ms_to_iso)
+from tuya_pool import pool
+from plug_poller import poller
+from .sensor import RANGES
+import outbox
+
+log = logging.getLogger(__name__)
+
+# Most state changes returned as history for one range (the newest ones)
+MAX_HISTORY = 2000
 
 class DeviceWidget(BaseWidget):
     """
@@ -14,7 +24,10 @@ class DeviceWidget(BaseWidget):
 
         # STATUS endpoint
         def _status():
-            return jsonify(self.get_data())
+            range_key = request.args.get("range", "24h")
+            if range_key not in RANGES:
+                return jsonify({"error": f"range must be one of {', '.join(RANGES)}"}), 400
+            return jsonify(self.get_data(range_key))
         self.app.add_url_rule(
             f"/api/{device_id}/status",       
             endpoint=f"{device_id}_status",   
@@ -25,8 +38,9 @@ class DeviceWidget(BaseWidget):
         def _control():
             payload = request.get_json()
             action = payload.get("action")
-            # Call control method directly from the widget
-            success = self.set_device_state(action == "on")
+            # Call control method directly from the widget; a manual command
+            # is always sent, even if we believe the plug is already there
+            success = self.set_device_state(action == "on", force=True)
             return jsonify({"result": "ok" if success else "error", "action": action})
             
         self.app.add_url_rule(
@@ -36,35 +50,32 @@ class DeviceWidget(BaseWidget):
             methods=["POST"]
         )
 
-    def set_device_state(self, on: bool):
-        """Control the device based on its type (tuya, etc)"""
+    def set_device_state(self, on: bool, force=False):
+        """
+        Control the device based on its type (tuya, etc). Tuya commands go
+        through a pooled persistent session and are skipped when the plug
+        is already known to be in the requested state, unless forced.
+        In split mode only the collector daemon talks to the plugs; other
+        processes hand it the command and wait for the result.
+        """
         device_id = self.device_info['id']
         device_type = self.device_info.get('device_type', 'generic')
-        
+
+        if SPLIT and not outbox.owner:
+            return outbox.send_command(device_id, on, force=force)
+        if not outbox.may_drive():
+            log.error("Not switching %s: this collector's lease has lapsed", device_id)
+            return False
+
         if device_type == 'tuya':
             try:
-                dev_id = self.device_info.get('dev_id')
-                ip = self.device_info.get('ip')
-                local_key = self.device_info.get('local_key')
-                version = self.device_info.get('version', 3.5)
-                
-                device = OutletDevice(
-                    dev_id=dev_id,
-                    address=ip,
-                    local_key=local_key,
-                    version=version
-                )
-                
-                if on:
-                    device.turn_on()
-                else:
-                    device.turn_off()
-                
-                # Log the device change to database
-                self._log_device_state(device_id, 'on' if on else 'off')
+                result = pool.session(self.device_info).set_state(on, force=force)
+                if result == "sent":
+                    # Log the device change to database
+                    self._log_device_state(device_id, 'on' if on else 'off')
                 return True
             except Exception as e:
-                print(f"Error controlling Tuya device: {e}")
+                log.error("Error controlling Tuya device %s: %s", device_id, e)
                 return False
         else:
             # For generic devices, use the controller module
@@ -73,62 +84,53 @@ class DeviceWidget(BaseWidget):
                 set_device(device_id, on)
                 return True
             except Exception as e:
-                print(f"Error controlling device: {e}")
+                log.error("Error controlling device %s: %s", device_id, e)
                 return False
     
     def _log_device_state(self, device_id: str, state: str):
         """Log device state changes to database"""
-        db_path = app.config.get("DATABASE", "data.db")
-        conn = sqlite3.connect(db_path)
-        conn.execute("""
-            CREATE TABLE IF NOT EXISTS device_logs(
-                ts         TEXT,
-                device_id  TEXT,
-                state      TEXT
-            )
-        """)
-        
-        ts = datetime.utcnow().isoformat()
-        conn.execute(
-            "INSERT INTO device_logs(ts, device_id, state) VALUES (?, ?, ?)",
-            (ts, device_id, state)
-        )
-        conn.commit()
-        conn.close()
+        log_device_state(device_id, state)
 
-    def get_data(self):
+    def get_data(self, range_key="24h"):
         """
-        Query the SQLite database for:
-        - current: most recent on/off state
-        - history: state changes in the last 24 hours
+        The device's on/off record over one of RANGES:
+        - current: state now and since when
+        - history: the state at the start of the range and every change in it
+        - stats: on-time, duty cycle, switch count and longest on run in the range
+        - daily: per-day duty cycle (UTC days) for the days the range touches
+        - actual: the state the plug itself last reported to the background
+          poller, with its age (None until polled; Tuya plugs only)
         """
-        db_path = app.config.get("DATABASE", "data.db")
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
-
-        # Fetch latest state
-        cursor.execute("""
-            SELECT ts, state
-            FROM device_logs
-            WHERE device_id = ?
-            ORDER BY ts DESC
-            LIMIT 1
-        """, (self.device_info["id"],))
-        row = cursor.fetchone()
-        current = {"ts": row[0], "state": row[1]} if row else {}
+        return type(self).get_batch_data([self], range_key=range_key)[self.widget_id]
 
-        # Fetch historical states from last 24 hours
-        cursor.execute("""
-            SELECT ts, state
-            FROM device_logs
-            WHERE device_id = ?
-              AND ts >= datetime('now', '-24 hours')
-            ORDER BY ts
-        """, (self.device_info["id"],))
-        history = [{"ts": r[0], "state": r[1]} for r in cursor.fetchall()]
-
-        conn.close()
-        return {"current": current, "history": history}
+    @classmethod
+    def get_batch_data(cls, widgets, range_key="24h", **options):
+        """
+        get_data() for many device widgets, from the incrementally
+        maintained device_intervals and device_daily tables: index seeks
+        on (device_id, start) and (device_id, day), never a scan of
+        device_logs.
+        """
+        ids = [w.device_info["id"] for w in widgets]
+        end = now_ms()
+        start = end - RANGES.get(range_key, RANGES["24h"])
+        current = current_device_state(ids)
+        return {
+            device_id: {
+                "current": ({"ts": ms_to_iso(current[device_id][0]), "state": current[device_id][1]}
+                            if device_id in current else {}),
+                "history": [{"ts": ms_to_iso(max(since, start)), "state": state}
+                            for since, _, state in device_intervals(device_id, start, end, MAX_HISTORY)],
+                "stats": device_stats(device_id, start, end),
+                "daily": [{"day": day, "on_ms": on_ms, "switches": switches,
+                           "longest_on_ms": longest, "on_pct": round(100 * on_ms / DAY_MS, 1)}
+                          for day, (on_ms, switches, longest) in device_daily(
+                              device_id, ms_to_iso(start)[:10], ms_to_iso(end)[:10], end).items()],
+                "actual": poller.get(device_id),
+                "range": range_key
+            }
+            for device_id in ids
+        }
 
     def render(self):
         """
@@ -1,7 +1,41 @@
 from .base_widget import BaseWidget
-import sqlite3
 import logging
-from flask import jsonify, current_app as app
+import sqlite3
+from itertools import groupby
+from operator import itemgetter
+from flask import jsonify, request
+
+from storage import (device_series, read_rollup, count_samples_many,
+                     iter_samples_many, now_ms, ms_to_iso, ROLLUP_TIERS)
+from latest import latest
+from downsample import lttb
+from profiling import phase
+
+log = logging.getLogger(__name__)
+
+HOUR_MS = 60 * 60 * 1000
+
+# Chart ranges accepted by ?range=
+RANGES = {
+    "1h":  HOUR_MS,
+    "6h":  6 * HOUR_MS,
+    "24h": 24 * HOUR_MS,
+    "7d":  7 * 24 * HOUR_MS,
+    "30d": 30 * 24 * HOUR_MS,
+}
+
+# Upper bound on buckets per metric; picks the rollup tier for a range
+MAX_CHART_POINTS = 800
+
+# Largest point budget a client may ask for with ?points=
+MAX_POINTS_PARAM = 5000
+
+def pick_tier(span_ms):
+    """Finest rollup tier that covers span_ms in at most MAX_CHART_POINTS buckets."""
+    for name, width in ROLLUP_TIERS:
+        if span_ms // width <= MAX_CHART_POINTS:
+            return name, width
+    return ROLLUP_TIERS[-1]
 
 class SensorWidget(BaseWidget):
     """
@@ -14,7 +48,13 @@ class SensorWidget(BaseWidget):
         endpoint = f"{device_id}_sensor_data"
 
         def _sensor_data():
-            return jsonify(self.get_data())
+            range_key = request.args.get("range", "24h")
+            if range_key not in RANGES:
+                return jsonify({"error": f"range must be one of {', '.join(RANGES)}"}), 400
+            points = request.args.get("points", type=int)
+            if points is not None and not 3 <= points <= MAX_POINTS_PARAM:
+                return jsonify({"error": f"points must be between 3 and {MAX_POINTS_PARAM}"}), 400
+            return jsonify(self.get_data(range_key, points))
 
         self.app.add_url_rule(
             f"/api/{device_id}/sensor_data",
@@ -22,97 +62,134 @@ class SensorWidget(BaseWidget):
             view_func=_sensor_data
         )
 
-    def get_data(self):
+    def get_data(self, range_key="24h", points=None):
         """
         Returns JSON with:
           - metrics: list of {name, label} from config
           - current: { ts, <metric>: value, ... }
-          - history: list of { ts, <metric>: value, ... } for last 24h
+          - history: list of { ts, <metric>: value, ... } over the range
+          - series: { <metric>: [[ts, value], ...] } per-metric chart points
+          - range / tier: the requested range and the data source used
+
+        Without `points` the history is one record per rollup bucket (mean
+        values). With `points` the raw samples of the whole window are
+        reduced to at most that many points per metric with LTTB.
         """
-        db_path = app.config.get("DATABASE", "data.db")
-        device_id = self.device_info["id"]
-        metrics_cfg = self.device_info.get("metrics", [])
+        batch = type(self).get_batch_data([self], range_key=range_key, points=points)
+        return batch[self.widget_id]
 
-        # Extract metric keys from config
-        metric_keys = [m["name"] for m in metrics_cfg]
-        print(f"Looking for metrics: {metric_keys} for device: {device_id}")
+    @classmethod
+    def get_batch_data(cls, widgets, range_key="24h", points=None, **options):
+        """
+        get_data() for many sensor widgets with one query for all of their
+        series (plus one COUNT query when reducing raw samples).
+        """
+        # Resolve every configured metric to its series id
+        owners = {}
+        for w in widgets:
+            metric_keys = [m["name"] for m in w.device_info.get("metrics", [])]
+            log.debug("Looking for metrics: %s for device: %s", metric_keys, w.widget_id)
+            for metric, sid in device_series(w.widget_id).items():
+                if metric in metric_keys:
+                    owners[sid] = (w, metric)
+
+        span = RANGES[range_key]
+        end = now_ms()
+        per_metric = {
+            w.widget_id: {m["name"]: [] for m in w.device_info.get("metrics", [])}
+            for w in widgets
+        }
 
-        # Connect and enable row factory for easier column access
-        conn = sqlite3.connect(db_path)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        
-        rows = []
         try:
-            # Query raw readings for this device, but LIMIT to a reasonable number
-            # to avoid overwhelming the charts - just get last 24 hours
-            cursor.execute(
-                "SELECT ts, metric, value FROM readings "
-                "WHERE device_id=? AND ts >= datetime('now', '-24 hours') "
-                "ORDER BY ts DESC "
-                "LIMIT 100", # Reasonable limit to prevent too many data points
-                (device_id,)
-            )
-            rows = list(cursor.fetchall())
-            print(f"Found {len(rows)} readings for {device_id}")
-            
-            # If no rows, check if the device exists in the database
-            if not rows:
-                cursor.execute("SELECT DISTINCT device_id FROM readings")
-                devices = [r[0] for r in cursor.fetchall()]
-                print(f"No readings for {device_id}. Available devices: {devices}")
-        except Exception as e:
-            print(f"Database error: {e}")
-        finally:
-            conn.close()
+            # Row handling and reduction count as pivot time, the reads as SQL
+            with phase('pivot'):
+                if points:
+                    # Stream the full raw window of every series through the reducer
+                    tier = "raw"
+                    start = end - span
+                    counts = count_samples_many(list(owners), start, end + 1)
+                    rows = iter_samples_many(list(owners), start, end + 1)
+                    for sid, group in groupby(rows, key=itemgetter(0)):
+                        w, metric = owners[sid]
+                        samples = ((ts, value) for _, ts, value in group)
+                        # A series may have gained rows since the count;
+                        # a failing series is left empty, not the whole batch
+                        try:
+                            per_metric[w.widget_id][metric] = list(
+                                lttb(samples, counts.get(sid, 0), points))
+                        except (ValueError, TypeError, ZeroDivisionError) as e:
+                            log.error("Error reducing %s/%s: %s", w.widget_id, metric, e)
+                else:
+                    # Read the coarsest tier that still gives a useful number
+                    # of points, so the cost is the same for an hour or a month
+                    tier, width = pick_tier(span)
+                    start = end - span
+                    start -= start % width
+                    for sid, bucket, count, vmin, vmax, mean, last in read_rollup(tier, list(owners), start):
+                        if mean is None:
+                            continue
+                        w, metric = owners[sid]
+                        per_metric[w.widget_id][metric].append((bucket, mean))
+            log.debug("Read %s points for %d series", tier, len(owners))
+        except sqlite3.Error as e:
+            tier = None
+            log.error("Database error: %s", e)
+
+        with phase('pivot'):
+            return {
+                w.widget_id: w._build_payload(per_metric[w.widget_id], range_key, tier)
+                for w in widgets
+            }
+
+    def _build_payload(self, per_metric, range_key, tier):
+        """Assemble the sensor_data response from {metric: [(ts_ms, value)]}."""
+        device_id = self.device_info["id"]
+        metrics_cfg = self.device_info.get("metrics", [])
+        metric_keys = [m["name"] for m in metrics_cfg]
 
         # Pivot into per-timestamp records
         data_map = {}
-        for row in rows:
-            ts = row['ts']
-            metric = row['metric']
-            value = row['value']
-            
-            if metric not in metric_keys:
-                continue
-                
-            rec = data_map.setdefault(ts, {"ts": ts})
-            rec[metric] = float(value)  # Ensure numeric format
+        for metric, pts in per_metric.items():
+            for ts, value in pts:
+                if value is None:
+                    continue
+                rec = data_map.setdefault(ts, {"ts": ms_to_iso(ts)})
+                rec[metric] = float(value)
 
         # Build sorted history and current data
         # For chart display, we need chronological ordering (oldest to newest)
         history = [data_map[ts] for ts in sorted(data_map.keys())]
         
+        # Current values come from the latest-value cache, not SQL
+        cached = {m: latest.get(device_id, m) for m in metric_keys}
+        cached = {m: entry for m, entry in cached.items() if entry}
+
         # Handle empty data case
-        if not history:
-            print(f"No data found for device {device_id}")
+        if not cached:
+            log.debug("No data found for device %s", device_id)
             # Create an empty current record with placeholders for all configured metrics
             current = {"ts": "No data", "data_available": False}
             # Add null placeholder for each metric
             for metric in metric_keys:
                 current[metric] = None
         else:
-            current = history[0] if history else {}
-            current["data_available"] = True
-        
-        # Limit history to reasonable number of points for charting
-        if len(history) > 30:
-            # Sample down to 30 points for charts - take every Nth point
-            step = len(history) // 30
-            history = history[::step]
-            print(f"Reduced history to {len(history)} points")
-        
-        # Ensure numeric values for JavaScript
-        for record in history:
+            newest = max(ts for ts, _ in cached.values())
+            current = {"ts": ms_to_iso(newest), "data_available": True}
             for metric in metric_keys:
-                if metric in record:
-                    record[metric] = float(record[metric])
-                    
+                entry = cached.get(metric)
+                current[metric] = float(entry[1]) if entry and entry[1] is not None else None
+        
         return {
             "metrics": metrics_cfg,
             "current": current,
             "history": history,
-            "has_data": len(history) > 0
+            "series": {
+                metric: [[ms_to_iso(ts), float(value)] for ts, value in pts if value is not None]
+                for metric, pts in per_metric.items()
+            },
+            "has_data": len(history) > 0,
+            "range": range_key,
+            "tier": tier
         }
 
     def render(self):
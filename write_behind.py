@@ -0,0 +1,240 @@
+# write_behind.py — Optional queued, group-committed writes of sensor samples
+
+import json
+import logging
+import threading
+import time
+
+from storage import cfg, write_samples
+from metrics import registry
+
+log = logging.getLogger(__name__)
+
+flush_seconds = registry.histogram(
+    'growlab_write_behind_flush_seconds', "Duration of one write-behind group commit.")
+rejected_total = registry.counter(
+    'growlab_write_behind_rejected_total', "Samples rejected because the queue was full.")
+dead_letter_total = registry.counter(
+    'growlab_write_behind_dead_letter_total',
+    "Queued samples that could not be committed and went to the dead-letter file.")
+
+class QueueFull(Exception):
+    """Raised when the write-behind queue has no room for a submission."""
+
+    def __init__(self, retry_after_s):
+        super().__init__("write queue full")
+        self.retry_after_s = retry_after_s
+
+class BatchTooLarge(Exception):
+    """Raised when one submission has more rows than the queue can ever hold."""
+
+    def __init__(self, rows, max_rows):
+        super().__init__(f"batch of {rows} rows exceeds queue size {max_rows}")
+        self.max_rows = max_rows
+
+class WriteBehind:
+    """
+    Decouples callers from SQLite commits. When enabled, submit() appends
+    rows to a bounded in-memory queue and returns at once; one writer
+    thread commits them with write_samples() in a single transaction
+    whenever flush_rows are waiting or the oldest row is flush_interval_ms
+    old, whichever comes first. A full queue rejects the submission with
+    QueueFull (backpressure) instead of growing without bound; a single
+    submission larger than max_rows raises BatchTooLarge.
+
+    A group commit that still fails after max_attempts is retried one
+    row at a time, so one bad row cannot take the others down with it;
+    rows that fail even alone are appended to the dead_letter NDJSON file
+    (they were already acknowledged to their senders).
+
+    When disabled, submit() simply calls write_samples() inline.
+    """
+
+    def __init__(self, enabled=False, max_rows=50000, flush_rows=2000,
+                 flush_interval_ms=200, retry_after_s=1, max_attempts=3,
+                 dead_letter='write_behind_dead_letter.ndjson'):
+        self.enabled = enabled
+        self.max_rows = max_rows
+        self.flush_rows = flush_rows
+        self.flush_interval_ms = flush_interval_ms
+        self.retry_after_s = retry_after_s
+        self.max_attempts = max_attempts
+        self.dead_letter = dead_letter
+
+        self._rows = []
+        self._oldest = None       # monotonic time the oldest queued row arrived
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        self._running = False
+
+        self.enqueued = 0
+        self.rejected = 0
+        self.flushed = 0
+        self.flushes = 0
+        self.failed = 0
+        self.max_depth = 0
+        self.last_flush_ms = None
+        self.max_flush_ms = 0.0
+        self._flush_total_ms = 0.0
+
+    def submit(self, rows, block=False, timeout=None):
+        """
+        Store (device_id, ts_ms, metric, value) rows. Returns True once they
+        are queued (or written, when disabled). Raises QueueFull if there is
+        no room; with block=True waits up to `timeout` seconds for room first.
+        Raises BatchTooLarge if `rows` alone exceeds max_rows.
+        """
+        if not rows:
+            return True
+        if not self.enabled:
+            write_samples(rows)
+            return True
+        if len(rows) > self.max_rows:
+            raise BatchTooLarge(len(rows), self.max_rows)
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while len(self._rows) + len(rows) > self.max_rows:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if not block or (remaining is not None and remaining <= 0):
+                    self.rejected += len(rows)
+                    rejected_total.inc(len(rows))
+                    raise QueueFull(self.retry_after_s)
+                self._cond.wait(remaining)
+            if not self._rows:
+                self._oldest = time.monotonic()
+            self._rows.extend(rows)
+            self.enqueued += len(rows)
+            self.max_depth = max(self.max_depth, len(self._rows))
+            if len(self._rows) >= self.flush_rows:
+                self._cond.notify_all()
+        self.start()
+        return True
+
+    def flush(self):
+        """Commit everything queued right now, in one transaction."""
+        with self._flush_lock:
+            with self._cond:
+                rows, self._rows, self._oldest = self._rows, [], None
+                self._cond.notify_all()   # room for blocked submitters
+            if not rows:
+                return 0
+            start = time.perf_counter()
+            for attempt in range(1, self.max_attempts + 1):
+                try:
+                    write_samples(rows)
+                    break
+                except Exception as e:
+                    log.error("Error flushing %d queued samples (attempt %d): %s",
+                              len(rows), attempt, e)
+                    if attempt == self.max_attempts:
+                        return self._salvage(rows)
+                    time.sleep(0.1 * attempt)
+            elapsed = (time.perf_counter() - start) * 1000
+            flush_seconds.observe(elapsed / 1000)
+            self.flushes += 1
+            self.flushed += len(rows)
+            self.last_flush_ms = elapsed
+            self.max_flush_ms = max(self.max_flush_ms, elapsed)
+            self._flush_total_ms += elapsed
+            return len(rows)
+
+    def _salvage(self, rows):
+        """
+        Commit a batch that failed as a whole one row at a time; the rows
+        that fail alone go to the dead-letter file. Returns how many were
+        committed.
+        """
+        dead = []
+        for row in rows:
+            try:
+                write_samples([row])
+            except Exception as e:
+                dead.append((row, str(e)))
+        self.flushed += len(rows) - len(dead)
+        if dead:
+            self.failed += len(dead)
+            dead_letter_total.inc(len(dead))
+            log.error("Dropped %d of %d queued samples that could not be committed "
+                      "(first: %r: %s); written to %s",
+                      len(dead), len(rows), dead[0][0], dead[0][1], self.dead_letter)
+            try:
+                with open(self.dead_letter, 'a') as f:
+                    for (device_id, ts_ms, metric, value), error in dead:
+                        f.write(json.dumps({"device_id": device_id, "ts_ms": ts_ms, "metric": metric,
+                                            "value": value, "error": error}, default=repr) + "\n")
+            except OSError as e:
+                log.error("Could not write the dead-letter file %s: %s", self.dead_letter, e)
+        return len(rows) - len(dead)
+
+    def stats(self):
+        """Queue depth, throughput and flush latency for diagnostics."""
+        with self._cond:
+            depth = len(self._rows)
+            oldest = self._oldest
+        return {
+            "enabled": self.enabled,
+            "depth": depth,
+            "max_depth": self.max_depth,
+            "capacity": self.max_rows,
+            "oldest_age_ms": (time.monotonic() - oldest) * 1000 if oldest else None,
+            "enqueued": self.enqueued,
+            "rejected": self.rejected,
+            "flushed": self.flushed,
+            "failed": self.failed,
+            "flushes": self.flushes,
+            "flush_ms": {
+                "last": self.last_flush_ms,
+                "avg": self._flush_total_ms / self.flushes if self.flushes else None,
+                "max": self.max_flush_ms if self.flushes else None
+            }
+        }
+
+    # — writer thread —
+
+    def start(self):
+        """Start the writer thread (idempotent; submit() calls it)."""
+        if self._thread is not None or not self.enabled:
+            return
+        with self._cond:
+            if self._thread is not None:
+                return
+            self._running = True
+            self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """Stop the writer thread and flush whatever is still queued."""
+        thread = self._thread
+        if thread is not None:
+            with self._cond:
+                self._running = False
+                self._cond.notify_all()
+            thread.join(timeout=10)
+            self._thread = None
+        self.flush()
+
+    def _run(self):
+        interval = self.flush_interval_ms / 1000
+        while True:
+            with self._cond:
+                while self._running:
+                    if len(self._rows) >= self.flush_rows:
+                        break
+                    if self._oldest is not None:
+                        wait = self._oldest + interval - time.monotonic()
+                        if wait <= 0:
+                            break
+                    else:
+                        wait = None
+                    self._cond.wait(wait)
+                if not self._running:
+                    return
+            self.flush()
+
+# Shared instance, configured under storage.write_behind in config.yaml
+writer = WriteBehind(**((cfg.get('storage') or {}).get('write_behind') or {}))
+
+registry.gauge('growlab_write_behind_depth', "Samples waiting in the write-behind queue.",
+               collect=lambda: {(): writer.stats()["depth"]})